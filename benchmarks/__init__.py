@@ -0,0 +1,13 @@
+"""
+Benchmarks for the MP3 Tag Editor
+
+Run from the repository root:
+    python -m benchmarks.run --files 2000
+"""
+import os
+import sys
+
+# Make the application modules importable, as the launcher script does
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
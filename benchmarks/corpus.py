@@ -0,0 +1,237 @@
+"""
+Synthetic MP3 corpus generator for the benchmarks
+
+The generated files are tiny but valid MPEG-1 Layer III streams with the
+tag layouts found in real libraries. Tags are built byte by byte, so the
+same parameters always produce identical files.
+"""
+import os
+import json
+import random
+import struct
+
+# MPEG-1 Layer III, 128 kbit/s, 44.1 kHz, no padding: 417 bytes per frame
+MPEG_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+# Name of the file describing a generated corpus
+MANIFEST_FILE = "corpus.json"
+
+# Version of the generator; corpora of other versions are regenerated
+GENERATOR_VERSION = 1
+
+# Files per album directory
+FILES_PER_DIRECTORY = 12
+
+# Share of each kind of file in a corpus
+VARIANT_WEIGHTS = {
+    "v2": 40,  # ID3v2.3 only
+    "both": 15,  # ID3v2.3 and ID3v1
+    "v1": 10,  # ID3v1.1 only
+    "none": 5,  # No tags
+    "art": 5,  # ID3v2.3 with a large embedded picture
+    "gbk": 7,  # Legacy code pages declared as Latin-1
+    "big5": 6,
+    "shift_jis": 6,
+    "cp1251": 6,
+}
+
+# Sample text for the legacy code page variants: titles, artists, albums
+LEGACY_TEXT = {
+    "gbk": (["月亮代表我的心", "甜蜜蜜", "青花瓷", "晴天", "稻香"],
+            ["邓丽君", "周杰伦", "王菲"],
+            ["经典老歌", "叶惠美", "我很忙"]),
+    "big5": (["愛你一萬年", "聽海", "後來", "月亮代表我的心"],
+             ["張惠妹", "劉若英", "鄧麗君"],
+             ["精選輯", "我等你", "歌聲"]),
+    "shift_jis": (["夜に駆ける", "さくら", "千本桜", "初恋"],
+                  ["宇多田ヒカル", "美空ひばり", "米津玄師"],
+                  ["ベスト", "初恋", "歌謡曲"]),
+    "cp1251": (["Группа крови", "Звезда по имени Солнце", "Последний герой", "Город золотой"],
+               ["Кино", "Аквариум", "ДДТ"],
+               ["Группа крови", "Черный альбом", "Радио Африка"]),
+}
+
+GENRES = ["Rock", "Pop", "Jazz", "Classical", "Electronic", "Folk"]
+
+def _syncsafe(value):
+    """Encode an integer as a 4-byte ID3v2 synchsafe integer"""
+    return bytes([(value >> 21) & 0x7f, (value >> 14) & 0x7f, (value >> 7) & 0x7f, value & 0x7f])
+
+def _text_frame(frame_id, text, codec=None):
+    """
+    Build an ID3v2.3 text frame
+    
+    Args:
+        frame_id: Four-character frame ID
+        text: Frame text
+        codec: Legacy code page to encode the text with while declaring it
+            Latin-1, as old taggers did; None picks Latin-1 or UTF-16
+    
+    Returns:
+        bytes: The frame
+    """
+    if codec is not None:
+        data = b"\x00" + text.encode(codec)
+    else:
+        try:
+            data = b"\x00" + text.encode('latin-1')
+        except UnicodeEncodeError:
+            data = b"\x01" + text.encode('utf-16')
+    return frame_id.encode('ascii') + struct.pack(">I", len(data)) + b"\x00\x00" + data
+
+def _picture_frame(image):
+    """Build an ID3v2.3 APIC frame holding a front cover"""
+    data = b"\x00image/jpeg\x00\x03\x00" + image
+    return b"APIC" + struct.pack(">I", len(data)) + b"\x00\x00" + data
+
+def build_id3v2(fields, codec=None, image=None, padding=1024):
+    """
+    Build an ID3v2.3 tag
+    
+    Args:
+        fields: Dictionary with title, artist, album, year and genre
+        codec: Legacy code page for the text frames, if any
+        image: Picture data for an APIC frame, if any
+        padding: Number of padding bytes after the frames
+    
+    Returns:
+        bytes: The tag
+    """
+    frames = b"".join([
+        _text_frame("TIT2", fields["title"], codec),
+        _text_frame("TPE1", fields["artist"], codec),
+        _text_frame("TALB", fields["album"], codec),
+        _text_frame("TYER", fields["year"]),
+        _text_frame("TCON", fields["genre"]),
+    ])
+    if image is not None:
+        frames += _picture_frame(image)
+    
+    return b"ID3\x03\x00\x00" + _syncsafe(len(frames) + padding) + frames + b"\x00" * padding
+
+def build_id3v1(fields, track):
+    """
+    Build an ID3v1.1 tag
+    
+    Args:
+        fields: Dictionary with title, artist, album, year and genre
+        track: Track number
+    
+    Returns:
+        bytes: The 128-byte tag
+    """
+    def text(value, size):
+        return value.encode('latin-1', 'replace')[:size].ljust(size, b"\x00")
+    
+    genre = GENRES.index(fields["genre"]) if fields["genre"] in GENRES else 255
+    return (b"TAG" + text(fields["title"], 30) + text(fields["artist"], 30) + text(fields["album"], 30)
+            + text(fields["year"], 4) + b"\x00" * 28 + bytes([0, track % 256, genre]))
+
+def _pick_variant(rng, variants):
+    """Pick a variant according to its weight"""
+    names = sorted(variants)
+    return rng.choices(names, weights=[variants[name] for name in names])[0]
+
+def _fields(rng, index, variant):
+    """Make up the tag values of a file"""
+    if variant in LEGACY_TEXT:
+        titles, artists, albums = LEGACY_TEXT[variant]
+        title = f"{rng.choice(titles)} {index}"
+        artist = rng.choice(artists)
+        album = rng.choice(albums)
+    else:
+        artist_number = rng.randrange(500)
+        title = f"Track {index}"
+        artist = f"Artist {artist_number}"
+        album = f"Album {artist_number}-{rng.randrange(8)}"
+    
+    return {"title": title, "artist": artist, "album": album,
+            "year": str(rng.randrange(1960, 2025)), "genre": rng.choice(GENRES)}
+
+def generate_corpus(root, files=1000, seed=0, frames_per_file=20, art_size=256 * 1024,
+                    variants=None):
+    """
+    Generate a corpus, or reuse one generated with the same parameters
+    
+    Args:
+        root: Directory to generate the corpus in
+        files: Number of MP3 files
+        seed: Seed of the random generator
+        frames_per_file: Number of MPEG frames in each file
+        art_size: Size of the embedded picture of the "art" variant
+        variants: Weights of the variants (defaults to VARIANT_WEIGHTS)
+    
+    Returns:
+        dict: The corpus manifest, with the parameters, the number of files
+            per variant and the total size in bytes
+    """
+    variants = dict(variants or VARIANT_WEIGHTS)
+    params = {"generator": GENERATOR_VERSION, "files": files, "seed": seed,
+              "frames_per_file": frames_per_file, "art_size": art_size, "variants": variants}
+    
+    manifest_path = os.path.join(root, MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest["params"] == params:
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    rng = random.Random(seed)
+    audio = MPEG_FRAME * frames_per_file
+    image = bytes(rng.getrandbits(8) for _ in range(art_size)) if art_size else None
+    counts = dict.fromkeys(variants, 0)
+    total_bytes = 0
+    
+    for index in range(files):
+        variant = _pick_variant(rng, variants)
+        fields = _fields(rng, index, variant)
+        counts[variant] += 1
+        
+        tag = b""
+        if variant in ("v2", "both"):
+            tag = build_id3v2(fields)
+        elif variant == "art":
+            tag = build_id3v2(fields, image=image)
+        elif variant in LEGACY_TEXT:
+            tag = build_id3v2(fields, codec=variant)
+        
+        v1 = build_id3v1(fields, index % FILES_PER_DIRECTORY + 1) if variant in ("v1", "both") else b""
+        
+        directory = os.path.join(root, f"artist{index // (FILES_PER_DIRECTORY * 10):04d}",
+                                 f"album{index // FILES_PER_DIRECTORY:05d}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"track{index % FILES_PER_DIRECTORY + 1:02d}.mp3"), 'wb') as f:
+            f.write(tag + audio + v1)
+        total_bytes += len(tag) + len(audio) + len(v1)
+    
+    manifest = {"params": params, "counts": counts, "bytes": total_bytes}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def legacy_samples(count, seed=0):
+    """
+    Make up tag values as they look after reading legacy code page tags
+    
+    The text is encoded with a legacy code page and decoded as Latin-1, as
+    mutagen returns frames that declare Latin-1.
+    
+    Args:
+        count: Number of tag dictionaries
+        seed: Seed of the random generator
+    
+    Returns:
+        list: Tag dictionaries
+    """
+    rng = random.Random(seed)
+    codecs = sorted(LEGACY_TEXT)
+    samples = []
+    
+    for index in range(count):
+        codec = codecs[index % len(codecs)]
+        fields = _fields(rng, index, codec)
+        samples.append({key: value.encode(codec).decode('latin-1') if key in ("title", "artist", "album")
+                        else value for key, value in fields.items()})
+    return samples
@@ -0,0 +1,269 @@
+"""
+Run the benchmarks and compare them against a baseline
+
+Usage:
+    python -m benchmarks.run [--files N] [--output results.json] [--baseline baseline.json]
+
+Every benchmark runs in a fresh process, so the peak RSS of one doesn't
+include the others and caches start cold. The results are written as JSON;
+given a baseline from an earlier run, throughput that dropped or peak RSS
+that grew by more than the tolerance is reported as a regression and the
+exit code is 1.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.corpus import generate_corpus, legacy_samples
+
+BENCHMARKS = ["scan", "read", "detect", "save"]
+
+# Version of the results format
+RESULTS_VERSION = 1
+
+def _peak_rss_mb():
+    """Get the peak resident set size of this process in MB, or None if unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None  # Not available on Windows
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _list_files(root):
+    """List the corpus files without timing it"""
+    from utils.file_utils import get_mp3_files
+    return sorted(get_mp3_files(root, True))
+
+def bench_scan(root, files):
+    """Find the MP3 files of the corpus"""
+    from utils.file_utils import get_mp3_files
+    
+    start = time.perf_counter()
+    found = get_mp3_files(root, True)
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "files": len(found), "bytes_read": 0, "bytes_written": 0}
+
+def bench_read(root, files):
+    """Process the tags of every file, one after another"""
+    from tag_processor.processor import TagProcessor
+    
+    file_paths = _list_files(root)
+    tag_processor = TagProcessor()
+    
+    start = time.perf_counter()
+    for file_path in file_paths:
+        tag_processor.process_file(file_path)
+    seconds = time.perf_counter() - start
+    
+    return {"seconds": seconds, "files": len(file_paths),
+            "bytes_read": tag_processor.store.total_bytes_read(), "bytes_written": 0,
+            "encoding": tag_processor.encoding_stats}
+
+def bench_detect(root, files):
+    """Convert the encodings of legacy code page tags"""
+    from tag_processor.processor import TagProcessor
+    
+    samples = legacy_samples(files)
+    tag_processor = TagProcessor()
+    
+    start = time.perf_counter()
+    for tag_info in samples:
+        tag_processor._convert_encodings(dict(tag_info))
+    seconds = time.perf_counter() - start
+    
+    return {"seconds": seconds, "files": len(samples), "bytes_read": 0, "bytes_written": 0,
+            "encoding": tag_processor.encoding_stats}
+
+def bench_save(root, files):
+    """Change the title of every file and save it, on a copy of the corpus"""
+    from tag_processor.processor import TagProcessor
+    
+    work_dir = tempfile.mkdtemp(prefix="mp3tagedit-bench-")
+    try:
+        copy_root = os.path.join(work_dir, "corpus")
+        shutil.copytree(root, copy_root)
+        file_paths = _list_files(copy_root)
+        
+        tag_processor = TagProcessor()
+        for file_path in file_paths:
+            tag_info = tag_processor.process_file(file_path)
+            if tag_info is not None:
+                tag_processor.set_tag(file_path, "title", f"{tag_info.get('title', '')} (edited)")
+        
+        start = time.perf_counter()
+        for file_path in file_paths:
+            if file_path in tag_processor.processed_files:
+                tag_processor.save_changes(file_path)
+        seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    return {"seconds": seconds, "files": len(file_paths), "bytes_read": 0,
+            "bytes_written": tag_processor.write_stats["bytes_written"], "writes": tag_processor.write_stats}
+
+def _run_benchmark(name, root, files):
+    """Run one benchmark (in a child process) and add the derived figures"""
+    import benchmarks  # Puts the application modules on the path in spawned children
+    
+    result = globals()["bench_" + name](root, files)
+    seconds = max(result["seconds"], 1e-9)
+    result["files_per_sec"] = result["files"] / seconds
+    result["mb_read"] = result.pop("bytes_read") / 1e6
+    result["mb_written"] = result.pop("bytes_written") / 1e6
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+def run_benchmarks(root, files, names, repeat=3):
+    """
+    Run benchmarks, each in a fresh process
+    
+    Args:
+        root: Corpus directory
+        files: Number of files in the corpus
+        names: Benchmarks to run
+        repeat: Number of runs of each benchmark; the fastest is kept
+    
+    Returns:
+        dict: Results by benchmark name
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    
+    for name in names:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(_run_benchmark, name, root, files).result())
+        
+        best = max(runs, key=lambda run: run["files_per_sec"])
+        peaks = [run["peak_rss_mb"] for run in runs if run["peak_rss_mb"] is not None]
+        best["peak_rss_mb"] = max(peaks) if peaks else None
+        best["runs"] = repeat
+        results[name] = best
+    
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a baseline
+    
+    Args:
+        results: Results of this run
+        baseline: Results of an earlier run
+        tolerance: Allowed relative change, e.g. 0.15 for 15%
+    
+    Returns:
+        list: Descriptions of the regressions
+    """
+    regressions = []
+    
+    for name, result in results["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        
+        if result["files_per_sec"] < base["files_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['files_per_sec']:.0f} files/s, "
+                               f"baseline {base['files_per_sec']:.0f} files/s")
+        
+        if result["peak_rss_mb"] and base.get("peak_rss_mb") and \
+                result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {result['peak_rss_mb']:.1f} MB, "
+                               f"baseline {base['peak_rss_mb']:.1f} MB")
+    
+    if baseline.get("corpus", {}).get("params") != results["corpus"]["params"]:
+        print("Warning: the baseline was measured on a different corpus", file=sys.stderr)
+    
+    return regressions
+
+def build_parser():
+    """
+    Build the argument parser of the benchmark runner
+    
+    Returns:
+        argparse.ArgumentParser: The argument parser
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run",
+                                     description="Benchmark scanning, reading, encoding detection and saving.")
+    parser.add_argument("--files", type=int, default=1000, help="Number of files in the corpus (default: 1000)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus generator (default: 0)")
+    parser.add_argument("--frames", type=int, default=20, help="MPEG frames per file (default: 20)")
+    parser.add_argument("--art-size", type=int, default=256 * 1024, metavar="BYTES",
+                        help="Size of embedded pictures (default: 256 KiB)")
+    parser.add_argument("--corpus", metavar="DIR",
+                        help="Keep the corpus in DIR and reuse it on later runs (default: temporary)")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS),
+                        help=f"Comma separated benchmarks to run (default: {','.join(BENCHMARKS)})")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the fastest counts (default: 3)")
+    parser.add_argument("--output", metavar="FILE", help="Write the results to FILE instead of stdout")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare against the results in FILE")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Allowed relative slowdown or memory growth (default: 0.15)")
+    return parser
+
+def main(argv=None):
+    """
+    Entry point of the benchmark runner
+    
+    Returns:
+        int: 0 on success, 1 if a regression was found, 2 for invalid arguments
+    """
+    args = build_parser().parse_args(argv)
+    names = [name.strip() for name in args.benchmarks.split(",") if name.strip()]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    
+    root = args.corpus or tempfile.mkdtemp(prefix="mp3tagedit-corpus-")
+    try:
+        start = time.perf_counter()
+        manifest = generate_corpus(root, args.files, args.seed, args.frames, args.art_size)
+        print(f"Corpus of {args.files} files ({manifest['bytes'] / 1e6:.1f} MB) ready in "
+              f"{time.perf_counter() - start:.1f}s", file=sys.stderr)
+        
+        results = {
+            "version": RESULTS_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": manifest,
+            "results": run_benchmarks(root, args.files, names, max(1, args.repeat)),
+        }
+    finally:
+        if not args.corpus:
+            shutil.rmtree(root, ignore_errors=True)
+    
+    for name, result in results["results"].items():
+        rss = f"{result['peak_rss_mb']:.1f} MB" if result["peak_rss_mb"] is not None else "n/a"
+        print(f"{name:8} {result['files_per_sec']:10.0f} files/s  {result['mb_read']:8.1f} MB read  "
+              f"{result['mb_written']:8.1f} MB written  peak RSS {rss}", file=sys.stderr)
+    
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,712 @@
+"""
+Headless batch command line interface for the MP3 Tag Editor
+
+Usage:
+    mp3tagedit.py batch scan PATH [PATH ...]
+    mp3tagedit.py batch process PATH [PATH ...]
+    mp3tagedit.py batch save [--resume] PATH [PATH ...]
+    mp3tagedit.py batch duplicates PATH [PATH ...]
+    mp3tagedit.py batch export --output FILE PATH [PATH ...]
+    mp3tagedit.py batch import FILE
+    mp3tagedit.py batch recover [--rollback]
+
+Every command writes one JSON object per line to stdout. Each object has an
+"event" key ("file", "result", "edit", "saved", "restored", "duplicates", "error",
+"progress", "retry", "metrics" or "summary").
+Diagnostics are written to stderr so stdout stays machine readable.
+
+This module must never import PyQt6, so it can run on machines without a
+display and starts without paying Qt's import cost.
+
+Exit codes:
+    0: all files were handled successfully
+    1: at least one file failed
+    2: invalid command line arguments
+    3: no MP3 files were found
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from contextlib import redirect_stdout
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+EXIT_NO_FILES = 3
+
+class JsonLineWriter:
+    """Write events as JSON lines to a stream"""
+    
+    def __init__(self, stream):
+        self.stream = stream
+    
+    def emit(self, event, **fields):
+        """
+        Write a single event
+        
+        Args:
+            event (str): Event name
+            **fields: Additional fields for the event
+        """
+        record = {"event": event}
+        record.update(fields)
+        self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.stream.flush()
+
+def iter_input_files(paths, recursive=True):
+    """
+    Expand the command line paths into MP3 file paths
+    
+    Args:
+        paths (list): Files and/or directories given on the command line
+        recursive (bool): Whether to search directories recursively
+    
+    Yields:
+        str: Path to an MP3 file
+    """
+    from utils.file_utils import iter_mp3_files
+    
+    for path in paths:
+        if os.path.isdir(path):
+            for file_path in iter_mp3_files(path, recursive):
+                yield file_path
+        elif path.lower().endswith('.mp3'):
+            yield path
+
+def build_parser():
+    """
+    Build the argument parser for the batch command
+    
+    Returns:
+        argparse.ArgumentParser: The argument parser
+    """
+    parser = argparse.ArgumentParser(
+        prog="mp3tagedit.py batch",
+        description="Process MP3 tags without starting the GUI."
+    )
+    parser.add_argument("command", choices=["scan", "process", "save", "recover", "duplicates", "export",
+                                            "import"],
+                        help="scan: list MP3 files, process: read and normalize tags, "
+                             "save: process tags and write them back, "
+                             "recover: finish or roll back interrupted saves, "
+                             "duplicates: find files with identical audio, "
+                             "export: write the tags to a JSON lines or CSV file, "
+                             "import: write the values changed in an exported file back to the files")
+    parser.add_argument("paths", nargs="*", metavar="PATH",
+                        help="MP3 files or directories to search (import: the file to import)")
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false",
+                        help="Do not search directories recursively")
+    parser.add_argument("--workers", type=int, default=0, metavar="N",
+                        help="Number of worker processes (default: one per CPU core)")
+    parser.add_argument("--stream-info", action="store_true",
+                        help="Also read the audio length and bitrate (scans the audio frames)")
+    parser.add_argument("--detect-per-file", action="store_true",
+                        help="Detect the encoding once per file instead of once per field")
+    parser.add_argument("--padding", type=int, default=4096, metavar="BYTES",
+                        help="Padding added when a file has to be rewritten (default: 4096)")
+    parser.add_argument("--max-padding", type=int, default=1048576, metavar="BYTES",
+                        help="Leftover padding above this is reclaimed by rewriting (default: 1 MiB)")
+    parser.add_argument("--threads", type=int, default=4, metavar="N",
+                        help="Number of files written (or hashed) at the same time (default: 4)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="process/save: stream files through reading, decoding and saving while "
+                             "scanning, with bounded memory use (progress events have no total)")
+    parser.add_argument("--fields", metavar="LIST",
+                        help="process/save: only read these comma-separated fields, e.g. genre,year "
+                             "(default: all); the frames of other fields are not decoded")
+    parser.add_argument("--rules", metavar="FILE",
+                        help="process/save: apply the bulk edit rules in FILE (a JSON list, as saved by "
+                             "the GUI's Bulk Edit dialog) to the processed tags")
+    parser.add_argument("--set-artwork", metavar="IMAGE",
+                        help="process/save: replace the front cover with IMAGE (JPEG, PNG or GIF)")
+    parser.add_argument("--strip-artwork", action="store_true",
+                        help="process/save: remove all embedded pictures")
+    parser.add_argument("--resize-artwork", type=int, metavar="PIXELS",
+                        help="process/save: shrink embedded pictures (or the image of --set-artwork) "
+                             "to fit into PIXELS x PIXELS; needs the optional Pillow package")
+    parser.add_argument("--output", metavar="FILE",
+                        help="export: file the tags are written to")
+    parser.add_argument("--format", choices=["jsonl", "csv"],
+                        help="export/import: file format (default: csv for .csv files, otherwise jsonl)")
+    parser.add_argument("--resume", action="store_true",
+                        help="process/save/import: skip the files an interrupted run of the same command and "
+                             "paths finished, as recorded in its checkpoint")
+    parser.add_argument("--checkpoint-interval", type=float, default=5.0, metavar="SECONDS",
+                        help="process/save/import: seconds between two checkpoints of the progress (default: 5)")
+    parser.add_argument("--retries", type=int, default=3, metavar="N",
+                        help="process/save: retry failed files up to N times (default: 3)")
+    parser.add_argument("--retry-delay", type=float, default=1.0, metavar="SECONDS",
+                        help="process/save: wait before the first retry, doubled for every further "
+                             "retry (default: 1)")
+    parser.add_argument("--rollback", action="store_true",
+                        help="recover: restore the original tags instead of finishing the save")
+    parser.add_argument("--spill-to-disk", action="store_true",
+                        help="Keep processed tags in a temporary database instead of memory")
+    parser.add_argument("--no-cache", dest="cache", action="store_false",
+                        help="Do not use or update the persistent tag cache and audio hash index")
+    parser.add_argument("--progress-every", type=int, default=100, metavar="N",
+                        help="Emit a progress event every N files (0 disables, default: 100)")
+    parser.add_argument("--metrics-file", metavar="FILE",
+                        help="Also write the per-stage timings to FILE as JSON")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile the run with cProfile (saved under ~/.mp3tagedit/profiles)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Record the largest memory allocations (saved under ~/.mp3tagedit/profiles)")
+    return parser
+
+def emit_metrics(args, writer):
+    """Emit the per-stage timings and write them to the metrics file if one was given"""
+    from utils.instrumentation import get_metrics
+    
+    report = get_metrics().report()
+    writer.emit("metrics", **report)
+    
+    if args.metrics_file:
+        try:
+            with open(args.metrics_file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+        except OSError as e:
+            print(f"Error writing metrics file {args.metrics_file}: {e}")
+
+def parse_fields(value):
+    """
+    Parse the value of --fields
+    
+    Args:
+        value (str): Comma-separated fields, or None
+    
+    Returns:
+        list: Fields, or None for all fields
+    
+    Raises:
+        ValueError: If a field is unknown
+    """
+    from tag_processor.processor import ALL_FIELDS
+    
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in ALL_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown field {unknown[0]} (known fields: {', '.join(ALL_FIELDS)})")
+    return fields
+
+def run_scan(args, writer):
+    """Emit every MP3 file found in the given paths"""
+    count = 0
+    for file_path in iter_input_files(args.paths, args.recursive):
+        writer.emit("file", path=file_path)
+        count += 1
+    
+    emit_metrics(args, writer)
+    writer.emit("summary", command="scan", files=count)
+    return EXIT_OK if count else EXIT_NO_FILES
+
+def run_process(args, writer, save=False):
+    """Process the tags of every MP3 file, optionally saving them"""
+    from tag_processor.processor import TagProcessor, TXXX_PREFIX
+    from tag_processor.tag_cache import open_tag_cache
+    from tag_processor.tag_writer import TagWriter
+    from tag_processor.bulk_save import BulkSaver
+    from tag_processor.tag_store import create_tag_store
+    from tag_processor.checkpoint import RunCheckpoint
+    
+    try:
+        fields = parse_fields(args.fields)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return EXIT_USAGE
+    
+    rule_set = None
+    if args.rules:
+        from tag_processor.rules import RuleSet
+        
+        try:
+            rule_set = RuleSet.load(args.rules)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return EXIT_USAGE
+        
+        # Fields that aren't read would look empty to the rules
+        missing = []
+        if fields is not None:
+            missing = sorted(field for field in rule_set.fields if field not in fields and
+                             not (field.startswith(TXXX_PREFIX) and "txxx" in fields))
+        if missing:
+            print(f"Error: the rules use fields that --fields leaves out: {', '.join(missing)}")
+            return EXIT_USAGE
+    
+    artwork = None
+    if args.set_artwork and args.strip_artwork:
+        print("Error: --set-artwork and --strip-artwork can't be combined")
+        return EXIT_USAGE
+    if args.resize_artwork is not None and args.resize_artwork < 1:
+        print("Error: --resize-artwork must be at least 1")
+        return EXIT_USAGE
+    if args.resize_artwork:
+        from tag_processor.artwork import can_scale_images
+        
+        # Checked before any file is touched rather than failing every save
+        if not can_scale_images():
+            print("Error: --resize-artwork needs the Pillow package (pip install Pillow)")
+            return EXIT_USAGE
+    if args.set_artwork:
+        from tag_processor.artwork import image_mime, scale_image
+        
+        try:
+            with open(args.set_artwork, 'rb') as f:
+                artwork = f.read()
+        except OSError as e:
+            print(f"Error reading {args.set_artwork}: {e}")
+            return EXIT_USAGE
+        artwork_mime = image_mime(artwork)
+        if artwork_mime is None:
+            print(f"Error: {args.set_artwork} is not a JPEG, PNG or GIF image")
+            return EXIT_USAGE
+        
+        # Scaled once here instead of for every file
+        if args.resize_artwork:
+            scaled = scale_image(artwork, args.resize_artwork)
+            if scaled is not None:
+                artwork, artwork_mime = scaled
+    
+    if args.retries < 0 or args.retry_delay < 0 or args.checkpoint_interval < 0:
+        print("Error: --retries, --retry-delay and --checkpoint-interval can't be negative")
+        return EXIT_USAGE
+    
+    if args.pipeline:
+        mp3_files = iter_input_files(args.paths, args.recursive)
+        total = None
+    else:
+        mp3_files = list(iter_input_files(args.paths, args.recursive))
+        total = len(mp3_files)
+        
+        if not total:
+            emit_metrics(args, writer)
+            writer.emit("summary", command=args.command, files=0, processed=0, failed=0)
+            return EXIT_NO_FILES
+    
+    cache = open_tag_cache() if args.cache else None
+    tag_processor = TagProcessor(read_stream_info=args.stream_info, cache=cache,
+                                 detect_per_file=args.detect_per_file,
+                                 tag_writer=TagWriter(args.padding, args.max_padding),
+                                 tag_store=create_tag_store(args.spill_to_disk), fields=fields)
+    
+    # A resumed run should do the same to its remaining files; a mismatch is reported
+    options = {"fields": fields, "rules": args.rules and os.path.abspath(args.rules),
+               "set_artwork": args.set_artwork and os.path.abspath(args.set_artwork),
+               "strip_artwork": args.strip_artwork, "resize_artwork": args.resize_artwork}
+    checkpoint = RunCheckpoint.open(args.command, args.paths, args.recursive, options, args.resume,
+                                    interval=args.checkpoint_interval)
+    if args.resume and not checkpoint.resumed:
+        print("No checkpoint of an earlier run of this command; starting from the beginning")
+    checkpoint.total = total
+    mp3_files = checkpoint.remaining(mp3_files)
+    if not args.pipeline:
+        mp3_files = list(mp3_files)
+    
+    processed_count = 0
+    handled_count = 0
+    edit_count = 0
+    artwork_count = 0
+    failed = {}  # file path -> stage, for the files that failed in this run
+    retry = 0  # Number of the retry pass, 0 for the first pass
+    
+    def apply_rules(file_paths):
+        nonlocal edit_count
+        for change in rule_set.apply(tag_processor, file_paths):
+            edit_count += 1
+            writer.emit("edit", path=change.path, field=change.field, old=change.old, new=change.new)
+    
+    def change_artwork(file_path):
+        nonlocal artwork_count
+        if artwork is not None:
+            tag_processor.set_artwork([file_path], artwork, artwork_mime)
+        elif args.strip_artwork:
+            tag_processor.strip_artwork([file_path])
+        elif args.resize_artwork:
+            tag_processor.resize_artwork([file_path], args.resize_artwork)
+        else:
+            return
+        artwork_count += 1
+    
+    def on_result(file_path, tag_info):
+        nonlocal processed_count, handled_count
+        bytes_read = tag_processor.store.bytes_read(file_path)
+        attempt = {"retry": retry} if retry else {}
+        
+        if tag_info is None:
+            failed[file_path] = "process"
+            writer.emit("error", path=file_path, stage="process", error="Could not read tags",
+                        bytes_read=bytes_read, **attempt)
+            checkpoint.mark_failed(file_path, "process", "Could not read tags")
+        else:
+            # A file that failed to save was counted when it was processed
+            if failed.pop(file_path, None) != "save":
+                processed_count += 1
+            writer.emit("result", path=file_path, tags=tag_info, bytes_read=bytes_read, **attempt)
+            if rule_set is not None and args.pipeline:
+                # Before the file is queued for saving
+                apply_rules([file_path])
+            change_artwork(file_path)
+            if not save:
+                checkpoint.mark_done(file_path)
+        
+        if not retry:
+            handled_count += 1
+            done = checkpoint.skipped + handled_count
+            if args.progress_every and (handled_count % args.progress_every == 0 or done == total):
+                writer.emit("progress", done=done, total=total)
+    
+    def on_saved(file_path, result, error):
+        attempt = {"retry": retry} if retry else {}
+        if error is None:
+            writer.emit("saved", path=file_path, **result, **attempt)
+            checkpoint.mark_done(file_path)
+        else:
+            failed[file_path] = "save"
+            writer.emit("error", path=file_path, stage="save", error=error, **attempt)
+            checkpoint.mark_failed(file_path, "save", error)
+    
+    def run_files(file_paths):
+        for file_path, tag_info in tag_processor.process_files(file_paths, workers=args.workers):
+            on_result(file_path, tag_info)
+        processed_paths = [file_path for file_path in file_paths if file_path in tag_processor.store]
+        
+        if rule_set is not None:
+            # One pass over each column of all files
+            apply_rules(processed_paths)
+        
+        if save:
+            # Write concurrently once all tags are known; an interrupted save is journaled
+            saver = BulkSaver(tag_processor, args.threads)
+            for file_path, result, error in saver.save(processed_paths):
+                on_saved(file_path, result, error)
+    
+    complete = False
+    try:
+        if args.pipeline:
+            from tag_processor.pipeline import TagPipeline
+            
+            # Files are saved while later ones are still being found, then dropped from memory
+            pipeline = TagPipeline(tag_processor, decode_workers=args.workers, write_threads=args.threads,
+                                   save=save, discard=True)
+            pipeline.run(mp3_files, on_result, on_saved)
+            total = checkpoint.total = pipeline.files + checkpoint.skipped
+        else:
+            run_files(mp3_files)
+        
+        # Failures are often passing, e.g. a network share that went away for a moment
+        while failed and retry < args.retries:
+            retry += 1
+            delay = args.retry_delay * 2 ** (retry - 1)
+            writer.emit("retry", retry=retry, files=len(failed), delay=delay)
+            checkpoint.checkpoint(force=True)
+            time.sleep(delay)
+            run_files(list(failed))
+        complete = True
+    finally:
+        # An interrupted run keeps its checkpoint, as does one with failures
+        checkpoint.close(complete)
+    
+    summary = {"encoding": tag_processor.encoding_stats}
+    if checkpoint.resumed:
+        summary["resumed"] = checkpoint.skipped
+    if retry:
+        summary["retries"] = retry
+    if failed:
+        summary["checkpoint"] = checkpoint.run_dir
+    if rule_set is not None:
+        summary["edits"] = edit_count
+    if artwork_count:
+        summary["artwork_changes"] = artwork_count
+    if save:
+        summary["saved"] = tag_processor.write_stats
+    if cache is not None:
+        summary["cache"] = cache.stats()
+    bytes_read = tag_processor.store.total_bytes_read()
+    tag_processor.close()
+    
+    emit_metrics(args, writer)
+    writer.emit("summary", command=args.command, files=total, processed=processed_count,
+                failed=len(failed), bytes_read=bytes_read, **summary)
+    if not total:
+        return EXIT_NO_FILES
+    return EXIT_FAILURES if failed else EXIT_OK
+
+def run_duplicates(args, writer):
+    """Emit every group of files with identical audio"""
+    from tag_processor.duplicates import DuplicateFinder, open_audio_hash_index
+    
+    index = open_audio_hash_index() if args.cache else None
+    finder = DuplicateFinder(index, threads=args.threads)
+    groups = finder.find(iter_input_files(args.paths, args.recursive))
+    
+    for group in groups:
+        writer.emit("duplicates", **group)
+    
+    stats = finder.stats
+    summary = {}
+    if index is not None:
+        summary["index"] = index.stats()
+        index.close()
+    
+    emit_metrics(args, writer)
+    writer.emit("summary", command="duplicates", files=stats["files"], groups=len(groups),
+                duplicates=sum(len(group["files"]) - 1 for group in groups), failed=stats["errors"],
+                bytes_read=stats["bytes_read"], quick_hashed=stats["quick_hashed"],
+                full_hashed=stats["full_hashed"], **summary)
+    if not stats["files"]:
+        return EXIT_NO_FILES
+    return EXIT_FAILURES if stats["errors"] else EXIT_OK
+
+def run_export(args, writer):
+    """Write the tags of every MP3 file to a JSON lines or CSV file"""
+    from tag_processor.processor import TagProcessor
+    from tag_processor.tag_cache import open_tag_cache
+    from tag_processor.tag_store import create_tag_store
+    from tag_processor.pipeline import TagPipeline
+    from tag_processor.tag_io import TagExporter, guess_format, csv_columns
+    
+    if not args.output:
+        print("Error: the export command needs --output FILE")
+        return EXIT_USAGE
+    try:
+        fields = parse_fields(args.fields)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return EXIT_USAGE
+    
+    file_format = args.format or guess_format(args.output)
+    try:
+        output = open(args.output, 'w', encoding='utf-8', newline='')
+    except OSError as e:
+        print(f"Error writing {args.output}: {e}")
+        return EXIT_USAGE
+    
+    cache = open_tag_cache() if args.cache else None
+    tag_processor = TagProcessor(read_stream_info=args.stream_info, cache=cache,
+                                 detect_per_file=args.detect_per_file,
+                                 tag_store=create_tag_store(args.spill_to_disk), fields=fields)
+    exporter = TagExporter(output, file_format, csv_columns(fields, args.stream_info))
+    failed_count = 0
+    
+    def on_result(file_path, tag_info):
+        nonlocal failed_count
+        if tag_info is None:
+            failed_count += 1
+            writer.emit("error", path=file_path, stage="process", error="Could not read tags")
+        else:
+            exporter.write(file_path, tag_info)
+        
+        done = exporter.count + failed_count
+        if args.progress_every and done % args.progress_every == 0:
+            writer.emit("progress", done=done, total=None)
+    
+    # Files are written as they are read, then dropped from memory
+    pipeline = TagPipeline(tag_processor, decode_workers=args.workers, discard=True)
+    with output:
+        pipeline.run(iter_input_files(args.paths, args.recursive), on_result)
+    
+    summary = {"encoding": tag_processor.encoding_stats}
+    if cache is not None:
+        summary["cache"] = cache.stats()
+    bytes_read = tag_processor.store.total_bytes_read()
+    tag_processor.close()
+    
+    emit_metrics(args, writer)
+    writer.emit("summary", command="export", files=pipeline.files, exported=exporter.count,
+                failed=failed_count, bytes_read=bytes_read, output=args.output, format=file_format, **summary)
+    if not pipeline.files:
+        return EXIT_NO_FILES
+    return EXIT_FAILURES if failed_count else EXIT_OK
+
+def run_import(args, writer):
+    """Write the values changed in an exported file back to the files"""
+    from tag_processor.processor import TagProcessor
+    from tag_processor.tag_cache import open_tag_cache
+    from tag_processor.tag_writer import TagWriter
+    from tag_processor.tag_store import create_tag_store
+    from tag_processor.checkpoint import RunCheckpoint
+    from tag_processor.tag_io import TagImporter, guess_format, read_rows
+    
+    if len(args.paths) != 1:
+        print("Error: the import command takes a single FILE")
+        return EXIT_USAGE
+    if args.checkpoint_interval < 0:
+        print("Error: --checkpoint-interval can't be negative")
+        return EXIT_USAGE
+    
+    import_file = args.paths[0]
+    file_format = args.format or guess_format(import_file)
+    try:
+        # Spreadsheets often save CSV files with a byte order mark
+        rows_file = open(import_file, 'r', encoding='utf-8-sig', newline='')
+    except OSError as e:
+        print(f"Error reading {import_file}: {e}")
+        return EXIT_USAGE
+    
+    checkpoint = RunCheckpoint.open("import", [import_file], False, {"format": file_format}, args.resume,
+                                    interval=args.checkpoint_interval)
+    if args.resume and not checkpoint.resumed:
+        print("No checkpoint of an earlier run of this command; starting from the beginning")
+    
+    cache = open_tag_cache() if args.cache else None
+    tag_processor = TagProcessor(cache=cache, detect_per_file=args.detect_per_file,
+                                 tag_writer=TagWriter(args.padding, args.max_padding),
+                                 tag_store=create_tag_store(args.spill_to_disk))
+    importer = TagImporter(tag_processor, workers=args.workers, concurrency=args.threads)
+    file_count = 0
+    edit_count = 0
+    failed_count = 0
+    
+    def pending_rows(rows):
+        for row in rows:
+            if row.error is None and checkpoint.is_done(row.path):
+                checkpoint.skipped += 1
+            else:
+                yield row
+    
+    def handled():
+        nonlocal file_count
+        file_count += 1
+        if args.progress_every and file_count % args.progress_every == 0:
+            writer.emit("progress", done=file_count + checkpoint.skipped, total=None)
+    
+    def on_edit(change):
+        nonlocal edit_count
+        edit_count += 1
+        writer.emit("edit", path=change.path, field=change.field, old=change.old, new=change.new)
+    
+    def on_saved(file_path, result, error):
+        nonlocal failed_count
+        if error is None:
+            writer.emit("saved", path=file_path, **result)
+            checkpoint.mark_done(file_path)
+        else:
+            failed_count += 1
+            writer.emit("error", path=file_path, stage="save", error=error)
+            checkpoint.mark_failed(file_path, "save", error)
+        handled()
+    
+    def on_error(file_path, stage, error):
+        nonlocal failed_count
+        failed_count += 1
+        writer.emit("error", path=file_path, stage=stage, error=error)
+        if stage == "process":
+            checkpoint.mark_failed(file_path, stage, error)
+            handled()
+    
+    complete = False
+    try:
+        with rows_file:
+            importer.run(pending_rows(read_rows(rows_file, file_format)), on_edit, on_saved, on_error)
+        complete = True
+    except ValueError as e:
+        print(f"Error reading {import_file}: {e}")
+        failed_count += 1
+    finally:
+        # An interrupted import keeps its checkpoint, as does one with failures
+        checkpoint.close(complete)
+    
+    summary = {"saved": tag_processor.write_stats}
+    if checkpoint.resumed:
+        summary["resumed"] = checkpoint.skipped
+    if cache is not None:
+        summary["cache"] = cache.stats()
+    tag_processor.close()
+    
+    emit_metrics(args, writer)
+    writer.emit("summary", command="import", files=file_count, edits=edit_count, failed=failed_count,
+                **summary)
+    if failed_count:
+        return EXIT_FAILURES
+    return EXIT_OK if file_count or checkpoint.skipped else EXIT_NO_FILES
+
+def run_recover(args, writer):
+    """Finish or roll back every interrupted save"""
+    from tag_processor.processor import TagProcessor
+    from tag_processor.tag_cache import open_tag_cache
+    from tag_processor.tag_writer import TagWriter
+    from tag_processor.bulk_save import BulkSaver, find_interrupted_runs
+    
+    runs = find_interrupted_runs()
+    cache = open_tag_cache() if args.cache else None
+    tag_processor = TagProcessor(cache=cache, tag_writer=TagWriter(args.padding, args.max_padding))
+    saver = BulkSaver(tag_processor, args.threads)
+    file_count = 0
+    failed_count = 0
+    restored_count = 0
+    
+    for run_dir in runs:
+        results = saver.rollback(run_dir) if args.rollback else saver.resume(run_dir)
+        for file_path, result, error in results:
+            file_count += 1
+            if error is not None:
+                failed_count += 1
+                writer.emit("error", path=file_path, stage="recover", error=error)
+            elif args.rollback:
+                restored_count += result["status"] == "restored"
+                writer.emit("restored", path=file_path, **result)
+            else:
+                writer.emit("saved", path=file_path, **result)
+    
+    tag_processor.close()
+    
+    summary = {"restored": restored_count} if args.rollback else {"saved": tag_processor.write_stats}
+    emit_metrics(args, writer)
+    writer.emit("summary", command="recover", runs=len(runs), files=file_count, failed=failed_count,
+                **summary)
+    return EXIT_FAILURES if failed_count else EXIT_OK
+
+def batch_main(argv=None):
+    """
+    Entry point for the batch command
+    
+    Args:
+        argv (list): Arguments following "batch" (defaults to sys.argv[2:])
+    
+    Returns:
+        int: Process exit code
+    """
+    if argv is None:
+        argv = sys.argv[2:]
+    
+    parser = build_parser()
+    try:
+        args = parser.parse_args(argv)
+        if args.command != "recover" and not args.paths:
+            parser.error(f"the {args.command} command needs at least one PATH")
+    except SystemExit as e:
+        return EXIT_OK if e.code == 0 else EXIT_USAGE
+    
+    from utils.instrumentation import profiling
+    
+    writer = JsonLineWriter(sys.stdout)
+    
+    # The tag processor reports problems with print(); keep them off stdout
+    try:
+        with redirect_stdout(sys.stderr):
+            with profiling(args.profile, args.trace_memory, label=f"batch-{args.command}") as written:
+                if args.command == "scan":
+                    exit_code = run_scan(args, writer)
+                elif args.command == "recover":
+                    exit_code = run_recover(args, writer)
+                elif args.command == "duplicates":
+                    exit_code = run_duplicates(args, writer)
+                elif args.command == "export":
+                    exit_code = run_export(args, writer)
+                elif args.command == "import":
+                    exit_code = run_import(args, writer)
+                else:
+                    exit_code = run_process(args, writer, save=args.command == "save")
+            for path in written:
+                print(f"Profile written to {path}")
+            return exit_code
+    except BrokenPipeError:
+        # The reader went away (e.g. output piped into head); silence the final flush
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        return EXIT_FAILURES
@@ -0,0 +1,80 @@
+"""
+Duplicates dialog for the MP3 Tag Editor application
+"""
+import os
+from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel,
+                             QPushButton, QTreeWidget, QTreeWidgetItem, QHeaderView)
+from PyQt6.QtCore import Qt, pyqtSignal
+from utils.file_utils import format_size
+
+class DuplicatesDialog(QDialog):
+    """Shows groups of files with identical audio, one expandable entry per group"""
+    
+    # Emitted with the path of a file that was double-clicked
+    file_activated = pyqtSignal(str)
+    
+    def __init__(self, groups, tag_store, parent=None):
+        """
+        Args:
+            groups: Groups found by DuplicateFinder.find
+            tag_store: TagStore whose tags are shown next to processed files
+            parent: Parent widget
+        """
+        super().__init__(parent)
+        self.setWindowTitle("Duplicate Tracks")
+        self.resize(700, 450)
+        
+        self.groups = groups
+        self.tag_store = tag_store
+        self.init_ui()
+    
+    def init_ui(self):
+        """Initialize the user interface"""
+        layout = QVBoxLayout(self)
+        
+        duplicate_count = sum(len(group["files"]) - 1 for group in self.groups)
+        if self.groups:
+            summary = (f"{len(self.groups)} recordings are stored more than once "
+                       f"({duplicate_count} duplicate files). Double-click a file to select it in the table.")
+        else:
+            summary = "No files with identical audio were found."
+        layout.addWidget(QLabel(summary))
+        
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["File", "Title", "Artist", "Album"])
+        self.tree.header().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.tree.itemDoubleClicked.connect(self.on_item_double_clicked)
+        
+        for group in self.groups:
+            group_item = QTreeWidgetItem([f"{len(group['files'])} files, "
+                                          f"{format_size(group['audio_size'])} of audio"])
+            
+            for file_path in group["files"]:
+                tag_info = self.tag_store.get(file_path) or {}
+                file_item = QTreeWidgetItem([os.path.basename(file_path), tag_info.get("title", ""),
+                                             tag_info.get("artist", ""), tag_info.get("album", "")])
+                file_item.setToolTip(0, file_path)
+                file_item.setData(0, Qt.ItemDataRole.UserRole, file_path)
+                group_item.addChild(file_item)
+            
+            self.tree.addTopLevelItem(group_item)
+            group_item.setExpanded(True)
+        
+        layout.addWidget(self.tree)
+        
+        # Button layout
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        
+        # Close button
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(self.accept)
+        button_layout.addWidget(close_button)
+        
+        layout.addLayout(button_layout)
+    
+    def on_item_double_clicked(self, item, column):
+        """Select a double-clicked file in the main window"""
+        file_path = item.data(0, Qt.ItemDataRole.UserRole)
+        if file_path:
+            self.file_activated.emit(file_path)
@@ -0,0 +1,48 @@
+"""
+Image scaling with Qt's image readers, used for artwork in the GUI
+"""
+from PyQt6.QtCore import QBuffer, QByteArray, QIODevice, Qt
+from PyQt6.QtGui import QImageReader
+
+def qt_scale_image(data, max_size, quality):
+    """
+    Shrink an image to fit into a square, see artwork.scale_image
+    
+    JPEG images are decoded at a reduced size, so large pictures are
+    scaled without decoding them in full. Qt's image readers need neither
+    a display nor a QApplication.
+    
+    Args:
+        data: Image bytes, e.g. the data of an APIC frame
+        max_size: Maximum width and height in pixels
+        quality: JPEG quality of the scaled image
+    
+    Returns:
+        tuple: (image bytes, MIME type); data itself if the image already
+            fits. None if the data isn't an image Qt can read.
+    """
+    source = QBuffer()
+    source.setData(QByteArray(data))
+    source.open(QIODevice.OpenModeFlag.ReadOnly)
+    reader = QImageReader(source)
+    size = reader.size()
+    image_format = bytes(reader.format()).decode('ascii', 'replace').lower()
+    if not size.isValid() or not image_format:
+        return None
+    
+    if size.width() <= max_size and size.height() <= max_size:
+        return data, "image/" + ("jpeg" if image_format == "jpg" else image_format)
+    
+    reader.setScaledSize(size.scaled(max_size, max_size, Qt.AspectRatioMode.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        return None
+    
+    # Transparency would be lost in a JPEG
+    output_format = "PNG" if image.hasAlphaChannel() else "JPEG"
+    output = QByteArray()
+    target = QBuffer(output)
+    target.open(QIODevice.OpenModeFlag.WriteOnly)
+    if not image.save(target, output_format, quality):
+        return None
+    return bytes(output), "image/" + output_format.lower()
@@ -3,16 +3,21 @@ Main window for the MP3 Tag Editor application
 """
 import os
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                            QPushButton, QTableWidget, QTableWidgetItem, 
+                            QPushButton, QTableView, QLineEdit,
                             QFileDialog, QMessageBox, QLabel, QHeaderView,
                             QCheckBox, QSpinBox, QProgressBar, QMenuBar, QMenu)
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QIcon, QAction, QColor
-from tag_processor.processor import TagProcessor
-from utils.file_utils import get_music_folder, get_sample_mp3_files
-from utils.config import load_config, save_config, get_config_value, set_config_value
-from gui.about_dialog import AboutDialog
-from gui.settings_dialog import SettingsDialog
+from PyQt6.QtCore import Qt, QThread, QSize, QTimer
+from PyQt6.QtGui import QIcon, QAction
+from tag_processor.bulk_save import find_interrupted_runs
+from tag_processor.search_index import SearchIndex
+from tag_processor.tag_store import create_tag_store
+from utils.file_utils import get_music_folder, get_sample_mp3_files, format_size
+from utils.config import get_config
+from utils.instrumentation import get_metrics
+from gui.tag_table_model import TagTableModel, TAG_KEYS
+
+# Size at which artwork thumbnails are shown in the table
+THUMBNAIL_ICON_SIZE = 32
 
 class MainWindow(QMainWindow):
     """Main window for the MP3 Tag Editor application"""
@@ -22,19 +27,58 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("MP3 Tag Editor")
         
         # Load configuration
-        self.config = load_config()
+        self.config = get_config()
         
         # Set window size from config
         width = self.config.get("window_width", 800)
         height = self.config.get("window_height", 600)
         self.resize(width, height)
         
-        self.tag_processor = TagProcessor()
+        # The tag processor is created on first use; see the tag_processor property
+        self.tag_store = create_tag_store(self.config.get("tag_store_spill_to_disk", False))
+        self._tag_processor = None
         self.mp3_files = []
-        self.processed_data = {}  # Store processed data for each file
+        self.file_rows = {}  # Map file paths to their table rows
+        self.search_index = SearchIndex()  # Words of the loaded files, for the search box
+        self.worker = None
+        self.worker_thread = None
+        self.thumbnail_worker = None  # Started when the first thumbnail is needed
+        self.thumbnail_thread = None
         
         self.init_ui()
         self.create_menu_bar()
+        
+        if find_interrupted_runs():
+            self.status_label.setText("An earlier save was interrupted. Use 'File > Recover Interrupted Save' "
+                                      "to finish it or roll it back.")
+    
+    @property
+    def tag_processor(self):
+        """
+        The tag processor, created on first use
+        
+        Creating it loads mutagen and opens the tag cache, which is put off
+        until files are loaded so the window appears sooner.
+        """
+        if self._tag_processor is None:
+            from tag_processor.artwork import set_image_scaler
+            from tag_processor.processor import TagProcessor
+            from tag_processor.tag_cache import open_tag_cache
+            from tag_processor.tag_writer import TagWriter
+            from gui.image_scaling import qt_scale_image
+            
+            # New artwork is scaled with Qt, so the GUI doesn't need Pillow
+            set_image_scaler(qt_scale_image)
+            cache = None
+            if self.config.get("tag_cache_enabled", True):
+                cache = open_tag_cache(self.config.get("tag_cache_max_entries", 1000000))
+            self._tag_processor = TagProcessor(read_stream_info=self.config.get("read_stream_info", False),
+                                               cache=cache,
+                                               detect_per_file=self.config.get("detect_encoding_per_file", False),
+                                               tag_writer=TagWriter(self.config.get("tag_padding", 4096),
+                                                                    self.config.get("tag_max_padding", 1048576)),
+                                               tag_store=self.tag_store)
+        return self._tag_processor
     
     def init_ui(self):
         """Initialize the user interface"""
@@ -64,6 +108,11 @@ class MainWindow(QMainWindow):
         self.save_button.setEnabled(False)
         button_layout.addWidget(self.save_button)
         
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_worker)
+        self.cancel_button.setVisible(False)
+        button_layout.addWidget(self.cancel_button)
+        
         main_layout.addLayout(button_layout)
         
         # Sample options layout
@@ -95,14 +144,29 @@ class MainWindow(QMainWindow):
         self.progress_bar.setVisible(False)
         main_layout.addWidget(self.progress_bar)
         
+        # Search box; the table only shows the files matching the query
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Search, e.g. beatles help or artist:beatles year:<1970 genre:rock")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self.filter_files)
+        main_layout.addWidget(self.search_edit)
+        
         # Table for displaying MP3 files and their tags
-        self.files_table = QTableWidget()
-        self.files_table.setColumnCount(7)
-        self.files_table.setHorizontalHeaderLabels(["Filename", "Title", "Artist", "Album", "Year", "Genre", "Track#"])
+        # The model renders rows on demand, so large libraries don't allocate per-cell items
+        self.table_model = TagTableModel(self.tag_store, self)
+        self.files_table = QTableView()
+        self.files_table.setModel(self.table_model)
         self.files_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
         
-        # Make cells editable except for the filename column
-        self.files_table.itemChanged.connect(self.on_table_item_changed)
+        # Fixed row heights avoid measuring every row
+        self.files_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        
+        # Thumbnails of the artwork are loaded in the background as rows are drawn
+        self.table_model.thumbnail_requested.connect(self.request_thumbnail)
+        self.set_show_artwork(self.config.get("show_artwork", True))
+        
+        # Cells are editable except for the filename column
+        self.table_model.tag_edited.connect(self.on_table_item_changed)
         
         main_layout.addWidget(self.files_table)
         
@@ -134,6 +198,11 @@ class MainWindow(QMainWindow):
         settings_action.triggered.connect(self.show_settings_dialog)
         file_menu.addAction(settings_action)
         
+        # Recover action
+        recover_action = QAction("&Recover Interrupted Save...", self)
+        recover_action.triggered.connect(self.recover_interrupted_save)
+        file_menu.addAction(recover_action)
+        
         file_menu.addSeparator()
         
         # Exit action
@@ -157,6 +226,29 @@ class MainWindow(QMainWindow):
         save_action.triggered.connect(self.save_changes)
         edit_menu.addAction(save_action)
         
+        edit_menu.addSeparator()
+        
+        # Bulk edit action
+        bulk_edit_action = QAction("&Bulk Edit...", self)
+        bulk_edit_action.setShortcut("Ctrl+B")
+        bulk_edit_action.triggered.connect(self.bulk_edit)
+        edit_menu.addAction(bulk_edit_action)
+        
+        # Artwork actions
+        set_artwork_action = QAction("Set &Artwork...", self)
+        set_artwork_action.triggered.connect(self.set_artwork)
+        edit_menu.addAction(set_artwork_action)
+        
+        remove_artwork_action = QAction("&Remove Artwork", self)
+        remove_artwork_action.triggered.connect(self.remove_artwork)
+        edit_menu.addAction(remove_artwork_action)
+        
+        # Duplicates action
+        duplicates_action = QAction("Find &Duplicates...", self)
+        duplicates_action.setShortcut("Ctrl+D")
+        duplicates_action.triggered.connect(self.find_duplicates)
+        edit_menu.addAction(duplicates_action)
+        
         # Help menu
         help_menu = menu_bar.addMenu("&Help")
         
@@ -167,26 +259,44 @@ class MainWindow(QMainWindow):
     
     def show_about_dialog(self):
         """Show the about dialog"""
+        from gui.about_dialog import AboutDialog
+        
         dialog = AboutDialog(self)
         dialog.exec()
     
     def show_settings_dialog(self):
         """Show the settings dialog"""
+        from gui.settings_dialog import SettingsDialog
+        
         dialog = SettingsDialog(self)
         if dialog.exec():
-            # Reload configuration
-            self.config = load_config()
-            
             # Update UI with new configuration
             self.sample_size_spin.setValue(self.config.get("sample_size", 10))
             self.recursive_checkbox.setChecked(self.config.get("recursive_search", True))
+            self.set_show_artwork(self.config.get("show_artwork", True))
     
     def closeEvent(self, event):
         """Handle window close event"""
+        # Stop any background work before the window goes away
+        if self.worker_thread is not None:
+            self.worker.cancel()
+            self.worker_thread.quit()
+            self.worker_thread.wait()
+        
+        if self.thumbnail_thread is not None:
+            self.thumbnail_worker.stop()
+            self.thumbnail_thread.quit()
+            self.thumbnail_thread.wait()
+        
+        if self._tag_processor is not None:
+            self._tag_processor.close()
+        else:
+            self.tag_store.close()
+        
         # Save window size
         self.config["window_width"] = self.width()
         self.config["window_height"] = self.height()
-        save_config(self.config)
+        self.config.flush()
         
         event.accept()
     
@@ -208,7 +318,6 @@ class MainWindow(QMainWindow):
             if self.mp3_files:
                 last_dir = os.path.dirname(self.mp3_files[0])
                 self.config["last_directory"] = last_dir
-                save_config(self.config)
             
             self.status_label.setText(f"Loaded {len(self.mp3_files)} MP3 files.")
             self.process_button.setEnabled(True)
@@ -234,10 +343,9 @@ class MainWindow(QMainWindow):
         sample_size = self.sample_size_spin.value()
         recursive = self.recursive_checkbox.isChecked()
         
-        # Update config with current values
+        # Update config with current values; unchanged values aren't written
         self.config["sample_size"] = sample_size
         self.config["recursive_search"] = recursive
-        save_config(self.config)
         
         # Get sample MP3 files
         self.mp3_files = get_sample_mp3_files(music_folder, sample_size, recursive)
@@ -260,28 +368,74 @@ class MainWindow(QMainWindow):
     
     def display_files(self):
         """Display the loaded MP3 files in the table"""
-        # Disconnect the itemChanged signal to prevent triggering while populating
-        self.files_table.itemChanged.disconnect(self.on_table_item_changed)
-        
-        self.files_table.setRowCount(len(self.mp3_files))
-        
-        for row, file_path in enumerate(self.mp3_files):
-            # Display filename
-            filename = file_path.split("/")[-1]
-            filename_item = QTableWidgetItem(filename)
-            filename_item.setFlags(filename_item.flags() & ~Qt.ItemFlag.ItemIsEditable)  # Make filename non-editable
-            self.files_table.setItem(row, 0, filename_item)
+        # Tag columns will be filled after processing; tags of previous files are dropped
+        self.tag_store.clear()
+        if self.thumbnail_worker is not None:
+            self.thumbnail_worker.clear()
+        self.table_model.set_files(self.mp3_files)
+        self.search_index.reset(self.mp3_files)
+        self.file_rows = {file_path: row for row, file_path in enumerate(self.mp3_files)}
+        self.filter_files()
+    
+    def filter_files(self):
+        """Show only the files matching the search box"""
+        query = self.search_edit.text()
+        rows = self.search_index.search(query)
+        self.table_model.set_filter(rows)
+        
+        if rows is None:
+            self.statusBar().clearMessage()
+        else:
+            self.statusBar().showMessage(f"{len(rows)} of {len(self.mp3_files)} files match '{query}'.")
+    
+    def set_show_artwork(self, show):
+        """
+        Show or hide the artwork thumbnails in the table
+        
+        Args:
+            show (bool): Whether thumbnails are shown
+        """
+        self.table_model.show_artwork = show
+        if show:
+            self.files_table.setIconSize(QSize(THUMBNAIL_ICON_SIZE, THUMBNAIL_ICON_SIZE))
+            header = self.files_table.verticalHeader()
+            header.setDefaultSectionSize(max(header.defaultSectionSize(), THUMBNAIL_ICON_SIZE + 4))
+        self.table_model.clear_thumbnails()
+    
+    def request_thumbnail(self, file_path):
+        """Load the thumbnail of a file drawn in the table in the background"""
+        if self.thumbnail_worker is None:
+            from gui.image_scaling import qt_scale_image
+            from gui.workers import ThumbnailWorker
+            from tag_processor.artwork import open_thumbnail_cache, set_image_scaler
             
-            # Other columns will be filled after processing
-            for col in range(1, 7):
-                self.files_table.setItem(row, col, QTableWidgetItem(""))
-        
-        # Reconnect the itemChanged signal
-        self.files_table.itemChanged.connect(self.on_table_item_changed)
+            set_image_scaler(qt_scale_image)
+            cache = open_thumbnail_cache(self.config.get("thumbnail_cache_max_mb", 64) * 1024 * 1024)
+            if cache is None:
+                self.table_model.show_artwork = False
+                return
+            
+            # Runs until the window is closed, next to the other workers
+            self.thumbnail_worker = ThumbnailWorker(cache)
+            self.thumbnail_thread = QThread(self)
+            self.thumbnail_worker.moveToThread(self.thumbnail_thread)
+            self.thumbnail_thread.started.connect(self.thumbnail_worker.run)
+            self.thumbnail_worker.thumbnail_ready.connect(self.on_thumbnail_ready)
+            self.thumbnail_thread.start()
+        
+        dropped = self.thumbnail_worker.request(file_path)
+        if dropped:
+            self.table_model.forget_requests(self.file_rows[path] for path in dropped if path in self.file_rows)
+    
+    def on_thumbnail_ready(self, file_path, image):
+        """Show a thumbnail made in the background"""
+        row = self.file_rows.get(file_path)
+        if row is not None:
+            self.table_model.set_thumbnail(row, image)
     
     def process_tags(self):
-        """Process the tags of the loaded MP3 files"""
-        if not self.mp3_files:
+        """Process the tags of the loaded MP3 files in the background"""
+        if not self.mp3_files or self.worker_thread is not None:
             return
         
         self.status_label.setText("Processing tags...")
@@ -289,79 +443,141 @@ class MainWindow(QMainWindow):
         self.progress_bar.setRange(0, len(self.mp3_files))
         self.progress_bar.setValue(0)
         
-        # Disconnect the itemChanged signal to prevent triggering while populating
-        self.files_table.itemChanged.disconnect(self.on_table_item_changed)
-        
-        # Process each file
-        for row, file_path in enumerate(self.mp3_files):
-            try:
-                tag_info = self.tag_processor.process_file(file_path)
-                
-                # Store processed data
-                self.processed_data[file_path] = tag_info
-                
-                # Update table with tag information
-                if tag_info:
-                    self.update_table_cell(row, 1, tag_info.get("title", ""))
-                    self.update_table_cell(row, 2, tag_info.get("artist", ""))
-                    self.update_table_cell(row, 3, tag_info.get("album", ""))
-                    self.update_table_cell(row, 4, str(tag_info.get("year", "")))
-                    self.update_table_cell(row, 5, tag_info.get("genre", ""))
-                    self.update_table_cell(row, 6, tag_info.get("track", ""))
-            except Exception as e:
-                print(f"Error processing {file_path}: {e}")
-            
-            self.progress_bar.setValue(row + 1)
+        # Results arrive in completion order, so map them back to their rows
+        self.file_rows = {file_path: row for row, file_path in enumerate(self.mp3_files)}
+        self.search_index.reset(self.mp3_files)  # Tags are indexed again as they arrive
+        workers = self.config.get("worker_processes", 0)
         
-        # Reconnect the itemChanged signal
-        self.files_table.itemChanged.connect(self.on_table_item_changed)
+        from gui.workers import ProcessWorker
         
-        self.status_label.setText(f"Processed {len(self.mp3_files)} files. You can edit tags directly in the table. Click 'Save Changes' to apply.")
-        self.save_button.setEnabled(True)
-        self.progress_bar.setVisible(False)
-
-    def update_table_cell(self, row, col, new_value):
-        """Update a table cell and highlight it if the value has changed"""
-        item = self.files_table.item(row, col)
-        if item is None:
-            item = QTableWidgetItem()
-            self.files_table.setItem(row, col, item)
-        
-        # Check if the value has changed
-        if item.text() != new_value:
-            item.setText(new_value)
-            item.setBackground(QColor("yellow"))  # Highlight changed cells
+        worker = ProcessWorker(self.tag_processor, self.mp3_files, workers)
+        worker.results_ready.connect(self.on_process_results)
+        worker.finished.connect(self.on_process_finished)
+        self.start_worker(worker)
+    
+    def on_process_results(self, results):
+        """Fill the table rows of a batch of processed files"""
+        rows = []
+        indexed = []
+        for file_path, tag_info in results:
+            row = self.file_rows.get(file_path)
+            if row is not None and tag_info:
+                rows.append(row)
+                indexed.append((row, tag_info))
+        
+        self.search_index.add(indexed)
+        if self.search_edit.text():
+            # Newly processed files may match the search
+            self.filter_files()
+        
+        # Update table with tag information
+        self.table_model.update_rows(rows)
+    
+    def on_process_finished(self, cancelled):
+        """Handle the end of tag processing"""
+        processed_count = len(self.tag_store)
+        
+        if cancelled:
+            self.status_label.setText(f"Processing cancelled after {processed_count} files.")
         else:
-            item.setBackground(QColor("white"))  # Reset background for unchanged cells
-
-    def on_table_item_changed(self, item):
-        """Handle changes to table items"""
-        row = item.row()
-        col = item.column()
+            self.status_label.setText(f"Processed {processed_count} files. You can edit tags directly in the table. Click 'Save Changes' to apply.")
         
-        if col == 0 or row >= len(self.mp3_files):
-            return  # Ignore changes to filename column or invalid rows
+        self.save_button.setEnabled(processed_count > 0)
+    
+    def start_worker(self, worker):
+        """
+        Run a worker on a background thread
+        
+        Args:
+            worker: TagWorker to run
+        """
+        self.worker = worker
+        self.worker_thread = QThread(self)
+        worker.moveToThread(self.worker_thread)
+        
+        # Time this run on its own; profiling is opt-in through the config
+        get_metrics().reset()
+        worker.profile_cpu = self.config.get("profile_cpu", False)
+        worker.profile_memory = self.config.get("profile_memory", False)
+        
+        self.worker_thread.started.connect(worker.run)
+        worker.progress.connect(self.progress_bar.setValue)
+        worker.finished.connect(self.on_worker_finished)
+        
+        self.set_busy(True)
+        self.worker_thread.start()
+    
+    def on_worker_finished(self):
+        """Clean up after a background worker has finished"""
+        self.worker_thread.quit()
+        self.worker_thread.wait()
+        self.worker_thread.deleteLater()
+        self.worker.deleteLater()
+        self.worker_thread = None
+        self.worker = None
+        
+        self.progress_bar.setVisible(False)
+        self.set_busy(False)
+        
+        summary = get_metrics().summary()
+        if summary:
+            self.statusBar().showMessage(f"Time by stage: {summary}")
+    
+    def cancel_worker(self):
+        """Cancel the running background worker"""
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_button.setEnabled(False)
+            self.status_label.setText("Cancelling...")
+    
+    def set_busy(self, busy):
+        """
+        Enable or disable the controls while a background worker runs
+        
+        Args:
+            busy (bool): Whether a background worker is running
+        """
+        self.load_button.setEnabled(not busy)
+        self.sample_button.setEnabled(not busy)
+        self.process_button.setEnabled(not busy and bool(self.mp3_files))
+        self.save_button.setEnabled(not busy and bool(self.mp3_files) and len(self.tag_store) > 0)
+        self.cancel_button.setVisible(busy)
+        self.cancel_button.setEnabled(busy)
+        
+        # Edits made while a worker reads or saves the files would be lost or saved half-way
+        self.table_model.read_only = busy
+
+    def on_table_item_changed(self, row, col, value):
+        """Handle tags edited in the table"""
+        if row >= len(self.mp3_files):
+            return  # Ignore invalid rows
         
         file_path = self.mp3_files[row]
         
-        if file_path not in self.processed_data:
+        if file_path not in self.tag_store:
             return
         
-        # Update the processed data with the new value
-        tag_keys = ["title", "artist", "album", "year", "genre", "track"]
-        tag_key = tag_keys[col - 1]  # Adjust for filename column
+        # Update the tag processor's data, which marks the field for saving
+        tag_key = TAG_KEYS[col - 1]  # Adjust for filename column
+        old_value = self.tag_store[file_path].get(tag_key)
         
-        self.processed_data[file_path][tag_key] = item.text()
+        self.tag_processor.set_tag(file_path, tag_key, value)
         
-        # Update the tag processor's data
-        self.tag_processor.processed_files[file_path] = self.processed_data[file_path]
+        # The row stays visible until the search changes, even if it no longer matches
+        self.search_index.update([(row, tag_key, old_value, value)])
     
     def save_changes(self):
-        """Save the changes to the MP3 files"""
+        """Save the changes to the MP3 files in the background"""
+        if self.worker_thread is not None:
+            return
+        
+        dirty_count = sum(1 for file_path in self.mp3_files if self.tag_processor.is_dirty(file_path))
+        
         reply = QMessageBox.question(
             self, 
             "Confirm Changes",
-            f"Are you sure you want to save changes to {len(self.mp3_files)} files?",
+            f"Are you sure you want to save changes to {dirty_count} of {len(self.mp3_files)} files? "
+            "Files without changes will not be written.",
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
             QMessageBox.StandardButton.No
         )
@@ -372,21 +588,280 @@ class MainWindow(QMainWindow):
             self.progress_bar.setRange(0, len(self.mp3_files))
             self.progress_bar.setValue(0)
             
-            success_count = 0
-            for i, file_path in enumerate(self.mp3_files):
-                try:
-                    self.tag_processor.save_changes(file_path)
-                    success_count += 1
-                except Exception as e:
-                    print(f"Error saving changes to {file_path}: {e}")
-                
-                self.progress_bar.setValue(i + 1)
+            self.save_counts = {"in_place": 0, "rewritten": 0, "skipped": 0, "failed": 0, "bytes_written": 0}
             
-            self.status_label.setText(f"Successfully saved changes to {success_count} files.")
-            self.progress_bar.setVisible(False)
+            from gui.workers import SaveWorker
             
-            # Reset buttons
-            self.save_button.setEnabled(False)
-            self.process_button.setEnabled(False)
-            self.mp3_files = []
-            self.processed_data = {}
\ No newline at end of file
+            worker = SaveWorker(self.tag_processor, self.mp3_files, self.config.get("save_threads", 4))
+            worker.results_ready.connect(self.on_save_results)
+            worker.finished.connect(self.on_save_finished)
+            self.start_worker(worker)
+    
+    def on_save_results(self, results):
+        """Count a batch of saved files"""
+        for file_path, result, error in results:
+            if error is None:
+                self.save_counts[result["status"]] += 1
+                self.save_counts["bytes_written"] += result["bytes_written"]
+            else:
+                self.save_counts["failed"] += 1
+                print(f"Error saving changes to {file_path}: {error}")
+    
+    def on_save_finished(self, cancelled):
+        """Handle the end of saving"""
+        self.table_model.refresh()  # Saved fields are no longer highlighted
+        self.table_model.clear_thumbnails()  # Saved artwork is shown
+        counts = self.save_counts
+        summary = (f"{counts['in_place'] + counts['rewritten']} files written "
+                   f"({counts['in_place']} in place, {counts['rewritten']} rewritten), "
+                   f"{counts['skipped']} unchanged files skipped, "
+                   f"{format_size(counts['bytes_written'])} written")
+        if counts["failed"]:
+            summary += f", {counts['failed']} failed"
+        
+        if cancelled:
+            self.status_label.setText(f"Saving cancelled: {summary}.")
+            return
+        
+        # The files stay loaded, so they can be edited and saved again
+        self.status_label.setText(f"Saved changes: {summary}.")
+    
+    def bulk_edit(self):
+        """Edit the tags of all processed files with rules"""
+        if self.worker_thread is not None:
+            return
+        
+        file_paths = [file_path for file_path in self.mp3_files if file_path in self.tag_store]
+        if not file_paths:
+            QMessageBox.information(self, "Bulk Edit", "Process the tags of the files first.")
+            return
+        
+        from gui.rules_dialog import RulesDialog
+        
+        dialog = RulesDialog(self.tag_processor, file_paths, self)
+        if dialog.exec():
+            self.search_index.update((self.file_rows[change.path], change.field, change.old, change.new)
+                                     for change in dialog.changes)
+            self.filter_files()
+            self.table_model.refresh()  # Changed fields are highlighted until they are saved
+            self.status_label.setText(f"Bulk edit changed {len(dialog.changes)} values in "
+                                      f"{dialog.changes.file_count()} files. Save to write them.")
+            self.set_busy(False)
+    
+    def selected_files(self):
+        """
+        Get the processed files of the selected table rows
+        
+        Returns:
+            list: File paths, in table order
+        """
+        rows = sorted({index.row() for index in self.files_table.selectionModel().selectedIndexes()})
+        file_paths = [self.table_model.file_path(row) for row in rows]
+        return [file_path for file_path in file_paths if file_path in self.tag_store]
+    
+    def set_artwork(self):
+        """Replace the artwork of the selected files with an image file"""
+        if self.worker_thread is not None:
+            return
+        
+        file_paths = self.selected_files()
+        if not file_paths:
+            QMessageBox.information(self, "Set Artwork", "Select processed files in the table first.")
+            return
+        
+        image_path, _ = QFileDialog.getOpenFileName(self, "Choose Artwork", os.path.dirname(file_paths[0]),
+                                                    "Images (*.jpg *.jpeg *.png *.gif)")
+        if not image_path:
+            return
+        
+        try:
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            self.tag_processor.set_artwork(file_paths, data, max_size=self.config.get("artwork_max_size", 1000))
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Set Artwork", f"Could not use {os.path.basename(image_path)}: {e}")
+            return
+        
+        self.table_model.refresh()  # The file names are highlighted until the artwork is saved
+        self.status_label.setText(f"The artwork of {len(file_paths)} files will be replaced when you save.")
+        self.set_busy(False)
+    
+    def remove_artwork(self):
+        """Remove the artwork of the selected files"""
+        if self.worker_thread is not None:
+            return
+        
+        file_paths = self.selected_files()
+        if not file_paths:
+            QMessageBox.information(self, "Remove Artwork", "Select processed files in the table first.")
+            return
+        
+        self.tag_processor.strip_artwork(file_paths)
+        self.table_model.refresh()
+        self.status_label.setText(f"The artwork of {len(file_paths)} files will be removed when you save.")
+        self.set_busy(False)
+    
+    def find_duplicates(self):
+        """Find loaded files with identical audio in the background"""
+        if not self.mp3_files or self.worker_thread is not None:
+            return
+        
+        self.status_label.setText("Looking for duplicate tracks...")
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setRange(0, 0)  # Groups are only known once the files are hashed
+        self.duplicate_groups = []
+        
+        from gui.workers import DuplicatesWorker
+        
+        worker = DuplicatesWorker(self.tag_processor, self.mp3_files,
+                                  self.config.get("tag_cache_enabled", True),
+                                  self.config.get("save_threads", 4))
+        worker.results_ready.connect(self.duplicate_groups.extend)
+        worker.finished.connect(self.on_duplicates_finished)
+        self.start_worker(worker)
+    
+    def on_duplicates_finished(self, cancelled):
+        """Show the groups of duplicate files"""
+        if cancelled:
+            self.status_label.setText("Search for duplicate tracks cancelled.")
+            return
+        
+        duplicate_count = sum(len(group["files"]) - 1 for group in self.duplicate_groups)
+        self.status_label.setText(f"Found {duplicate_count} duplicate files in "
+                                  f"{len(self.duplicate_groups)} groups.")
+        
+        from gui.duplicates_dialog import DuplicatesDialog
+        
+        # Not modal, so files can be looked at in the table while the groups stay open
+        dialog = DuplicatesDialog(self.duplicate_groups, self.tag_store, self)
+        dialog.file_activated.connect(self.select_file)
+        dialog.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        dialog.show()
+    
+    def select_file(self, file_path):
+        """
+        Select and show the table row of a file
+        
+        Args:
+            file_path: Path to a loaded MP3 file
+        """
+        file_row = self.file_rows.get(file_path)
+        if file_row is None:
+            return
+        
+        row = self.table_model.view_row(file_row)
+        if row is None:
+            # Hidden by the search
+            self.search_edit.clear()
+            row = file_row
+        self.files_table.selectRow(row)
+        self.files_table.scrollTo(self.table_model.index(row, 0))
+    
+    def recover_interrupted_save(self):
+        """Resume or roll back the oldest interrupted save"""
+        if self.worker_thread is not None:
+            return
+        
+        runs = find_interrupted_runs()
+        if not runs:
+            QMessageBox.information(self, "Recover Interrupted Save", "No interrupted saves were found.")
+            return
+        
+        message_box = QMessageBox(self)
+        message_box.setWindowTitle("Recover Interrupted Save")
+        message_box.setText(f"A save of tags was interrupted ({len(runs)} interrupted in total). "
+                            "Resume it to write the remaining files, or roll it back to restore "
+                            "the original tags of the files it wrote.")
+        resume_button = message_box.addButton("Resume", QMessageBox.ButtonRole.AcceptRole)
+        rollback_button = message_box.addButton("Roll Back", QMessageBox.ButtonRole.DestructiveRole)
+        message_box.addButton(QMessageBox.StandardButton.Cancel)
+        message_box.exec()
+        
+        clicked = message_box.clickedButton()
+        if clicked not in (resume_button, rollback_button):
+            return
+        
+        rollback = clicked == rollback_button
+        self.status_label.setText("Rolling back interrupted save..." if rollback else "Resuming interrupted save...")
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setRange(0, 0)  # The number of files is only known to the worker
+        
+        self.save_counts = {"in_place": 0, "rewritten": 0, "skipped": 0, "restored": 0, "failed": 0,
+                            "bytes_written": 0}
+        
+        from gui.workers import RecoverWorker
+        
+        self.recovered_files = []
+        worker = RecoverWorker(self.tag_processor, runs[0], rollback, self.config.get("save_threads", 4))
+        worker.results_ready.connect(self.on_recover_results)
+        worker.finished.connect(self.on_recover_finished)
+        self.start_worker(worker)
+    
+    def on_recover_results(self, results):
+        """Count a batch of resumed or restored files and remember those shown in the table"""
+        self.on_save_results(results)
+        self.recovered_files.extend(file_path for file_path, result, error in results
+                                    if file_path in self.file_rows)
+    
+    def on_recover_finished(self, cancelled):
+        """Handle the end of resuming or rolling back a save"""
+        self.table_model.refresh()
+        self.table_model.clear_thumbnails()
+        counts = self.save_counts
+        summary = (f"{counts['in_place'] + counts['rewritten']} files written, "
+                   f"{counts['restored']} files restored, {counts['skipped']} unchanged files skipped")
+        if counts["failed"]:
+            summary += f", {counts['failed']} failed"
+        
+        if cancelled:
+            self.status_label.setText(f"Recovery cancelled: {summary}. It can be continued later.")
+        else:
+            self.status_label.setText(f"Recovered interrupted save: {summary}.")
+        
+        # The files written or restored no longer hold the tags loaded for them. The worker is only
+        # cleaned up after this, so read them again once it is
+        QTimer.singleShot(0, lambda: self.reload_files(self.recovered_files))
+    
+    def reload_files(self, file_paths):
+        """
+        Read loaded files again after their tags were changed on disk
+        
+        Unsaved edits of the files are applied again to the tags read.
+        
+        Args:
+            file_paths: Paths of the files; those that aren't loaded are skipped
+        """
+        file_paths = [file_path for file_path in dict.fromkeys(file_paths) if file_path in self.file_rows]
+        if not file_paths or self.worker_thread is not None:
+            return
+        
+        self.reload_edits = {}
+        for file_path in file_paths:
+            tag_info = self.tag_store.get(file_path)
+            if tag_info is not None:
+                edits = {field: tag_info[field] for field in self.tag_store.dirty_fields(file_path)
+                         if field in tag_info}
+                if edits:
+                    self.reload_edits[file_path] = edits
+                # The row is indexed again when its new tags arrive
+                row = self.file_rows[file_path]
+                self.search_index.update((row, field, value, None) for field, value in tag_info.items())
+            self.tag_store.discard(file_path)
+        
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setRange(0, len(file_paths))
+        self.progress_bar.setValue(0)
+        
+        from gui.workers import ProcessWorker
+        
+        worker = ProcessWorker(self.tag_processor, file_paths, self.config.get("worker_processes", 0))
+        worker.results_ready.connect(self.on_reload_results)
+        self.start_worker(worker)
+    
+    def on_reload_results(self, results):
+        """Apply the unsaved edits to a batch of files read again and show them"""
+        for file_path, tag_info in results:
+            edits = self.reload_edits.pop(file_path, None)
+            if edits and tag_info is not None:
+                self.tag_processor.set_tags((file_path, field, value) for field, value in edits.items())
+        self.on_process_results([(file_path, self.tag_store.get(file_path)) for file_path, _ in results])
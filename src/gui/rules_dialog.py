@@ -0,0 +1,372 @@
+"""
+Bulk edit dialog for the MP3 Tag Editor application
+"""
+import os
+import json
+from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QComboBox,
+                             QLineEdit, QCheckBox, QListWidget, QTableView, QHeaderView,
+                             QFileDialog, QMessageBox, QGroupBox, QFormLayout)
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+from tag_processor.rules import RuleSet, Preview, CASE_MODES
+
+# Operations offered by the dialog: op of RuleSet.from_dicts -> label
+OPERATIONS = {
+    "replace": "Find and replace",
+    "case": "Change case",
+    "trim": "Trim whitespace",
+    "set": "Set value",
+    "from_filename": "Fields from file name",
+}
+
+PREVIEW_HEADERS = ["File", "Field", "Old Value", "New Value"]
+
+def describe_rule(spec):
+    """
+    Describe a rule dictionary in a line of text
+    
+    Args:
+        spec: Rule dictionary as accepted by RuleSet.from_dicts
+    
+    Returns:
+        str: Description
+    """
+    op = spec["op"]
+    if op == "replace":
+        text = f"{spec['field']}: replace \"{spec['find']}\" with \"{spec.get('replace', '')}\""
+        if spec.get("regex"):
+            text += " (regex)"
+    elif op == "case":
+        text = f"{spec['field']}: {spec.get('mode', 'title')} case"
+    elif op == "trim":
+        text = f"{spec['field']}: trim whitespace"
+    elif op == "set":
+        text = f"{spec['field']}: set to \"{spec['value']}\""
+    elif op == "from_filename":
+        text = f"from file name: {spec['pattern']}"
+    else:
+        text = op
+    
+    condition = spec.get("if")
+    if condition:
+        verb = "doesn't match" if condition.get("negate") else "matches"
+        text += f", if {condition['field']} {verb} \"{condition['matches']}\""
+    return text
+
+class PreviewModel(QAbstractTableModel):
+    """Table model showing the changes of a rule set, one row per changed value"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._changes = Preview([], [])
+    
+    def set_changes(self, changes):
+        """
+        Replace the changes shown
+        
+        Args:
+            changes: Preview returned by RuleSet.preview
+        """
+        self.beginResetModel()
+        self._changes = changes
+        self.endResetModel()
+    
+    def rowCount(self, parent=QModelIndex()):
+        """Get the number of rows"""
+        if parent.isValid():
+            return 0
+        return len(self._changes)
+    
+    def columnCount(self, parent=QModelIndex()):
+        """Get the number of columns"""
+        if parent.isValid():
+            return 0
+        return len(PREVIEW_HEADERS)
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        """Get the column headers"""
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return PREVIEW_HEADERS[section]
+        return super().headerData(section, orientation, role)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        """Get the data of a cell; Change tuples are only created for the rows shown"""
+        if not index.isValid():
+            return None
+        
+        if role == Qt.ItemDataRole.DisplayRole:
+            change = self._changes[index.row()]
+            if index.column() == 0:
+                return os.path.basename(change.path)
+            return change[index.column()]
+        
+        if role == Qt.ItemDataRole.ToolTipRole and index.column() == 0:
+            return self._changes[index.row()].path
+        
+        return None
+
+class RulesDialog(QDialog):
+    """Builds a list of bulk edit rules, previews their changes and applies them"""
+    
+    def __init__(self, tag_processor, file_paths, parent=None):
+        """
+        Args:
+            tag_processor: TagProcessor holding the processed tags
+            file_paths: Files the rules are applied to
+            parent: Parent widget
+        """
+        super().__init__(parent)
+        self.setWindowTitle("Bulk Edit")
+        self.resize(800, 600)
+        
+        from tag_processor.processor import TAG_FRAMES, DESCRIBED_FRAMES
+        
+        self.tag_processor = tag_processor
+        self.file_paths = file_paths
+        self.fields = list(TAG_FRAMES) + list(DESCRIBED_FRAMES)
+        self.specs = []  # Rule dictionaries, in order
+        self.rule_set = None
+        self.changes = Preview([], [])
+        self.init_ui()
+        self.on_operation_changed()
+    
+    def init_ui(self):
+        """Initialize the user interface"""
+        layout = QVBoxLayout(self)
+        
+        # Rule builder
+        builder = QGroupBox("New rule")
+        form_layout = QFormLayout(builder)
+        
+        self.operation_combo = QComboBox()
+        for op, label in OPERATIONS.items():
+            self.operation_combo.addItem(label, op)
+        self.operation_combo.currentIndexChanged.connect(self.on_operation_changed)
+        form_layout.addRow("Operation:", self.operation_combo)
+        
+        self.field_combo = QComboBox()
+        self.field_combo.addItems(self.fields)
+        form_layout.addRow("Field:", self.field_combo)
+        
+        self.text_label = QLabel()
+        self.text_edit = QLineEdit()
+        form_layout.addRow(self.text_label, self.text_edit)
+        
+        self.replace_label = QLabel("Replace with:")
+        self.replace_edit = QLineEdit()
+        form_layout.addRow(self.replace_label, self.replace_edit)
+        
+        self.case_label = QLabel("Case:")
+        self.case_combo = QComboBox()
+        self.case_combo.addItems(CASE_MODES)
+        self.case_combo.setCurrentText("title")
+        form_layout.addRow(self.case_label, self.case_combo)
+        
+        self.options_label = QLabel("Options:")
+        options_layout = QHBoxLayout()
+        self.regex_checkbox = QCheckBox("Regular expression")
+        self.ignore_case_checkbox = QCheckBox("Ignore case")
+        options_layout.addWidget(self.regex_checkbox)
+        options_layout.addWidget(self.ignore_case_checkbox)
+        options_layout.addStretch()
+        form_layout.addRow(self.options_label, options_layout)
+        
+        # Condition
+        condition_layout = QHBoxLayout()
+        self.condition_combo = QComboBox()
+        self.condition_combo.addItem("(all files)", None)
+        for field in self.fields:
+            self.condition_combo.addItem(field, field)
+        self.negate_checkbox = QCheckBox("doesn't match")
+        self.condition_edit = QLineEdit()
+        self.condition_edit.setPlaceholderText("Regular expression")
+        condition_layout.addWidget(self.condition_combo)
+        condition_layout.addWidget(self.negate_checkbox)
+        condition_layout.addWidget(self.condition_edit)
+        form_layout.addRow("Only where:", condition_layout)
+        
+        add_button = QPushButton("Add Rule")
+        add_button.clicked.connect(self.add_rule)
+        form_layout.addRow("", add_button)
+        
+        layout.addWidget(builder)
+        
+        # Rule list
+        rules_layout = QHBoxLayout()
+        self.rules_list = QListWidget()
+        rules_layout.addWidget(self.rules_list)
+        
+        rule_buttons = QVBoxLayout()
+        for text, handler in (("Move Up", lambda: self.move_rule(-1)), ("Move Down", lambda: self.move_rule(1)),
+                              ("Remove", self.remove_rule), ("Load...", self.load_rules),
+                              ("Save...", self.save_rules)):
+            button = QPushButton(text)
+            button.clicked.connect(handler)
+            rule_buttons.addWidget(button)
+        rule_buttons.addStretch()
+        rules_layout.addLayout(rule_buttons)
+        layout.addLayout(rules_layout)
+        
+        # Preview
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+        
+        self.preview_model = PreviewModel(self)
+        self.preview_table = QTableView()
+        self.preview_table.setModel(self.preview_model)
+        self.preview_table.verticalHeader().setVisible(False)
+        self.preview_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.preview_table, 1)
+        
+        # Button layout
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        
+        # Cancel button
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(self.reject)
+        button_layout.addWidget(cancel_button)
+        
+        # Apply button
+        self.apply_button = QPushButton("Apply")
+        self.apply_button.clicked.connect(self.apply_rules)
+        button_layout.addWidget(self.apply_button)
+        
+        layout.addLayout(button_layout)
+        self.update_preview()
+    
+    def on_operation_changed(self):
+        """Show the inputs of the selected operation"""
+        op = self.operation_combo.currentData()
+        labels = {"replace": "Find:", "set": "Value:", "from_filename": "Pattern:"}
+        
+        self.field_combo.setEnabled(op != "from_filename")
+        self.text_label.setText(labels.get(op, ""))
+        self.text_label.setVisible(op in labels)
+        self.text_edit.setVisible(op in labels)
+        self.text_edit.setPlaceholderText("%artist% - %title%" if op == "from_filename" else "")
+        for widget in (self.replace_label, self.replace_edit, self.options_label,
+                       self.regex_checkbox, self.ignore_case_checkbox):
+            widget.setVisible(op == "replace")
+        self.case_label.setVisible(op == "case")
+        self.case_combo.setVisible(op == "case")
+    
+    def current_spec(self):
+        """Get the rule dictionary of the rule builder's inputs"""
+        op = self.operation_combo.currentData()
+        spec = {"op": op}
+        if op != "from_filename":
+            spec["field"] = self.field_combo.currentText()
+        
+        if op == "replace":
+            spec.update(find=self.text_edit.text(), replace=self.replace_edit.text(),
+                        regex=self.regex_checkbox.isChecked(), ignore_case=self.ignore_case_checkbox.isChecked())
+        elif op == "case":
+            spec["mode"] = self.case_combo.currentText()
+        elif op == "set":
+            spec["value"] = self.text_edit.text()
+        elif op == "from_filename":
+            spec["pattern"] = self.text_edit.text()
+        
+        condition_field = self.condition_combo.currentData()
+        if condition_field is not None:
+            spec["if"] = {"field": condition_field, "matches": self.condition_edit.text(),
+                          "negate": self.negate_checkbox.isChecked()}
+        return spec
+    
+    def set_rules(self, specs):
+        """
+        Replace the rules and update the preview
+        
+        Args:
+            specs: List of rule dictionaries
+        
+        Returns:
+            bool: False if a rule is invalid; the rules are left unchanged then
+        """
+        try:
+            rule_set = RuleSet.from_dicts(specs)
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid Rule", str(e))
+            return False
+        
+        self.specs = list(specs)
+        self.rule_set = rule_set
+        self.rules_list.clear()
+        self.rules_list.addItems([describe_rule(spec) for spec in self.specs])
+        self.update_preview()
+        return True
+    
+    def add_rule(self):
+        """Add the rule of the rule builder's inputs"""
+        if self.set_rules(self.specs + [self.current_spec()]):
+            self.rules_list.setCurrentRow(len(self.specs) - 1)
+    
+    def remove_rule(self):
+        """Remove the selected rule"""
+        row = self.rules_list.currentRow()
+        if row >= 0:
+            self.set_rules(self.specs[:row] + self.specs[row + 1:])
+    
+    def move_rule(self, offset):
+        """
+        Move the selected rule, as rules are applied in order
+        
+        Args:
+            offset: -1 to move it up, 1 to move it down
+        """
+        row = self.rules_list.currentRow()
+        target = row + offset
+        if row < 0 or not 0 <= target < len(self.specs):
+            return
+        
+        specs = list(self.specs)
+        specs[row], specs[target] = specs[target], specs[row]
+        if self.set_rules(specs):
+            self.rules_list.setCurrentRow(target)
+    
+    def load_rules(self):
+        """Load rules from a JSON file"""
+        rules_file, _ = QFileDialog.getOpenFileName(self, "Load Rules", "", "Rules (*.json)")
+        if not rules_file:
+            return
+        
+        try:
+            with open(rules_file, 'r', encoding='utf-8') as f:
+                specs = json.load(f)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Load Rules", f"Could not read rules from {rules_file}: {e}")
+            return
+        
+        if not isinstance(specs, list):
+            QMessageBox.warning(self, "Load Rules", f"{rules_file} must contain a list of rules")
+            return
+        self.set_rules(specs)
+    
+    def save_rules(self):
+        """Save the rules to a JSON file, e.g. for the batch mode's --rules option"""
+        rules_file, _ = QFileDialog.getSaveFileName(self, "Save Rules", "rules.json", "Rules (*.json)")
+        if not rules_file:
+            return
+        
+        try:
+            with open(rules_file, 'w', encoding='utf-8') as f:
+                json.dump(self.specs, f, indent=2, ensure_ascii=False)
+        except OSError as e:
+            QMessageBox.warning(self, "Save Rules", f"Could not save rules to {rules_file}: {e}")
+    
+    def update_preview(self):
+        """Compute and show the changes of the current rules"""
+        if self.rule_set is None:
+            self.changes = Preview([], [])
+        else:
+            self.changes = self.rule_set.preview(self.tag_processor.store, self.file_paths)
+        
+        self.preview_model.set_changes(self.changes)
+        self.summary_label.setText(f"{len(self.changes)} values change in {self.changes.file_count()} "
+                                   f"of {len(self.file_paths)} files.")
+        self.apply_button.setEnabled(len(self.changes) > 0)
+    
+    def apply_rules(self):
+        """Store the previewed changes; they are written by the next save"""
+        self.tag_processor.set_tags((change.path, change.field, change.new) for change in self.changes)
+        self.accept()
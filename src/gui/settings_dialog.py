@@ -4,7 +4,7 @@ Settings dialog for the MP3 Tag Editor application
 from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, 
                            QPushButton, QCheckBox, QSpinBox, QFormLayout)
 from PyQt6.QtCore import Qt
-from utils.config import load_config, save_config
+from utils.config import get_config
 
 class SettingsDialog(QDialog):
     """Settings dialog for the MP3 Tag Editor application"""
@@ -14,7 +14,7 @@ class SettingsDialog(QDialog):
         self.setWindowTitle("Settings")
         self.setMinimumWidth(400)
         
-        self.config = load_config()
+        self.config = get_config()
         self.init_ui()
     
     def init_ui(self):
@@ -41,6 +41,11 @@ class SettingsDialog(QDialog):
         self.auto_process_checkbox.setChecked(self.config.get("auto_process", False))
         form_layout.addRow("Auto-process files after loading:", self.auto_process_checkbox)
         
+        # Artwork thumbnails
+        self.show_artwork_checkbox = QCheckBox()
+        self.show_artwork_checkbox.setChecked(self.config.get("show_artwork", True))
+        form_layout.addRow("Show artwork thumbnails:", self.show_artwork_checkbox)
+        
         layout.addLayout(form_layout)
         
         # Button layout
@@ -64,6 +69,6 @@ class SettingsDialog(QDialog):
         self.config["sample_size"] = self.sample_size_spin.value()
         self.config["recursive_search"] = self.recursive_checkbox.isChecked()
         self.config["auto_process"] = self.auto_process_checkbox.isChecked()
+        self.config["show_artwork"] = self.show_artwork_checkbox.isChecked()
         
-        save_config(self.config)
         self.accept()
\ No newline at end of file
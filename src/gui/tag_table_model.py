@@ -0,0 +1,288 @@
+"""
+Table model for displaying MP3 files and their tags
+"""
+import os
+import bisect
+from collections import OrderedDict
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, pyqtSignal
+from PyQt6.QtGui import QColor, QIcon, QPixmap
+from tag_processor.artwork import ARTWORK_FIELD
+
+COLUMN_HEADERS = ["Filename", "Title", "Artist", "Album", "Year", "Genre", "Track#"]
+
+# Tag keys of the columns after the filename column
+TAG_KEYS = ["title", "artist", "album", "year", "genre", "track"]
+
+# Shared background colour of cells that will be written on save
+CHANGED_COLOR = QColor("yellow")
+
+# Thumbnails kept in memory; others are read from the thumbnail cache again when shown
+MAX_THUMBNAILS = 500
+
+class TagTableModel(QAbstractTableModel):
+    """
+    Model holding the files shown in the main window's table
+    
+    Rows are rendered on demand by the view, so no per-cell objects are
+    created. The model only holds the file paths; tag values and their
+    dirty state are read from the tag processor's TagStore, which owns
+    them. Cells of fields that will be written on save are highlighted.
+    
+    With show_artwork set, the filename column shows a thumbnail of the
+    file's artwork. Thumbnails are requested through thumbnail_requested
+    when a row is first drawn and arrive later through set_thumbnail, so
+    drawing never waits for a picture.
+    
+    A filter can hide files, e.g. those not matching a search. Methods
+    taking a "file row" expect the position of a file in the list given to
+    set_files(); the model's own rows only count the files shown.
+    
+    With read_only set, e.g. while a worker saves the files, no cell can
+    be edited.
+    """
+    
+    # Emitted when the user edits a tag: file row, column, new value
+    tag_edited = pyqtSignal(int, int, str)
+    
+    # Emitted with the path of a file whose thumbnail is needed
+    thumbnail_requested = pyqtSignal(str)
+    
+    def __init__(self, tag_store, parent=None):
+        """
+        Args:
+            tag_store: TagStore with the processed tags of the files
+            parent: Parent QObject
+        """
+        super().__init__(parent)
+        self._store = tag_store
+        self._paths = []
+        self._shown = None  # Sorted file rows shown, or None for all files
+        self._row_cache = (None, None)  # Tags of the last row read, as the view reads row by row
+        self.show_artwork = False
+        self.read_only = False
+        self._thumbnails = OrderedDict()  # File row -> QIcon, or None without artwork; least recent first
+        self._requested = set()  # File rows whose thumbnails were requested
+    
+    def set_files(self, file_paths):
+        """
+        Replace the files shown in the table
+        
+        Args:
+            file_paths: List of MP3 file paths
+        """
+        self.beginResetModel()
+        self._paths = list(file_paths)
+        self._shown = None
+        self._row_cache = (None, None)
+        self._thumbnails.clear()
+        self._requested.clear()
+        self.endResetModel()
+    
+    def set_filter(self, file_rows):
+        """
+        Show only some of the files
+        
+        Args:
+            file_rows: Sorted file rows to show, or None to show all files
+        """
+        self.beginResetModel()
+        self._shown = file_rows
+        self._row_cache = (None, None)
+        self.endResetModel()
+    
+    def _file_row(self, row):
+        """Get the file row shown in a row of the model"""
+        return row if self._shown is None else self._shown[row]
+    
+    def view_row(self, file_row):
+        """
+        Get the row of the model showing a file
+        
+        Args:
+            file_row (int): Position of the file in the list given to set_files()
+        
+        Returns:
+            int: Row of the model, or None if the file is hidden by the filter
+        """
+        if self._shown is None:
+            return file_row
+        row = bisect.bisect_left(self._shown, file_row)
+        return row if row < len(self._shown) and self._shown[row] == file_row else None
+    
+    def update_rows(self, rows):
+        """
+        Show the processed tags of a batch of rows
+        
+        Args:
+            rows: List of file rows whose tags were stored
+        """
+        if not rows:
+            return
+        
+        self._row_cache = (None, None)
+        
+        first, last = min(rows), max(rows)
+        if self._shown is not None:
+            # Redraw the rows shown between the first and the last file
+            first = bisect.bisect_left(self._shown, first)
+            last = bisect.bisect_right(self._shown, last) - 1
+            if first > last:
+                return
+        
+        # A single signal for the whole batch keeps repaints cheap; the filename cell shows pending artwork
+        self.dataChanged.emit(self.index(first, 0), self.index(last, len(COLUMN_HEADERS) - 1))
+    
+    def set_thumbnail(self, file_row, image):
+        """
+        Show the thumbnail of a file
+        
+        Args:
+            file_row (int): Position of the file in the list given to set_files()
+            image: QImage of the thumbnail; a null image if the file has no artwork
+        """
+        self._requested.discard(file_row)
+        self._thumbnails[file_row] = QIcon(QPixmap.fromImage(image)) if not image.isNull() else None
+        self._thumbnails.move_to_end(file_row)
+        if len(self._thumbnails) > MAX_THUMBNAILS:
+            self._thumbnails.popitem(last=False)
+        
+        row = self.view_row(file_row)
+        if row is not None:
+            index = self.index(row, 0)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+    
+    def forget_requests(self, file_rows):
+        """
+        Request the thumbnails of files again when they are drawn, e.g. after
+        their requests were dropped
+        
+        Args:
+            file_rows: File rows
+        """
+        self._requested.difference_update(file_rows)
+    
+    def clear_thumbnails(self):
+        """Read all thumbnails again, e.g. after the artwork of files was saved"""
+        self._thumbnails.clear()
+        self._requested.clear()
+        if self.rowCount():
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, 0),
+                                  [Qt.ItemDataRole.DecorationRole])
+    
+    def _thumbnail(self, row):
+        """Get the thumbnail of a row, requesting it if it isn't loaded yet"""
+        file_row = self._file_row(row)
+        if file_row in self._thumbnails:
+            self._thumbnails.move_to_end(file_row)
+            return self._thumbnails[file_row]
+        
+        if file_row not in self._requested:
+            self._requested.add(file_row)
+            self.thumbnail_requested.emit(self._paths[file_row])
+        return None
+    
+    def refresh(self):
+        """Redraw all tag cells, e.g. after the files were saved"""
+        if self._paths:
+            self.update_rows([0, len(self._paths) - 1])
+    
+    def _tags(self, row):
+        """
+        Get the tags of a row
+        
+        Args:
+            row (int): Row number
+        
+        Returns:
+            dict: Tag information, or None if the file hasn't been processed
+        """
+        cached_row, tag_info = self._row_cache
+        if cached_row != row:
+            tag_info = self._store.get(self._paths[self._file_row(row)])
+            self._row_cache = (row, tag_info)
+        return tag_info
+    
+    def file_path(self, row):
+        """
+        Get the file path of a row
+        
+        Args:
+            row (int): Row number
+        
+        Returns:
+            str: Path to the MP3 file
+        """
+        return self._paths[self._file_row(row)]
+    
+    def rowCount(self, parent=QModelIndex()):
+        """Get the number of rows"""
+        if parent.isValid():
+            return 0
+        return len(self._paths) if self._shown is None else len(self._shown)
+    
+    def columnCount(self, parent=QModelIndex()):
+        """Get the number of columns"""
+        if parent.isValid():
+            return 0
+        return len(COLUMN_HEADERS)
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        """Get the column headers"""
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return COLUMN_HEADERS[section]
+        return super().headerData(section, orientation, role)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        """Get the data of a cell"""
+        if not index.isValid():
+            return None
+        
+        row = index.row()
+        col = index.column()
+        
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            if col == 0:
+                return os.path.basename(self.file_path(row))
+            
+            tag_info = self._tags(row)
+            return str(tag_info.get(TAG_KEYS[col - 1], "")) if tag_info is not None else ""
+        
+        if role == Qt.ItemDataRole.DecorationRole and col == 0 and self.show_artwork:
+            return self._thumbnail(row)
+        
+        if role == Qt.ItemDataRole.BackgroundRole:
+            # The filename cell stands for the artwork
+            field = TAG_KEYS[col - 1] if col > 0 else ARTWORK_FIELD
+            if self._store.is_dirty(self.file_path(row), field):
+                return CHANGED_COLOR
+        
+        return None
+    
+    def flags(self, index):
+        """Make tag cells of processed files editable"""
+        flags = super().flags(index)
+        if (not self.read_only and index.isValid() and index.column() > 0
+                and self.file_path(index.row()) in self._store):
+            flags |= Qt.ItemFlag.ItemIsEditable
+        return flags
+    
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        """Store a tag edited by the user"""
+        if self.read_only or role != Qt.ItemDataRole.EditRole or not index.isValid() or index.column() == 0:
+            return False
+        
+        row = index.row()
+        col = index.column()
+        tag_info = self._tags(row)
+        if tag_info is None:
+            return False
+        
+        value = str(value)
+        if str(tag_info.get(TAG_KEYS[col - 1], "")) == value:
+            return False
+        
+        # The receiver stores the value; the cell is redrawn from the store afterwards
+        self.tag_edited.emit(self._file_row(row), col, value)
+        self._row_cache = (None, None)
+        self.dataChanged.emit(index, index)
+        return True
@@ -0,0 +1,268 @@
+"""
+Background workers for the MP3 Tag Editor application
+"""
+import time
+import threading
+from collections import OrderedDict
+from PyQt6.QtCore import QObject, pyqtSignal
+from PyQt6.QtGui import QImage
+from tag_processor.bulk_save import BulkSaver
+from utils.instrumentation import profiling
+
+# Minimum number of seconds between two batches of results sent to the UI
+BATCH_INTERVAL = 0.05
+
+# Thumbnail requests kept waiting; older ones are dropped when the table is scrolled quickly
+MAX_THUMBNAIL_REQUESTS = 256
+
+class TagWorker(QObject):
+    """
+    Base class for workers that handle a list of files on a QThread
+    
+    Results are collected into batches and sent to the UI thread at most
+    every BATCH_INTERVAL seconds, so the event loop is never flooded with
+    one signal per file. Set profile_cpu or profile_memory to profile the
+    worker thread while it runs.
+    """
+    
+    results_ready = pyqtSignal(list)
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(bool)  # True if the worker was cancelled
+    
+    profile_cpu = False
+    profile_memory = False
+    
+    def __init__(self, tag_processor, file_paths):
+        super().__init__()
+        self.tag_processor = tag_processor
+        self.file_paths = list(file_paths)
+        self._cancelled = False
+    
+    def cancel(self):
+        """Request the worker to stop after the current file"""
+        self._cancelled = True
+    
+    def is_cancelled(self):
+        """Check whether the worker was asked to stop"""
+        return self._cancelled
+    
+    def run(self):
+        """Run the worker and emit its results in batches"""
+        batch = []
+        done = 0
+        last_emit = time.monotonic()
+        
+        try:
+            with profiling(self.profile_cpu, self.profile_memory, label=type(self).__name__):
+                for result in self.iter_results():
+                    batch.append(result)
+                    done += 1
+                    
+                    now = time.monotonic()
+                    if now - last_emit >= BATCH_INTERVAL:
+                        self.results_ready.emit(batch)
+                        self.progress.emit(done)
+                        batch = []
+                        last_emit = now
+                    
+                    if self._cancelled:
+                        break
+        except Exception as e:
+            print(f"Error in background worker: {e}")
+        
+        if batch:
+            self.results_ready.emit(batch)
+        self.progress.emit(done)
+        self.finished.emit(self._cancelled)
+    
+    def iter_results(self):
+        """
+        Handle the files
+        
+        Yields:
+            tuple: One result per file, starting with the file path
+        """
+        raise NotImplementedError
+
+class ProcessWorker(TagWorker):
+    """Worker that processes the tags of files in the background"""
+    
+    def __init__(self, tag_processor, file_paths, workers=0):
+        super().__init__(tag_processor, file_paths)
+        self.workers = workers
+    
+    def iter_results(self):
+        """
+        Process the files with the tag processor's worker pool
+        
+        Yields:
+            tuple: (file_path, tag_info), where tag_info is None on error
+        """
+        results = self.tag_processor.process_files(self.file_paths, workers=self.workers,
+                                                   is_cancelled=self.is_cancelled)
+        try:
+            for result in results:
+                yield result
+        finally:
+            results.close()
+
+class SaveWorker(TagWorker):
+    """Worker that saves the changes to files in the background"""
+    
+    def __init__(self, tag_processor, file_paths, concurrency=4):
+        super().__init__(tag_processor, file_paths)
+        self.concurrency = concurrency
+    
+    def iter_results(self):
+        """
+        Save the changes with a journaled pool of writer threads
+        
+        Yields:
+            tuple: (file_path, result, error), where result is the dict
+                returned by save_changes and error is None on success
+        """
+        saver = BulkSaver(self.tag_processor, self.concurrency)
+        results = saver.save(self.file_paths, is_cancelled=self.is_cancelled)
+        try:
+            for result in results:
+                yield result
+        finally:
+            results.close()
+
+class RecoverWorker(TagWorker):
+    """Worker that resumes or rolls back an interrupted save"""
+    
+    def __init__(self, tag_processor, run_dir, rollback=False, concurrency=4):
+        super().__init__(tag_processor, [])
+        self.run_dir = run_dir
+        self.rollback = rollback
+        self.concurrency = concurrency
+    
+    def iter_results(self):
+        """
+        Resume or roll back the run recorded in the journal
+        
+        The planned tags of a resumed run are loaded into a tag processor of
+        the worker's own, so the tags and unsaved edits shown in the table
+        are left alone; the window reads the files it shows again afterwards.
+        
+        Yields:
+            tuple: (file_path, result, error); see BulkSaver.resume and
+                BulkSaver.rollback
+        """
+        from tag_processor.processor import TagProcessor
+        
+        recover_processor = TagProcessor(cache=self.tag_processor.cache, tag_writer=self.tag_processor.tag_writer)
+        saver = BulkSaver(recover_processor, self.concurrency)
+        if self.rollback:
+            results = saver.rollback(self.run_dir, is_cancelled=self.is_cancelled)
+        else:
+            results = saver.resume(self.run_dir, is_cancelled=self.is_cancelled)
+        try:
+            for result in results:
+                yield result
+        finally:
+            results.close()
+
+class DuplicatesWorker(TagWorker):
+    """Worker that finds files with identical audio in the background"""
+    
+    def __init__(self, tag_processor, file_paths, use_index=True, threads=4):
+        super().__init__(tag_processor, file_paths)
+        self.use_index = use_index
+        self.threads = threads
+    
+    def iter_results(self):
+        """
+        Hash the audio of the files, reusing the persistent hash index
+        
+        Yields:
+            dict: A group of files with identical audio; see DuplicateFinder.find
+        """
+        from tag_processor.duplicates import DuplicateFinder, open_audio_hash_index
+        
+        index = open_audio_hash_index() if self.use_index else None
+        try:
+            finder = DuplicateFinder(index, threads=self.threads)
+            for group in finder.find(self.file_paths, is_cancelled=self.is_cancelled):
+                yield group
+        finally:
+            if index is not None:
+                index.close()
+
+class ThumbnailWorker(QObject):
+    """
+    Worker that makes artwork thumbnails on a QThread for as long as the window is open
+    
+    The table requests the thumbnails of the rows it draws. The newest
+    requests are served first, so after scrolling the rows in view are
+    filled in first, and the oldest requests are dropped once more than
+    MAX_THUMBNAIL_REQUESTS are waiting. Pictures are read and thumbnails
+    decoded on the worker's thread; the UI thread only gets the decoded
+    images.
+    """
+    
+    # File path and its thumbnail; the image is null if the file has no artwork
+    thumbnail_ready = pyqtSignal(str, QImage)
+    
+    def __init__(self, thumbnail_cache):
+        """
+        Args:
+            thumbnail_cache: ThumbnailCache, closed when the worker stops
+        """
+        super().__init__()
+        self.thumbnail_cache = thumbnail_cache
+        self._requests = OrderedDict()  # File paths, oldest request first
+        self._condition = threading.Condition()
+        self._stopped = False
+    
+    def request(self, file_path):
+        """
+        Ask for the thumbnail of a file (called from the UI thread)
+        
+        Args:
+            file_path: Path to the MP3 file
+        
+        Returns:
+            list: File paths whose requests were dropped to make room
+        """
+        dropped = []
+        with self._condition:
+            self._requests[file_path] = None
+            self._requests.move_to_end(file_path)
+            while len(self._requests) > MAX_THUMBNAIL_REQUESTS:
+                dropped.append(self._requests.popitem(last=False)[0])
+            self._condition.notify()
+        return dropped
+    
+    def clear(self):
+        """Drop all waiting requests, e.g. when other files are loaded"""
+        with self._condition:
+            self._requests.clear()
+    
+    def stop(self):
+        """Stop the worker after the current thumbnail"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+    
+    def run(self):
+        """Serve requests until the worker is stopped"""
+        while True:
+            with self._condition:
+                while not self._requests and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    break
+                file_path = self._requests.popitem(last=True)[0]
+            
+            try:
+                thumbnail = self.thumbnail_cache.get(file_path)
+            except Exception as e:
+                print(f"Error making thumbnail of {file_path}: {e}")
+                thumbnail = None
+            
+            image = QImage.fromData(thumbnail) if thumbnail else QImage()
+            self.thumbnail_ready.emit(file_path, image)
+        
+        self.thumbnail_cache.close()
@@ -3,16 +3,38 @@
 MP3 Tag Editor - A desktop application for mass editing MP3 tags
 """
 import sys
-from PyQt6.QtWidgets import QApplication
-from gui.main_window import MainWindow
 
 def main():
     """Main entry point for the application"""
+    # The batch command runs headless and must not import PyQt6
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        from cli import batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+
+    # Print how long each import took once the window is shown
+    import_timer = None
+    if "--startup-profile" in sys.argv:
+        sys.argv.remove("--startup-profile")
+        from utils.startup_profile import ImportTimer
+        import_timer = ImportTimer.install()
+
+    from PyQt6.QtWidgets import QApplication
+    from gui.main_window import MainWindow
+
     app = QApplication(sys.argv)
     app.setApplicationName("MP3 Tag Editor")
     window = MainWindow()
     window.show()
+
+    if import_timer is not None:
+        from PyQt6.QtCore import QTimer
+
+        def report():
+            import_timer.uninstall()
+            import_timer.report("Window shown after")
+        QTimer.singleShot(0, report)
+
     sys.exit(app.exec())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,511 @@
+"""
+Artwork - Reads embedded pictures and keeps thumbnails of them on disk
+"""
+import io
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import importlib.util
+import tempfile
+import threading
+from collections import namedtuple
+from tag_processor.tag_cache import TagCache
+from utils.config import THUMBNAIL_DIR
+
+# Pseudo field marking a file whose artwork changes when it is saved
+ARTWORK_FIELD = "artwork"
+
+# Picture type of the front cover in APIC frames
+FRONT_COVER = 3
+
+# Width and height thumbnails are scaled to fit into
+THUMBNAIL_SIZE = 64
+
+# JPEG quality of scaled pictures
+JPEG_QUALITY = 85
+
+# Default size limit of the thumbnail cache
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Number of buffered index writes after which they are committed to disk
+FLUSH_INTERVAL = 100
+
+# Fraction of max_bytes kept after an eviction, so evictions happen in bulk
+EVICTION_TARGET = 0.9
+
+# Name of the index database in the thumbnail directory
+INDEX_FILE = "index.sqlite3"
+
+# Frame IDs of ID3v2.3/2.4 and of ID3v2.2; anything else ends the frames (padding) or is invalid
+_FRAME_ID = {4: re.compile(rb"[A-Z0-9]{4}"), 3: re.compile(rb"[A-Z0-9]{3}")}
+
+# Leading bytes of the image formats accepted as artwork
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"GIF8": "image/gif"
+}
+
+# Function scale_image uses instead of Pillow, see set_image_scaler
+_image_scaler = None
+
+# A pending artwork change: action is "replace" (with data and mime), "strip" or "resize"
+# (pictures larger than max_size pixels are shrunk)
+ArtworkChange = namedtuple("ArtworkChange", ["action", "data", "mime", "max_size"])
+
+def _int_to_syncsafe(value):
+    """Encode an ID3v2 synchsafe integer"""
+    return bytes((value >> shift) & 0x7f for shift in (21, 14, 7, 0))
+
+def read_pictures(file_path):
+    """
+    Read the embedded pictures of an MP3 file
+    
+    Only the frame headers of the ID3v2 tag and the picture frames are
+    read; the other frames, e.g. long lyrics, are skipped over. Tags that
+    are unsynchronised as a whole, or whose frames can't be walked, are
+    read and parsed in full instead.
+    
+    Args:
+        file_path: Path to the MP3 file
+    
+    Returns:
+        list: Mutagen APIC frames in tag order; ID3v2.2 PIC frames are
+            converted
+    
+    Raises:
+        OSError: If the file can't be read
+    """
+    # Imported here, so showing the table doesn't wait for mutagen
+    from mutagen.id3 import ID3, APIC, Frames_2_2
+    from tag_processor.processor import ID3V2_HEADER_SIZE, _syncsafe_to_int
+    
+    with open(file_path, 'rb') as f:
+        header = f.read(ID3V2_HEADER_SIZE)
+        if len(header) < ID3V2_HEADER_SIZE or header[:3] != b"ID3" or header[3] not in (2, 3, 4):
+            return []
+        
+        version = header[3]
+        flags = header[5]
+        end = ID3V2_HEADER_SIZE + _syncsafe_to_int(header[6:10])
+        data = _read_picture_frames(f, version, flags, end, _syncsafe_to_int)
+        if data is None:
+            f.seek(0)
+            data = f.read(end)
+    
+    id3 = ID3()
+    id3.load(io.BytesIO(data), known_frames={"APIC": APIC, "PIC": Frames_2_2["PIC"]}, load_v1=False)
+    return id3.getall("APIC")
+
+def _read_picture_frames(f, version, flags, end, syncsafe_to_int):
+    """
+    Collect the raw picture frames of an ID3v2 tag into a tag of their own
+    
+    Args:
+        f: MP3 file positioned after the ID3v2 header
+        version: ID3v2 major version (2, 3 or 4)
+        flags: Flags of the ID3v2 header
+        end: Offset of the end of the tag
+        syncsafe_to_int: Decoder of synchsafe integers
+    
+    Returns:
+        bytes: An ID3v2 tag holding only the picture frames, or None if the
+            whole tag has to be parsed
+    """
+    # Unsynchronisation (and ID3v2.2 compression) applies to the tag as a whole
+    if flags & 0x80 or (version == 2 and flags & 0x40):
+        return None
+    
+    position = f.tell()
+    if version > 2 and flags & 0x40:
+        size_data = f.read(4)
+        if len(size_data) < 4:
+            return None
+        # The size of the extended header includes itself in ID3v2.4, but not in ID3v2.3
+        position += syncsafe_to_int(size_data) if version == 4 else int.from_bytes(size_data, "big") + 4
+        f.seek(position)
+    
+    id_size = 3 if version == 2 else 4
+    header_size = 6 if version == 2 else 10
+    picture_id = b"PIC" if version == 2 else b"APIC"
+    frames = []
+    
+    while position + header_size <= end:
+        frame_header = f.read(header_size)
+        if len(frame_header) < header_size or frame_header[0] == 0:
+            break  # Padding
+        if not _FRAME_ID[id_size].fullmatch(frame_header[:id_size]):
+            return None
+        
+        size_data = frame_header[id_size:id_size + (3 if version == 2 else 4)]
+        if version == 4 and not any(byte & 0x80 for byte in size_data):
+            size = syncsafe_to_int(size_data)
+        else:
+            # Sizes with the high bit set are plain integers written by some encoders
+            size = int.from_bytes(size_data, "big")
+        
+        position += header_size + size
+        if position > end:
+            return None
+        
+        if frame_header[:id_size] == picture_id:
+            frames.append(frame_header + f.read(size))
+        else:
+            f.seek(position)
+    
+    body = b"".join(frames)
+    return b"ID3" + bytes([version, 0, 0]) + _int_to_syncsafe(len(body)) + body
+
+def image_mime(data):
+    """
+    Get the MIME type of an image from its first bytes
+    
+    Args:
+        data: Image bytes
+    
+    Returns:
+        str: MIME type, or None if the data isn't a JPEG, PNG or GIF image
+    """
+    for signature, mime in IMAGE_SIGNATURES.items():
+        if data.startswith(signature):
+            return mime
+    return None
+
+def front_cover(pictures):
+    """
+    Pick the picture shown for a file
+    
+    Args:
+        pictures: APIC frames, see read_pictures
+    
+    Returns:
+        The front cover, or the first picture if there is none, or None
+    """
+    for picture in pictures:
+        if picture.type == FRONT_COVER:
+            return picture
+    return pictures[0] if pictures else None
+
+def read_artwork(file_path):
+    """
+    Read the picture shown for an MP3 file, see front_cover
+    
+    Args:
+        file_path: Path to the MP3 file
+    
+    Returns:
+        dict: "mime", "type", "desc" and "data" of the picture, or None if
+            the file has no artwork
+    
+    Raises:
+        OSError: If the file can't be read
+    """
+    picture = front_cover(read_pictures(file_path))
+    if picture is None:
+        return None
+    return {"mime": picture.mime, "type": int(picture.type), "desc": picture.desc, "data": picture.data}
+
+def scale_image(data, max_size, quality=JPEG_QUALITY):
+    """
+    Shrink an image to fit into a square
+    
+    The GUI scales images with Qt, see set_image_scaler; without it the
+    optional Pillow package is used, which needs no display either. JPEG
+    images are decoded at a reduced size, so large pictures are scaled
+    without decoding them in full.
+    
+    Args:
+        data: Image bytes, e.g. the data of an APIC frame
+        max_size: Maximum width and height in pixels
+        quality: JPEG quality of the scaled image
+    
+    Returns:
+        tuple: (image bytes, MIME type); data itself if the image already
+            fits. None if the data isn't an image that can be read.
+    
+    Raises:
+        RuntimeError: If no scaler is set and Pillow isn't installed
+    """
+    if _image_scaler is not None:
+        return _image_scaler(data, max_size, quality)
+    if not can_scale_images():
+        raise RuntimeError("Resizing artwork needs the Pillow package (pip install Pillow)")
+    return _pillow_scale_image(data, max_size, quality)
+
+def set_image_scaler(scaler):
+    """
+    Replace the image scaling of scale_image, e.g. with Qt's in the GUI
+    
+    Args:
+        scaler: Function taking (data, max_size, quality) and returning
+            what scale_image does, or None to use Pillow again
+    """
+    global _image_scaler
+    _image_scaler = scaler
+
+def can_scale_images():
+    """
+    Check whether scale_image can be used
+    
+    Returns:
+        bool: True if a scaler is set or Pillow is installed
+    """
+    return _image_scaler is not None or importlib.util.find_spec("PIL") is not None
+
+def _pillow_scale_image(data, max_size, quality):
+    """Shrink an image with Pillow, see scale_image"""
+    from PIL import Image
+    
+    try:
+        image = Image.open(io.BytesIO(data))
+        image_format = (image.format or "").lower()
+        if image.width <= max_size and image.height <= max_size:
+            return (data, "image/" + image_format) if image_format else None
+        
+        image.draft("RGB", (max_size, max_size))
+        # Transparency would be lost in a JPEG
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA" if has_alpha else "RGB")
+        image.thumbnail((max_size, max_size))
+        
+        output_format = "PNG" if has_alpha else "JPEG"
+        output = io.BytesIO()
+        image.save(output, output_format, quality=quality)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    return output.getvalue(), "image/" + output_format.lower()
+
+class ThumbnailCache:
+    """
+    On-disk cache of artwork thumbnails, limited in size
+    
+    Thumbnails are stored once per distinct picture, in a file named after
+    a hash of the picture, so all tracks of an album share one thumbnail.
+    An index maps each MP3 file to the hash of its picture and is validated
+    against the file's size, modification time and inode like the tag
+    cache, so a file is only read again after it changed. When the
+    thumbnails grow beyond max_bytes, the least recently used ones are
+    deleted.
+    """
+    
+    def __init__(self, cache_dir=THUMBNAIL_DIR, max_bytes=DEFAULT_MAX_BYTES, size=THUMBNAIL_SIZE):
+        """
+        Args:
+            cache_dir: Directory holding the thumbnails and their index
+            max_bytes: Maximum total size of the thumbnails
+            size: Width and height thumbnails are scaled to fit into
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self._lock = threading.Lock()
+        self._pending = {}  # Buffered index writes: path -> (size, mtime_ns, inode, picture hash)
+        self._touched = {}  # Buffered last-used updates: thumbnail name -> timestamp
+        
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        
+        self._connection = sqlite3.connect(os.path.join(cache_dir, INDEX_FILE), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        # An empty picture hash records a file without artwork
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, picture TEXT)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS thumbnails (name TEXT PRIMARY KEY, bytes INTEGER, last_used INTEGER)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS thumbnails_last_used ON thumbnails (last_used)")
+        self._connection.commit()
+        
+        self._total_bytes = self._connection.execute("SELECT COALESCE(SUM(bytes), 0) FROM thumbnails").fetchone()[0]
+    
+    def get(self, file_path, read=read_artwork):
+        """
+        Get the thumbnail of a file's artwork, making it if needed
+        
+        Args:
+            file_path: Path to the MP3 file
+            read: Function reading the artwork of a file, see read_artwork
+        
+        Returns:
+            bytes: Encoded thumbnail (JPEG or PNG), or None if the file has
+                no artwork that can be shown
+        """
+        key = TagCache.file_key(file_path)
+        if key is None:
+            return None
+        
+        with self._lock:
+            row = self._pending.get(file_path)
+            if row is None:
+                row = self._connection.execute(
+                    "SELECT size, mtime_ns, inode, picture FROM files WHERE path = ?", (file_path,)
+                ).fetchone()
+        
+        if row is not None and tuple(row[:3]) == key:
+            picture_hash = row[3]
+            thumbnail = self._load(self._name(picture_hash)) if picture_hash else None
+            if thumbnail is not None or not picture_hash:
+                self.hits += 1
+                return thumbnail
+        
+        self.misses += 1
+        try:
+            picture = read(file_path)
+        except Exception as e:
+            print(f"Error reading artwork of {file_path}: {e}")
+            return None
+        
+        thumbnail = None
+        picture_hash = ""
+        if picture is not None:
+            picture_hash = hashlib.blake2b(picture["data"], digest_size=16).hexdigest()
+            name = self._name(picture_hash)
+            # Other tracks of the album may have made the thumbnail already
+            thumbnail = self._load(name)
+            if thumbnail is None:
+                scaled = scale_image(picture["data"], self.size)
+                if scaled is None:
+                    picture_hash = ""  # Not an image that can be shown
+                else:
+                    thumbnail = scaled[0]
+                    self._store(name, thumbnail)
+        
+        with self._lock:
+            self._pending[file_path] = key + (picture_hash,)
+            if len(self._pending) >= FLUSH_INTERVAL:
+                self._flush()
+        return thumbnail
+    
+    def _name(self, picture_hash):
+        """Get the file name of the thumbnail of a picture"""
+        return f"{picture_hash}-{self.size}"
+    
+    def _path(self, name):
+        """Get the path of a thumbnail; thumbnails are spread over subdirectories"""
+        return os.path.join(self.cache_dir, name[:2], name)
+    
+    def _load(self, name):
+        """Read a thumbnail, or return None if it was never made or was evicted"""
+        try:
+            with open(self._path(name), 'rb') as f:
+                thumbnail = f.read()
+        except OSError:
+            return None
+        
+        with self._lock:
+            self._touched[name] = time.time_ns()
+            if len(self._touched) >= FLUSH_INTERVAL:
+                self._flush()
+        return thumbnail
+    
+    def _store(self, name, thumbnail):
+        """Write a thumbnail through a temporary file and evict old ones if the cache is full"""
+        path = self._path(name)
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(thumbnail)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error writing thumbnail {path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        
+        with self._lock:
+            old = self._connection.execute("SELECT bytes FROM thumbnails WHERE name = ?", (name,)).fetchone()
+            self._connection.execute("INSERT OR REPLACE INTO thumbnails (name, bytes, last_used) VALUES (?, ?, ?)",
+                                     (name, len(thumbnail), time.time_ns()))
+            self._total_bytes += len(thumbnail) - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._flush()
+                self._evict()
+    
+    def _evict(self):
+        """Delete the least recently used thumbnails (caller holds _lock)"""
+        target = int(self.max_bytes * EVICTION_TARGET)
+        removed = []
+        for name, size in self._connection.execute("SELECT name, bytes FROM thumbnails ORDER BY last_used"):
+            if self._total_bytes <= target:
+                break
+            removed.append((name,))
+            self._total_bytes -= size
+        
+        for (name,) in removed:
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+        self._connection.executemany("DELETE FROM thumbnails WHERE name = ?", removed)
+        self._connection.commit()
+        self.evictions += len(removed)
+    
+    def flush(self):
+        """Commit buffered writes to disk"""
+        with self._lock:
+            self._flush()
+    
+    def close(self):
+        """Commit buffered writes and close the database"""
+        with self._lock:
+            self._flush()
+            self._connection.close()
+    
+    def stats(self):
+        """
+        Get the cache counters
+        
+        Returns:
+            dict: Hits, misses and evictions since the cache was opened,
+                and the total size of the thumbnails
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "bytes": self._total_bytes}
+    
+    def _flush(self):
+        """Commit buffered writes (caller holds _lock)"""
+        if not self._pending and not self._touched:
+            return
+        
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, picture) VALUES (?, ?, ?, ?, ?)",
+            ((path,) + row for path, row in self._pending.items())
+        )
+        self._connection.executemany(
+            "UPDATE thumbnails SET last_used = ? WHERE name = ?",
+            ((last_used, name) for name, last_used in self._touched.items())
+        )
+        self._pending.clear()
+        self._touched.clear()
+        self._connection.commit()
+
+def open_thumbnail_cache(max_bytes=DEFAULT_MAX_BYTES, cache_dir=THUMBNAIL_DIR):
+    """
+    Open the thumbnail cache, or return None if it can't be opened
+    
+    Args:
+        max_bytes: Maximum total size of the thumbnails
+        cache_dir: Directory holding the thumbnails and their index
+    
+    Returns:
+        ThumbnailCache: The opened cache, or None
+    """
+    try:
+        return ThumbnailCache(cache_dir, max_bytes)
+    except Exception as e:
+        print(f"Error opening thumbnail cache: {e}")
+        return None
@@ -0,0 +1,461 @@
+"""
+Bulk save - Saves many files concurrently, with a journal for crash recovery
+"""
+import os
+import json
+import time
+import shutil
+import threading
+from tag_processor.tag_writer import TEMP_PREFIX
+from utils.config import JOURNAL_DIR
+
+# Name of the log inside a journal directory
+JOURNAL_LOG = "journal.jsonl"
+
+# Seconds between checks of the cancellation callback while files are written
+CANCEL_POLL_INTERVAL = 0.05
+
+class SaveJournal:
+    """
+    Write-ahead journal of one bulk save run
+    
+    A journal is a directory under JOURNAL_DIR holding a log of JSON lines
+    and a backup of the original tags of every file that was about to be
+    written. The log records the planned tags of each file, synced to disk
+    before any file is touched, and the files that have been finished. A
+    backup is synced to disk before its file is written, so after a crash
+    every file that may have changed can be restored.
+    
+    The journal is removed when the run completes. A journal that is still
+    there belongs to an interrupted run, which can be resumed from the
+    planned tags or rolled back from the backups.
+    
+    Only the files that are planned but not finished are kept in memory,
+    with the number of their backup, so a journal kept for a whole
+    streaming run doesn't grow with the library. The planned tags are read
+    back from the log when a run is resumed.
+    """
+    
+    def __init__(self, run_dir):
+        """
+        Open a journal, creating it if it doesn't exist
+        
+        Args:
+            run_dir: Directory of the journal
+        """
+        self.run_dir = run_dir
+        self._pending = {}  # file path -> index of its plan, for the files that aren't finished
+        self._planned = 0  # Number of plans, which numbers the next one
+        self._lock = threading.Lock()
+        
+        os.makedirs(run_dir, exist_ok=True)
+        log_path = os.path.join(run_dir, JOURNAL_LOG)
+        if os.path.exists(log_path):
+            self._load(log_path)
+        self._log = open(log_path, 'a', encoding='utf-8')
+    
+    @classmethod
+    def create(cls, journal_dir=JOURNAL_DIR):
+        """
+        Create the journal of a new run
+        
+        Args:
+            journal_dir: Directory holding the journals of all runs
+        
+        Returns:
+            SaveJournal: The new journal
+        """
+        name = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}-{threading.get_ident()}"
+        return cls(os.path.join(journal_dir, name))
+    
+    def _entries(self):
+        """Read the entries of the log"""
+        with open(os.path.join(self.run_dir, JOURNAL_LOG), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # Last line cut off by the crash
+    
+    def _load(self, log_path):
+        """Read the log of an existing journal"""
+        for entry in self._entries():
+            if entry["op"] == "plan":
+                self._pending[entry["path"]] = entry["index"]
+                self._planned = max(self._planned, entry["index"] + 1)
+            else:
+                self._pending.pop(entry["path"], None)
+    
+    def _append(self, entries, sync=False):
+        """Append entries to the log"""
+        with self._lock:
+            for entry in entries:
+                self._log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._log.flush()
+            if sync:
+                os.fsync(self._log.fileno())
+    
+    def plan(self, files):
+        """
+        Record the tags that are going to be written
+        
+        Args:
+            files: List of (file_path, tag_info, dirty_fields) tuples
+        """
+        entries = []
+        with self._lock:
+            for file_path, tag_info, dirty_fields in files:
+                if file_path in self._pending:
+                    continue
+                
+                index = self._pending[file_path] = self._planned
+                self._planned += 1
+                entries.append({"op": "plan", "path": file_path, "index": index,
+                                "tags": tag_info, "dirty": list(dirty_fields)})
+        
+        self._append(entries, sync=True)
+    
+    def pending(self):
+        """
+        Get the planned files that haven't been finished
+        
+        Returns:
+            list: File paths in the order they were planned
+        """
+        with self._lock:
+            pending = [(index, path) for path, index in self._pending.items()]
+        return [path for _, path in sorted(pending)]
+    
+    def pending_plans(self):
+        """
+        Read the planned tags of the files that haven't been finished back
+        from the log
+        
+        Yields:
+            tuple: (file_path, tag_info, dirty_fields)
+        """
+        for entry in self._entries():
+            if entry["op"] == "plan" and self._pending.get(entry["path"]) == entry["index"]:
+                yield entry["path"], entry["tags"], entry["dirty"]
+    
+    def backup(self, file_path, tag_data, v1_data):
+        """
+        Store the original tags of a file before it is written
+        
+        A complete backup from an earlier attempt is kept, because the file
+        may already hold the new tags.
+        
+        Args:
+            file_path: Path to the MP3 file
+            tag_data: Raw ID3v2 tag of the file
+            v1_data: Raw ID3v1 tag of the file, or empty bytes
+        """
+        backup_path = self._backup_path(file_path)
+        if self._read_backup(backup_path) is not None:
+            return
+        
+        header = {"path": file_path, "tag_size": len(tag_data), "v1_size": len(v1_data)}
+        with open(backup_path, 'wb') as f:
+            f.write(json.dumps(header, ensure_ascii=False).encode('utf-8') + b"\n")
+            f.write(tag_data)
+            f.write(v1_data)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def read_backup(self, file_path):
+        """
+        Get the backup of a file taken by this or an earlier attempt
+        
+        Args:
+            file_path: Path to a planned MP3 file
+        
+        Returns:
+            tuple: (file_path, tag_data, v1_data), or None if there is no
+                complete backup
+        """
+        return self._read_backup(self._backup_path(file_path))
+    
+    def backups(self):
+        """
+        Get the complete backups of the run
+        
+        Backups come newest first: a file that was planned again after it
+        was finished has its first backup, of the original tags, come last.
+        
+        Yields:
+            tuple: (file_path, tag_data, v1_data)
+        """
+        for index in reversed(range(self._planned)):
+            backup = self._read_backup(os.path.join(self.run_dir, f"{index}.bak"))
+            if backup is not None:
+                yield backup
+    
+    def _backup_path(self, file_path):
+        """Get the path of the backup of a file that hasn't been finished"""
+        return os.path.join(self.run_dir, f"{self._pending[file_path]}.bak")
+    
+    def _read_backup(self, backup_path):
+        """
+        Read a backup file
+        
+        Returns:
+            tuple: (file_path, tag_data, v1_data), or None if the backup is
+                missing or was cut off
+        """
+        try:
+            with open(backup_path, 'rb') as f:
+                header = json.loads(f.readline())
+                data = f.read()
+        except (OSError, ValueError):
+            return None
+        
+        tag_size = header["tag_size"]
+        if len(data) != tag_size + header["v1_size"]:
+            return None
+        return header["path"], data[:tag_size], data[tag_size:]
+    
+    def finish(self, file_path, result=None, error=None):
+        """
+        Record that a file has been handled
+        
+        Args:
+            file_path: Path to the MP3 file
+            result: Dictionary returned by save_changes, if successful
+            error: Error message, if the file could not be written
+        """
+        with self._lock:
+            self._pending.pop(file_path, None)
+        if error is None:
+            self._append([{"op": "done", "path": file_path, "result": result}])
+        else:
+            self._append([{"op": "failed", "path": file_path, "error": error}])
+    
+    def remove_temp_files(self):
+        """Remove temporary files the interrupted run left next to its files"""
+        for directory in {os.path.dirname(os.path.abspath(path)) for path in self.pending()}:
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            
+            for name in names:
+                if name.startswith(TEMP_PREFIX) and name.endswith(".tmp"):
+                    try:
+                        os.unlink(os.path.join(directory, name))
+                    except OSError:
+                        pass
+    
+    def close(self, remove=False):
+        """
+        Close the journal
+        
+        Args:
+            remove: Delete the journal, e.g. because the run completed
+        """
+        self._log.close()
+        if remove:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+
+def find_interrupted_runs(journal_dir=JOURNAL_DIR):
+    """
+    Find the journals of interrupted bulk save runs
+    
+    Args:
+        journal_dir: Directory holding the journals of all runs
+    
+    Returns:
+        list: Journal directories, oldest first
+    """
+    try:
+        names = sorted(os.listdir(journal_dir))
+    except OSError:
+        return []
+    
+    return [os.path.join(journal_dir, name) for name in names
+            if os.path.exists(os.path.join(journal_dir, name, JOURNAL_LOG))]
+
+class BulkSaver:
+    """
+    Saves the changes of many files with a bounded pool of threads
+    
+    Writing tags is I/O bound, so on network storage several files in
+    flight hide the latency of each write. A tag that fits into the space
+    of the old one is overwritten in place; otherwise the file is rewritten
+    through a temporary file and an atomic rename. The run is recorded in a
+    SaveJournal with a synced backup of every file's old tags, so after a
+    crash the run can be resumed or rolled back, even for a file whose tag
+    was only partly written.
+    """
+    
+    def __init__(self, tag_processor, concurrency=4, journal_dir=JOURNAL_DIR):
+        """
+        Args:
+            tag_processor: TagProcessor holding the changes to save
+            concurrency: Maximum number of files written at the same time
+            journal_dir: Directory holding the journals of all runs
+        """
+        self.tag_processor = tag_processor
+        self.concurrency = max(1, concurrency)
+        self.journal_dir = journal_dir
+    
+    def save(self, file_paths, is_cancelled=None, journal=None):
+        """
+        Save the changes to the files
+        
+        Results are yielded in completion order. Files without changes are
+        reported as skipped without being journaled. If the run is cancelled
+        or interrupted, its journal is kept so it can be resumed.
+        
+        Args:
+            file_paths: Paths of processed MP3 files
+            is_cancelled: Optional callable; no more files are started once
+                it returns True
+            journal: SaveJournal to continue, e.g. when resuming a run
+        
+        Yields:
+            tuple: (file_path, result, error), where result is the dict
+                returned by save_changes and error is None on success
+        """
+        tag_processor = self.tag_processor
+        dirty_paths = []
+        
+        for file_path in file_paths:
+            if tag_processor.is_dirty(file_path):
+                dirty_paths.append(file_path)
+                continue
+            
+            try:
+                yield file_path, tag_processor.save_changes(file_path), None
+            except Exception as e:
+                yield file_path, None, str(e)
+        
+        if not dirty_paths:
+            if journal is not None:
+                journal.close(remove=not journal.pending())
+            return
+        
+        if journal is None:
+            journal = SaveJournal.create(self.journal_dir)
+        journal.plan([(file_path, tag_processor.store[file_path],
+                       tag_processor.store.dirty_fields(file_path)) for file_path in dirty_paths])
+        
+        # Imported here, so checking for interrupted runs at startup stays cheap
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+        
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = {}
+        remaining = iter(dirty_paths)
+        
+        try:
+            while True:
+                # Keep a few files queued per thread so no thread waits for work
+                while len(pending) < self.concurrency * 2 and not (is_cancelled and is_cancelled()):
+                    file_path = next(remaining, None)
+                    if file_path is None:
+                        break
+                    pending[executor.submit(self._save_file, journal, file_path)] = file_path
+                
+                if not pending:
+                    break
+                
+                done, _ = wait(pending, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        journal.finish(file_path, error=str(e))
+                        yield file_path, None, str(e)
+                    else:
+                        journal.finish(file_path, result)
+                        yield file_path, result, None
+        finally:
+            # Files being written are finished, so none is left half-way
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            journal.close(remove=not journal.pending())
+    
+    def _save_file(self, journal, file_path):
+        """Back up the tags of a file and save its changes (runs on a pool thread)"""
+        tag_writer = self.tag_processor.tag_writer
+        backup = journal.read_backup(file_path)
+        if backup is None:
+            tag_data, v1_data = tag_writer.read_raw(file_path)
+            journal.backup(file_path, tag_data, v1_data)
+        else:
+            # An earlier attempt may have stopped half-way through writing the tag in place
+            _, tag_data, v1_data = backup
+            tag_writer.write_raw(file_path, tag_data, v1_data, atomic=True)
+        return self.tag_processor.save_changes(file_path)
+    
+    def resume(self, run_dir, is_cancelled=None):
+        """
+        Save the files an interrupted run didn't finish
+        
+        The planned tags are loaded from the journal into the tag processor.
+        Files the interrupted run started writing are restored from their
+        backups first, as a tag written in place may have been cut off.
+        
+        Args:
+            run_dir: Journal directory of the interrupted run
+            is_cancelled: Optional callable; see save
+        
+        Yields:
+            tuple: (file_path, result, error); see save
+        """
+        journal = SaveJournal(run_dir)
+        journal.remove_temp_files()
+        
+        file_paths = journal.pending()
+        for file_path, tag_info, dirty_fields in journal.pending_plans():
+            self.tag_processor.store.put(file_path, tag_info, dirty_fields)
+        
+        return self.save(file_paths, is_cancelled, journal)
+    
+    def rollback(self, run_dir, is_cancelled=None):
+        """
+        Restore the original tags of the files an interrupted run wrote
+        
+        The journal is removed once every file has been restored.
+        
+        Args:
+            run_dir: Journal directory of the interrupted run
+            is_cancelled: Optional callable; no more files are restored once
+                it returns True
+        
+        Yields:
+            tuple: (file_path, result, error), where result has "status"
+                ("restored" or "skipped") and "bytes_written"
+        """
+        journal = SaveJournal(run_dir)
+        journal.remove_temp_files()
+        
+        tag_writer = self.tag_processor.tag_writer
+        cache = self.tag_processor.cache
+        complete = False
+        failed = False
+        
+        try:
+            for file_path, tag_data, v1_data in journal.backups():
+                if is_cancelled and is_cancelled():
+                    break
+                
+                try:
+                    current_tag, current_v1 = tag_writer.read_raw(file_path)
+                    # An ID3v1 tag that was stripped is appended again
+                    if current_tag == tag_data and (not v1_data or current_v1 == v1_data):
+                        yield file_path, {"status": "skipped", "bytes_written": 0}, None
+                        continue
+                    
+                    _, bytes_written = tag_writer.write_raw(file_path, tag_data, v1_data, atomic=True)
+                    if cache is not None:
+                        cache.invalidate(file_path)
+                    yield file_path, {"status": "restored", "bytes_written": bytes_written}, None
+                except Exception as e:
+                    failed = True
+                    yield file_path, None, str(e)
+            else:
+                complete = not failed
+        finally:
+            journal.close(remove=complete)
@@ -0,0 +1,302 @@
+"""
+Checkpoint - Records the progress of batch runs so they can be resumed
+"""
+import os
+import json
+import time
+import bisect
+import shutil
+import hashlib
+from array import array
+from utils.config import CHECKPOINT_DIR
+from utils.instrumentation import get_metrics
+
+# Name of the manifest inside a checkpoint directory
+MANIFEST_FILE = "manifest.json"
+
+# Name of the file holding the keys of the finished files
+DONE_FILE = "done.bin"
+
+# Seconds between two checkpoints; each costs two small writes and syncs
+CHECKPOINT_INTERVAL = 5.0
+
+# Bytes per key in the done file
+KEY_SIZE = 8
+
+MANIFEST_VERSION = 1
+
+def path_key(file_path):
+    """
+    Get the key a finished file is recorded under
+    
+    Paths are recorded as 64-bit hashes rather than as text, which keeps a
+    million finished files at 8 MB on disk and in memory.
+    
+    Args:
+        file_path: Path to the MP3 file
+    
+    Returns:
+        int: Hash of the absolute path
+    """
+    digest = hashlib.blake2b(os.fsencode(os.path.abspath(file_path)), digest_size=KEY_SIZE).digest()
+    return int.from_bytes(digest, "little")
+
+def run_name(command, paths, recursive):
+    """
+    Get the name of the checkpoint of a run
+    
+    Runs of the same command over the same paths share a checkpoint, so a
+    run can be resumed by repeating its command line.
+    
+    Args:
+        command: Batch command, e.g. "save"
+        paths: Files and/or directories given on the command line
+        recursive: Whether directories are searched recursively
+    
+    Returns:
+        str: Directory name of the checkpoint
+    """
+    identity = json.dumps([command, sorted(os.path.abspath(path) for path in paths), recursive])
+    return f"{command}-{hashlib.blake2b(identity.encode('utf-8'), digest_size=8).hexdigest()}"
+
+class RunCheckpoint:
+    """
+    Periodically saved progress of a batch run
+    
+    A checkpoint is a directory under CHECKPOINT_DIR holding a manifest and
+    a done file. The done file is an append-only array of the keys of the
+    files that have been finished, so a checkpoint only writes the files
+    finished since the previous one, however large the run. The manifest is
+    a small JSON document with the command line, the counts and the files
+    that failed, with their errors and attempts; it is replaced atomically.
+    Files that are neither done nor failed are pending.
+    
+    Progress is kept in memory between checkpoints, which are written every
+    CHECKPOINT_INTERVAL seconds, so a crash loses at most that much work.
+    The checkpoint is removed when the run completes without failures; one
+    that is still there can be resumed, which skips the files it records as
+    done.
+    """
+    
+    def __init__(self, run_dir, info, resume=False, interval=CHECKPOINT_INTERVAL):
+        """
+        Open the checkpoint of a run
+        
+        Args:
+            run_dir: Directory of the checkpoint
+            info: Dictionary describing the run (command, paths and options),
+                stored in the manifest
+            resume: Continue the progress recorded in the directory instead
+                of starting over
+            interval: Seconds between two checkpoints
+        """
+        self.run_dir = run_dir
+        self.info = info
+        self.interval = interval
+        self.failures = {}  # file path -> {"stage", "error", "attempts"}
+        self.done_count = 0  # Files finished, including those of the resumed runs
+        self.skipped = 0  # Files skipped because a resumed run finished them
+        self.total = None  # Number of files in the run, including skipped ones, if known
+        self.resumed = False
+        self.created = time.time()
+        self._finished = array('Q')  # Sorted keys of the files finished by the resumed runs
+        self._new = array('Q')  # Keys of the files finished since the last checkpoint
+        self._last_checkpoint = time.monotonic()
+        
+        os.makedirs(run_dir, exist_ok=True)
+        done_path = os.path.join(run_dir, DONE_FILE)
+        if resume:
+            self.resumed = self._load(done_path)
+        elif os.path.exists(os.path.join(run_dir, MANIFEST_FILE)):
+            print(f"Starting over; the progress of an earlier run in {run_dir} is discarded")
+        if not self.resumed:
+            self._remove(done_path)
+        self._done_file = open(done_path, 'ab')
+        self.checkpoint(force=True)
+    
+    @classmethod
+    def open(cls, command, paths, recursive, options=None, resume=False, checkpoint_dir=CHECKPOINT_DIR,
+             interval=CHECKPOINT_INTERVAL):
+        """
+        Open the checkpoint of a command line
+        
+        Args:
+            command: Batch command, e.g. "save"
+            paths: Files and/or directories given on the command line
+            recursive: Whether directories are searched recursively
+            options: Dictionary of the options that change what the run
+                does, compared when the run is resumed
+            resume: Continue an earlier run of the same command line
+            checkpoint_dir: Directory holding the checkpoints of all runs
+            interval: Seconds between two checkpoints
+        
+        Returns:
+            RunCheckpoint: The checkpoint
+        """
+        info = {"command": command, "paths": [os.path.abspath(path) for path in paths],
+                "recursive": recursive, "options": options or {}}
+        return cls(os.path.join(checkpoint_dir, run_name(command, paths, recursive)), info, resume, interval)
+    
+    def _load(self, done_path):
+        """
+        Read the progress of an earlier run
+        
+        Returns:
+            bool: Whether there was progress to resume
+        """
+        try:
+            with open(os.path.join(self.run_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_VERSION:
+                return False
+            with open(done_path, 'rb') as f:
+                data = f.read()
+        except (OSError, ValueError):
+            return False
+        
+        if manifest["info"].get("options") != self.info["options"]:
+            print(f"Warning: resuming a run that was started with different options: "
+                  f"{json.dumps(manifest['info'].get('options'))}")
+        
+        # A key cut off by a crash is dropped, so the next ones stay aligned
+        size = len(data) - len(data) % KEY_SIZE
+        if size != len(data):
+            os.truncate(done_path, size)
+        keys = array('Q')
+        keys.frombytes(data[:size])
+        
+        self._finished = array('Q', sorted(keys))
+        self.done_count = len(self._finished)
+        self.failures = manifest["failed"]
+        self.created = manifest["created"]
+        return True
+    
+    def _remove(self, path):
+        """Remove a file if it exists"""
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    
+    def is_done(self, file_path):
+        """
+        Check whether a resumed run finished a file
+        
+        Args:
+            file_path: Path to the MP3 file
+        
+        Returns:
+            bool: True if the file can be skipped
+        """
+        if not self._finished:
+            return False
+        key = path_key(file_path)
+        index = bisect.bisect_left(self._finished, key)
+        return index < len(self._finished) and self._finished[index] == key
+    
+    def remaining(self, file_paths):
+        """
+        Skip the files a resumed run finished
+        
+        Args:
+            file_paths: Iterable of MP3 file paths; it is consumed lazily
+        
+        Yields:
+            str: Paths of the files that still need to be handled
+        """
+        for file_path in file_paths:
+            if self.is_done(file_path):
+                self.skipped += 1
+            else:
+                yield file_path
+    
+    def mark_done(self, file_path):
+        """
+        Record that a file has been finished
+        
+        Args:
+            file_path: Path to the MP3 file
+        """
+        self._new.append(path_key(file_path))
+        self.done_count += 1
+        if self.failures:
+            self.failures.pop(file_path, None)
+        self.checkpoint()
+    
+    def mark_failed(self, file_path, stage, error):
+        """
+        Record that a file failed
+        
+        Args:
+            file_path: Path to the MP3 file
+            stage: Stage that failed, e.g. "process" or "save"
+            error: Error message
+        """
+        failure = self.failures.get(file_path)
+        attempts = failure["attempts"] + 1 if failure is not None else 1
+        self.failures[file_path] = {"stage": stage, "error": error, "attempts": attempts}
+        self.checkpoint()
+    
+    def pending(self):
+        """
+        Get the number of files that are neither done nor failed
+        
+        Returns:
+            int: Pending files, or None if the number of files isn't known
+        """
+        if self.total is None:
+            return None
+        return max(0, self.total - self.done_count - len(self.failures))
+    
+    def checkpoint(self, force=False):
+        """
+        Save the progress if the interval has passed since the last checkpoint
+        
+        Args:
+            force: Save the progress now
+        """
+        now = time.monotonic()
+        if not force and now - self._last_checkpoint < self.interval:
+            return
+        self._last_checkpoint = now
+        
+        with get_metrics().stage("checkpoint"):
+            # The keys are synced before the manifest counts them
+            if self._new:
+                self._done_file.write(self._new.tobytes())
+                self._done_file.flush()
+                os.fsync(self._done_file.fileno())
+                del self._new[:]
+            
+            manifest = {
+                "version": MANIFEST_VERSION,
+                "info": self.info,
+                "created": self.created,
+                "updated": time.time(),
+                "total": self.total,
+                "done": self.done_count,
+                "pending": self.pending(),
+                "failed": self.failures,
+            }
+            manifest_path = os.path.join(self.run_dir, MANIFEST_FILE)
+            temp_path = manifest_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, manifest_path)
+    
+    def close(self, complete=False):
+        """
+        Save the progress and close the checkpoint
+        
+        Args:
+            complete: The run went through all of its files; the checkpoint
+                is removed unless some of them failed
+        """
+        try:
+            self.checkpoint(force=True)
+        finally:
+            self._done_file.close()
+        if complete and not self.failures:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
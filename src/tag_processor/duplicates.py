@@ -0,0 +1,443 @@
+"""
+Duplicates - Finds files with the same audio by hashing it without the tags
+"""
+import os
+import mmap
+import sqlite3
+import hashlib
+import threading
+from tag_processor.id3v1 import TAIL_SIZE, read_tail, find_id3v1
+from tag_processor.processor import ID3V2_HEADER_SIZE, _syncsafe_to_int
+from tag_processor.tag_cache import TagCache
+from utils.config import AUDIO_HASH_FILE
+from utils.instrumentation import get_metrics
+
+try:
+    import xxhash  # Optional; several times faster than blake2b
+except ImportError:
+    xxhash = None
+
+# Bytes hashed at the start and at the end of the audio by the quick pass
+BLOCK_SIZE = 64 * 1024
+
+# Number of buffered index writes after which they are committed to disk
+FLUSH_INTERVAL = 500
+
+# Files handled at the same time; hashing releases the GIL, so threads help even on local disks
+DEFAULT_THREADS = 4
+
+if xxhash is not None and hasattr(xxhash, "xxh3_128"):
+    HASH_ALGORITHM = "xxh3_128"
+    _new_hash = xxhash.xxh3_128
+elif xxhash is not None:
+    HASH_ALGORITHM = "xxh64"
+    _new_hash = xxhash.xxh64
+else:
+    HASH_ALGORITHM = "blake2b-128"
+    _new_hash = lambda: hashlib.blake2b(digest_size=16)
+
+class AudioHashIndex:
+    """
+    On-disk index of the audio regions and hashes of files
+    
+    Entries are validated against the file's size, modification time and
+    inode like the tag cache, so only new and changed files are read again.
+    Hashes made with another algorithm (e.g. before xxhash was installed)
+    are ignored, but the audio region is still reused.
+    """
+    
+    def __init__(self, index_file=AUDIO_HASH_FILE):
+        """
+        Args:
+            index_file: Path to the SQLite database file
+        """
+        self.index_file = index_file
+        self.hits = 0
+        self.misses = 0
+        
+        self._lock = threading.Lock()
+        self._pending = {}  # Buffered writes: path -> row
+        
+        index_dir = os.path.dirname(index_file)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        
+        self._connection = sqlite3.connect(index_file, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+            "audio_start INTEGER, audio_end INTEGER, algorithm TEXT, quick TEXT, full TEXT)"
+        )
+        self._connection.commit()
+    
+    def get(self, file_path, key):
+        """
+        Get the indexed data of a file
+        
+        Args:
+            file_path: Path to the file
+            key: Validation key from TagCache.file_key
+        
+        Returns:
+            list: [audio_start, audio_end, quick hash, full hash], where the
+                hashes may be None, or None if missing or stale
+        """
+        if key is None:
+            return None
+        
+        with self._lock:
+            row = self._pending.get(file_path)
+            if row is None:
+                row = self._connection.execute(
+                    "SELECT size, mtime_ns, inode, audio_start, audio_end, algorithm, quick, full "
+                    "FROM hashes WHERE path = ?", (file_path,)
+                ).fetchone()
+            
+            if row is None or tuple(row[:3]) != key:
+                self.misses += 1
+                return None
+            self.hits += 1
+        
+        if row[5] != HASH_ALGORITHM:
+            return [row[3], row[4], None, None]
+        return [row[3], row[4], row[6], row[7]]
+    
+    def put(self, file_path, key, entry):
+        """
+        Store the data of a file
+        
+        Args:
+            file_path: Path to the file
+            key: Validation key from TagCache.file_key, taken before the file was read
+            entry: [audio_start, audio_end, quick hash, full hash]
+        """
+        if key is None:
+            return
+        
+        with self._lock:
+            self._pending[file_path] = key + (entry[0], entry[1], HASH_ALGORITHM, entry[2], entry[3])
+            if len(self._pending) >= FLUSH_INTERVAL:
+                self._flush()
+    
+    def flush(self):
+        """Commit buffered writes to disk"""
+        with self._lock:
+            self._flush()
+    
+    def close(self):
+        """Commit buffered writes and close the database"""
+        with self._lock:
+            self._flush()
+            self._connection.close()
+    
+    def stats(self):
+        """
+        Get the index counters
+        
+        Returns:
+            dict: Hits and misses since the index was opened
+        """
+        return {"hits": self.hits, "misses": self.misses}
+    
+    def _flush(self):
+        """Commit buffered writes (caller holds _lock)"""
+        if not self._pending:
+            return
+        
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, inode, audio_start, audio_end, "
+            "algorithm, quick, full) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((path,) + row for path, row in self._pending.items())
+        )
+        self._pending.clear()
+        self._connection.commit()
+
+def open_audio_hash_index(index_file=AUDIO_HASH_FILE):
+    """
+    Open the audio hash index, or return None if it can't be opened
+    
+    Args:
+        index_file: Path to the SQLite database file
+    
+    Returns:
+        AudioHashIndex: The opened index, or None
+    """
+    try:
+        return AudioHashIndex(index_file)
+    except Exception as e:
+        print(f"Error opening audio hash index: {e}")
+        return None
+
+class DuplicateFinder:
+    """
+    Finds MP3 files whose audio is identical, whatever their tags
+    
+    Only the audio between the ID3v2 tag and the ID3v1 tag is compared, in
+    three passes that each read more of fewer files:
+    
+    1. The audio region of every file is found from the ID3v2 header and
+       the file tail; files whose audio size is unique can't have a
+       duplicate.
+    2. Files sharing an audio size get a quick hash of the first and last
+       BLOCK_SIZE bytes of their audio.
+    3. Files sharing a quick hash get a full hash of their audio, read
+       through mmap.
+    
+    With an AudioHashIndex, unchanged files aren't read at all.
+    """
+    
+    def __init__(self, index=None, block_size=BLOCK_SIZE, threads=DEFAULT_THREADS):
+        """
+        Args:
+            index: AudioHashIndex to reuse and store results, or None
+            block_size: Bytes hashed at each end of the audio by the quick pass
+            threads: Number of files read at the same time
+        """
+        self.index = index
+        self.block_size = block_size
+        self.threads = max(1, threads)
+        self.metrics = get_metrics()
+        self.stats = {}
+        self._lock = threading.Lock()
+    
+    def find(self, file_paths, is_cancelled=None):
+        """
+        Find groups of files with identical audio
+        
+        Args:
+            file_paths: Iterable of MP3 file paths
+            is_cancelled: Optional callable; the search stops as soon as it
+                returns True
+        
+        Returns:
+            list: Groups as dictionaries with "audio_size", "hash" and
+                "files" (sorted paths), largest audio first; empty if the
+                search was cancelled
+        """
+        self.stats = {"files": 0, "errors": 0, "bytes_read": 0, "quick_hashed": 0, "full_hashed": 0}
+        if is_cancelled is None:
+            is_cancelled = lambda: False
+        
+        # Pass 1: audio regions; entries are [audio_start, audio_end, quick hash, full hash]
+        entries = {}
+        keys = {}
+        changed = set()
+        by_size = {}
+        for file_path, key, entry, from_index in self._map(self._find_region, file_paths, is_cancelled):
+            self.stats["files"] += 1
+            if entry is None:
+                self.stats["errors"] += 1
+                continue
+            
+            entries[file_path] = entry
+            keys[file_path] = key
+            if not from_index:
+                changed.add(file_path)
+            audio_size = entry[1] - entry[0]
+            if audio_size > 0:
+                by_size.setdefault(audio_size, []).append(file_path)
+        
+        if is_cancelled():
+            return []
+        
+        # Pass 2: quick hashes of the files whose audio size isn't unique
+        candidates = [path for paths in by_size.values() if len(paths) > 1 for path in paths]
+        missing = [path for path in candidates if entries[path][2] is None]
+        for file_path, hashes in self._map(lambda path: (path, self._quick_hash(path, entries[path])),
+                                           missing, is_cancelled):
+            self._update(file_path, entries, changed, hashes)
+        
+        by_quick = {}
+        for file_path in candidates:
+            entry = entries[file_path]
+            if entry[2] is not None:
+                by_quick.setdefault((entry[1] - entry[0], entry[2]), []).append(file_path)
+        
+        if is_cancelled():
+            return []
+        
+        # Pass 3: full hashes of the files whose quick hash isn't unique
+        candidates = [path for paths in by_quick.values() if len(paths) > 1 for path in paths]
+        missing = [path for path in candidates if entries[path][3] is None]
+        for file_path, hashes in self._map(lambda path: (path, self._full_hash(path, entries[path])),
+                                           missing, is_cancelled):
+            self._update(file_path, entries, changed, hashes)
+        
+        by_full = {}
+        for file_path in candidates:
+            entry = entries[file_path]
+            if entry[3] is not None:
+                by_full.setdefault((entry[1] - entry[0], entry[3]), []).append(file_path)
+        
+        if self.index is not None:
+            for file_path in changed:
+                self.index.put(file_path, keys[file_path], entries[file_path])
+            self.index.flush()
+        
+        if is_cancelled():
+            return []
+        
+        self.metrics.count("duplicates.bytes_read", self.stats["bytes_read"])
+        groups = [{"audio_size": audio_size, "hash": digest, "files": sorted(paths)}
+                  for (audio_size, digest), paths in by_full.items() if len(paths) > 1]
+        groups.sort(key=lambda group: (-group["audio_size"], group["files"][0]))
+        return groups
+    
+    def _map(self, func, items, is_cancelled):
+        """
+        Call func on every item on a pool of threads, yielding results in completion order
+        
+        A bounded number of items is in flight, so items can be a generator
+        over a large library.
+        """
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+        
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            pending = set()
+            while True:
+                while len(pending) < self.threads * 4 and not is_cancelled():
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    pending.add(executor.submit(func, item))
+                
+                if not pending:
+                    return
+                
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+    
+    def _update(self, file_path, entries, changed, hashes):
+        """Record the hashes computed for a file"""
+        if hashes is None:
+            self.stats["errors"] += 1
+            return
+        
+        entry = entries[file_path]
+        entry[2], entry[3] = hashes
+        changed.add(file_path)
+    
+    def _find_region(self, file_path):
+        """
+        Find the audio between the ID3v2 tag and the ID3v1 tag (runs on a pool thread)
+        
+        Returns:
+            tuple: (file_path, key, entry, whether the entry came from the
+                index); entry is None on error
+        """
+        key = TagCache.file_key(file_path)
+        if self.index is not None:
+            entry = self.index.get(file_path, key)
+            if entry is not None:
+                return file_path, key, entry, True
+        
+        if key is None:
+            print(f"Error finding duplicates of {file_path}: file not found")
+            return file_path, None, None, False
+        
+        try:
+            with self.metrics.stage("duplicates.region", file_path):
+                with open(file_path, 'rb', buffering=0) as f:
+                    file_size = key[0]
+                    header = f.read(ID3V2_HEADER_SIZE)
+                    
+                    start = 0
+                    if len(header) == ID3V2_HEADER_SIZE and header[:3] == b"ID3":
+                        start = ID3V2_HEADER_SIZE + _syncsafe_to_int(header[6:10])
+                        if header[5] & 0x10:
+                            start += ID3V2_HEADER_SIZE  # Footer present
+                        start = min(start, file_size)
+                    
+                    tail = read_tail(f.fileno(), file_size, min(TAIL_SIZE, file_size - start))
+                    end = file_size - len(find_id3v1(tail))
+            
+            self._count_read(len(header) + len(tail))
+            return file_path, key, [start, end, None, None], False
+        
+        except Exception as e:
+            print(f"Error finding duplicates of {file_path}: {e}")
+            return file_path, key, None, False
+    
+    def _quick_hash(self, file_path, entry):
+        """
+        Hash the first and last blocks of the audio (runs on a pool thread)
+        
+        Audio no longer than two blocks is hashed completely, so its quick
+        hash is also its full hash.
+        
+        Returns:
+            tuple: (quick hash, full hash or None), or None on error
+        """
+        start, end = entry[0], entry[1]
+        try:
+            with self.metrics.stage("duplicates.quick", file_path):
+                with open(file_path, 'rb', buffering=0) as f:
+                    fd = f.fileno()
+                    digest = _new_hash()
+                    if end - start <= 2 * self.block_size:
+                        data = _pread(fd, end - start, start)
+                        digest.update(data)
+                        bytes_read = len(data)
+                    else:
+                        first = _pread(fd, self.block_size, start)
+                        last = _pread(fd, self.block_size, end - self.block_size)
+                        digest.update(first)
+                        digest.update(last)
+                        bytes_read = len(first) + len(last)
+            
+            self._count_read(bytes_read, "quick_hashed")
+            quick = digest.hexdigest()
+            return quick, quick if end - start <= 2 * self.block_size else None
+        
+        except Exception as e:
+            print(f"Error hashing {file_path}: {e}")
+            return None
+    
+    def _full_hash(self, file_path, entry):
+        """
+        Hash all of the audio through a memory map (runs on a pool thread)
+        
+        Returns:
+            tuple: (quick hash, full hash), or None on error
+        """
+        start, end = entry[0], entry[1]
+        try:
+            with self.metrics.stage("duplicates.full", file_path):
+                with open(file_path, 'rb') as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        if hasattr(mapped, "madvise"):
+                            mapped.madvise(mmap.MADV_SEQUENTIAL)
+                        
+                        digest = _new_hash()
+                        view = memoryview(mapped)
+                        try:
+                            digest.update(view[start:end])
+                        finally:
+                            view.release()
+            
+            self._count_read(end - start, "full_hashed")
+            return entry[2], digest.hexdigest()
+        
+        except Exception as e:
+            print(f"Error hashing {file_path}: {e}")
+            return None
+    
+    def _count_read(self, bytes_read, counter=None):
+        """Add to the read counters (called from pool threads)"""
+        with self._lock:
+            self.stats["bytes_read"] += bytes_read
+            if counter is not None:
+                self.stats[counter] += 1
+
+def _pread(fd, size, offset):
+    """Read size bytes at offset, using os.pread where available"""
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    
+    # Windows has no pread
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
@@ -0,0 +1,138 @@
+"""
+ID3v1 - Detection and parsing of ID3v1, ID3v1.1 and Enhanced (TAG+) tags
+"""
+import os
+
+# Size of the ID3v1 tag at the end of the file
+ID3V1_SIZE = 128
+
+# Size of the Enhanced tag ("TAG+") that may precede the ID3v1 tag
+TAG_PLUS_SIZE = 227
+
+# Bytes read from the end of a file to find both
+TAIL_SIZE = ID3V1_SIZE + TAG_PLUS_SIZE
+
+# Offsets and sizes of the extended text fields of the Enhanced tag, by frame ID
+TAG_PLUS_FIELDS = {
+    "TIT2": (4, 60),
+    "TPE1": (64, 60),
+    "TALB": (124, 60),
+}
+
+# Offset and size of the free-text genre of the Enhanced tag
+TAG_PLUS_GENRE = (185, 30)
+
+# Offsets and sizes of the ID3v1 text fields the Enhanced tag continues
+ID3V1_FIELDS = {
+    "TIT2": (3, 30),
+    "TPE1": (33, 30),
+    "TALB": (63, 30),
+}
+
+def read_tail(fd, file_size, size=TAIL_SIZE):
+    """
+    Read the last bytes of a file with a single positioned read
+    
+    The file position is left unchanged where os.pread is available.
+    
+    Args:
+        fd: File descriptor of a file opened for reading
+        file_size: Size of the file
+        size: Number of bytes to read
+    
+    Returns:
+        bytes: Up to size bytes from the end of the file
+    """
+    size = min(size, file_size)
+    if size <= 0:
+        return b""
+    
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, file_size - size)
+    
+    # Windows has no pread
+    os.lseek(fd, file_size - size, os.SEEK_SET)
+    return os.read(fd, size)
+
+def find_id3v1(tail, available=None):
+    """
+    Find the ID3v1 tag, including an Enhanced tag before it, in a file tail
+    
+    Args:
+        tail: Last bytes of the file, as returned by read_tail
+        available: Number of bytes after the ID3v2 tag; tags that would
+            overlap it are ignored
+    
+    Returns:
+        bytes: The ID3v1 tag, preceded by the Enhanced tag if there is one,
+            or empty bytes if the file has no ID3v1 tag
+    """
+    if available is None:
+        available = len(tail)
+    if len(tail) < ID3V1_SIZE or available < ID3V1_SIZE or tail[-ID3V1_SIZE:-ID3V1_SIZE + 3] != b"TAG":
+        return b""
+    
+    if len(tail) >= TAIL_SIZE and available >= TAIL_SIZE and tail[-TAIL_SIZE:-TAIL_SIZE + 4] == b"TAG+":
+        return tail[-TAIL_SIZE:]
+    return tail[-ID3V1_SIZE:]
+
+def id3v1_version(v1_data):
+    """
+    Get the version of an ID3v1 tag
+    
+    Args:
+        v1_data: Result of find_id3v1
+    
+    Returns:
+        str: "1.0", "1.1" (with a track number) or None if there is no tag;
+            "+" is appended for tags with an Enhanced tag
+    """
+    if not v1_data:
+        return None
+    
+    tag = v1_data[-ID3V1_SIZE:]
+    version = "1.1" if tag[125] == 0 and tag[126] != 0 else "1.0"
+    return version + "+" if len(v1_data) == TAIL_SIZE else version
+
+def _text(data, offset, size):
+    """Decode a fixed-size, NUL padded Latin-1 text field"""
+    return data[offset:offset + size].split(b"\x00", 1)[0].decode('latin-1').rstrip(" ")
+
+def parse_id3v1(v1_data, v2_version=4):
+    """
+    Convert an ID3v1 tag to ID3v2 frames
+    
+    Title, artist and album are completed with the longer text of an
+    Enhanced tag, and its free-text genre replaces the numbered genre.
+    
+    Args:
+        v1_data: Result of find_id3v1
+        v2_version: ID3v2 minor version of the frames (3 or 4)
+    
+    Returns:
+        dict: Frames by hash key; empty if there is no tag
+    """
+    if not v1_data:
+        return {}
+    
+    from mutagen.id3 import ParseID3v1, Frames
+    
+    frames = ParseID3v1(v1_data[-ID3V1_SIZE:], v2_version) or {}
+    if len(v1_data) != TAIL_SIZE:
+        return frames
+    
+    tag_plus = v1_data[:TAG_PLUS_SIZE]
+    tag = v1_data[-ID3V1_SIZE:]
+    for frame_id, (offset, size) in TAG_PLUS_FIELDS.items():
+        extension = _text(tag_plus, offset, size)
+        if extension:
+            # The Enhanced tag holds the characters after the first 30
+            v1_offset, v1_size = ID3V1_FIELDS[frame_id]
+            text = tag[v1_offset:v1_offset + v1_size].split(b"\x00", 1)[0].decode('latin-1')
+            frames[frame_id] = Frames[frame_id](encoding=0, text=(text + extension).rstrip(" "))
+    
+    genre = _text(tag_plus, *TAG_PLUS_GENRE)
+    if genre:
+        frames["TCON"] = Frames["TCON"](encoding=0, text=genre)
+    
+    return frames
@@ -0,0 +1,355 @@
+"""
+Pipeline - Streams files through scanning, reading, decoding and saving
+"""
+import os
+import asyncio
+import threading
+import concurrent.futures
+from tag_processor.bulk_save import BulkSaver, SaveJournal
+from utils.config import JOURNAL_DIR
+
+# Maximum number of files waiting between two stages
+QUEUE_SIZE = 64
+
+# Maximum number of files decoded per worker task
+DECODE_BATCH = 32
+
+# Maximum number of files planned in the journal with a single sync
+WRITE_BATCH = 32
+
+# Seconds between checks whether the pipeline stopped while the scanner waits for room
+STOP_POLL_INTERVAL = 0.1
+
+# Marks the end of the files in a queue
+_DONE = object()
+
+class TagPipeline:
+    """
+    Processes and saves files in a streaming pipeline
+    
+    Scanning, reading, decoding and saving run at the same time as asyncio
+    stages connected by bounded queues:
+    
+        scan -> read -> decode -> save
+    
+    The scanner walks the input on a thread of its own, reading and saving
+    run on thread pools, as they wait for the disk, and decoding runs in a
+    pool of worker processes, as it is CPU bound. A stage that gets ahead
+    waits for room in the next queue, so the first files are saved while the
+    scanner is still walking, and the files in flight are bounded by the
+    queue sizes rather than by the size of the library. With discard set,
+    files are dropped from the tag store once they have been reported, so
+    memory use stays flat.
+    
+    Saving is journaled like BulkSaver, in batches of files that are planned
+    with a single sync.
+    """
+    
+    def __init__(self, tag_processor, read_threads=4, decode_workers=None, write_threads=4,
+                 queue_size=QUEUE_SIZE, save=False, discard=False, journal_dir=JOURNAL_DIR):
+        """
+        Args:
+            tag_processor: TagProcessor that processes and saves the files
+            read_threads: Number of files read at the same time
+            decode_workers: Number of worker processes that decode tags
+                (defaults to the CPU count); 1 decodes on a thread of the
+                calling process
+            write_threads: Number of files written at the same time
+            queue_size: Maximum number of files waiting between two stages
+            save: Save the changes of every file after decoding it
+            discard: Drop files from the tag store once they are reported
+            journal_dir: Directory holding the journals of all runs
+        """
+        self.tag_processor = tag_processor
+        self.read_threads = max(1, read_threads)
+        self.decode_workers = decode_workers or os.cpu_count() or 1
+        self.write_threads = max(1, write_threads)
+        self.queue_size = max(1, queue_size)
+        self.save = save
+        self.discard = discard
+        self.journal_dir = journal_dir
+        self.files = 0  # Number of files found by the scanner
+    
+    def run(self, file_paths, on_result=None, on_saved=None):
+        """
+        Run the pipeline until every file has been handled
+        
+        Args:
+            file_paths: Iterable of MP3 file paths; it is consumed lazily on
+                a separate thread, so it can be a generator that walks the
+                file system
+            on_result: Called with (file_path, tag_info) once a file has been
+                processed; tag_info is None on error
+            on_saved: Called with (file_path, result, error) once a file has
+                been saved, like the results of BulkSaver.save
+        """
+        asyncio.run(self.run_async(file_paths, on_result, on_saved))
+    
+    async def run_async(self, file_paths, on_result=None, on_saved=None):
+        """
+        Run the pipeline inside a running event loop
+        
+        The callbacks are called on the event loop's thread. See run().
+        """
+        self._on_result = on_result or (lambda file_path, tag_info: None)
+        self._on_saved = on_saved or (lambda file_path, result, error: None)
+        self._loop = asyncio.get_running_loop()
+        self._stopped = threading.Event()
+        self._journal = None
+        self.files = 0
+        
+        paths = asyncio.Queue(self.queue_size)
+        raw = asyncio.Queue(self.queue_size)
+        decoded = asyncio.Queue(self.queue_size)
+        
+        self._read_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.read_threads + 1, thread_name_prefix="pipeline-read")
+        self._write_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.write_threads, thread_name_prefix="pipeline-write")
+        self._decode_executor = self._create_decode_executor()
+        # Keep every worker process busy while the next batch is sent
+        decoders = self.decode_workers * 2 if self.decode_workers > 1 else 1
+        
+        try:
+            await asyncio.gather(
+                self._stage([self._scan(file_paths, paths)], paths, self.read_threads),
+                self._stage([self._read(paths, raw) for _ in range(self.read_threads)], raw, decoders),
+                self._stage([self._decode(raw, decoded) for _ in range(decoders)], decoded, 1),
+                self._save(decoded),
+            )
+        finally:
+            # Unblock the scanner if a stage failed, and finish the files being written
+            self._stopped.set()
+            self._read_executor.shutdown(wait=False)
+            self._decode_executor.shutdown(wait=False)
+            self._write_executor.shutdown(wait=True)
+            
+            if self._journal is not None:
+                self._journal.close(remove=not self._journal.pending())
+            if self.tag_processor.cache is not None:
+                self.tag_processor.cache.flush()
+    
+    def _create_decode_executor(self):
+        """Create the pool that decodes tags"""
+        if self.decode_workers <= 1:
+            # The tag processor's encoding counters aren't thread-safe, so decode on a single thread
+            return concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-decode")
+        return self.tag_processor.create_worker_pool(self.decode_workers)
+    
+    async def _stage(self, workers, queue, consumers):
+        """
+        Run the tasks of a stage, then tell the next stage that no more files come
+        
+        Args:
+            workers: Coroutines of the stage
+            queue: Output queue of the stage
+            consumers: Number of tasks reading the output queue
+        """
+        await asyncio.gather(*workers)
+        for _ in range(consumers):
+            await queue.put(_DONE)
+    
+    async def _get_batch(self, queue, size):
+        """
+        Wait for a file, then take whatever else is ready, up to size files
+        
+        Returns:
+            tuple: (list of items, whether the end of the queue was reached)
+        """
+        items = []
+        item = await queue.get()
+        while item is not _DONE:
+            items.append(item)
+            if len(items) >= size or queue.empty():
+                return items, False
+            item = queue.get_nowait()
+        return items, True
+    
+    async def _scan(self, file_paths, queue):
+        """Feed the file paths into the pipeline from a thread, waiting while the queue is full"""
+        loop = self._loop
+        stopped = self._stopped
+        
+        def walk():
+            for file_path in file_paths:
+                future = asyncio.run_coroutine_threadsafe(queue.put(file_path), loop)
+                while True:
+                    try:
+                        future.result(timeout=STOP_POLL_INTERVAL)
+                        break
+                    except concurrent.futures.TimeoutError:
+                        if stopped.is_set():
+                            future.cancel()
+                            return
+                self.files += 1
+        
+        await loop.run_in_executor(self._read_executor, walk)
+    
+    async def _read(self, paths, raw):
+        """Read the raw tags of files, or take their tags from the cache"""
+        loop = self._loop
+        while True:
+            file_path = await paths.get()
+            if file_path is _DONE:
+                return
+            await raw.put(await loop.run_in_executor(self._read_executor, self._read_file, file_path))
+    
+    def _read_file(self, file_path):
+        """
+        Read a file (runs on a pool thread)
+        
+        Returns:
+            tuple: ("cached", file_path, (tag_info, dirty_fields)),
+                ("raw", file_path, (tag_data, v1_data, stream_info, bytes_read, key))
+                or ("failed", file_path, None)
+        """
+        tag_processor = self.tag_processor
+        key = None
+        
+        try:
+            if tag_processor.cache is not None:
+                key = tag_processor.cache.file_key(file_path)
+                cached = tag_processor._get_cached_tags(file_path, key)
+                if cached is not None:
+                    return "cached", file_path, cached
+            
+            return "raw", file_path, tag_processor._read_raw(file_path) + (key,)
+        
+        except Exception as e:
+            print(f"Error processing {file_path}: {e}")
+            tag_processor.metrics.count("process.errors")
+            return "failed", file_path, None
+    
+    async def _decode(self, raw, decoded):
+        """Decode the raw tags of files in batches, then store and report them"""
+        tag_processor = self.tag_processor
+        
+        while True:
+            items, finished = await self._get_batch(raw, DECODE_BATCH)
+            
+            batch = []
+            for kind, file_path, data in items:
+                if kind == "cached":
+                    tag_info, dirty_fields = data
+                    tag_processor._store_result(file_path, tag_info, dirty_fields, 0)
+                    await self._processed(file_path, tag_info, decoded)
+                elif kind == "failed":
+                    tag_processor._store_result(file_path, None, [], 0)
+                    await self._processed(file_path, None, decoded)
+                else:
+                    batch.append((file_path, data))
+            
+            if batch:
+                results = await self._decode_batch([(file_path, data[0], data[1]) for file_path, data in batch])
+                
+                for (file_path, data), (_, tag_info, dirty_fields) in zip(batch, results):
+                    _, _, stream_info, bytes_read, key = data
+                    if stream_info is not None:
+                        tag_info.update(stream_info)
+                    tag_processor.metrics.count("process.bytes_read", bytes_read)
+                    tag_processor._store_result(file_path, tag_info, dirty_fields, bytes_read, key)
+                    await self._processed(file_path, tag_info, decoded)
+            
+            if finished:
+                return
+    
+    async def _decode_batch(self, items):
+        """
+        Decode raw tags, in a worker process if there is a pool of them
+        
+        Args:
+            items: List of (file_path, tag_data, v1_data) tuples
+        
+        Returns:
+            list: (file_path, tag_info, dirty_fields) tuples
+        """
+        tag_processor = self.tag_processor
+        
+        if isinstance(self._decode_executor, concurrent.futures.ProcessPoolExecutor):
+            from tag_processor.processor import _decode_chunk
+            
+            results, encoding_stats, metrics = await asyncio.wrap_future(
+                self._decode_executor.submit(_decode_chunk, items))
+            tag_processor._merge_worker_stats(encoding_stats, metrics)
+            return results
+        
+        def decode():
+            return [(file_path,) + tag_processor._process_id3_tags(file_path, tag_data, v1_data)
+                    for file_path, tag_data, v1_data in items]
+        
+        return await self._loop.run_in_executor(self._decode_executor, decode)
+    
+    async def _processed(self, file_path, tag_info, decoded):
+        """Report a processed file and pass it on to be saved"""
+        self._on_result(file_path, tag_info)
+        
+        if tag_info is None or not self.save:
+            self._done(file_path)
+        else:
+            await decoded.put(file_path)
+    
+    async def _save(self, decoded):
+        """Save the changes of the decoded files"""
+        tag_processor = self.tag_processor
+        saver = BulkSaver(tag_processor, self.write_threads, self.journal_dir)
+        # Keep a few files queued per thread so no thread waits for work
+        slots = asyncio.Semaphore(self.write_threads * 2)
+        writing = set()
+        
+        while True:
+            file_paths, finished = await self._get_batch(decoded, WRITE_BATCH)
+            
+            dirty_paths = []
+            for file_path in file_paths:
+                if tag_processor.is_dirty(file_path):
+                    dirty_paths.append(file_path)
+                    continue
+                
+                # Nothing to write, so this doesn't touch the file
+                try:
+                    self._saved(file_path, tag_processor.save_changes(file_path), None)
+                except Exception as e:
+                    self._saved(file_path, None, str(e))
+            
+            if dirty_paths:
+                if self._journal is None:
+                    self._journal = SaveJournal.create(self.journal_dir)
+                plans = [(file_path, tag_processor.store[file_path], tag_processor.store.dirty_fields(file_path))
+                         for file_path in dirty_paths]
+                await self._loop.run_in_executor(self._write_executor, self._journal.plan, plans)
+                
+                for file_path in dirty_paths:
+                    await slots.acquire()
+                    task = asyncio.ensure_future(self._save_file(saver, file_path, slots))
+                    writing.add(task)
+                    task.add_done_callback(writing.discard)
+            
+            if finished:
+                break
+        
+        if writing:
+            await asyncio.gather(*writing)
+    
+    async def _save_file(self, saver, file_path, slots):
+        """Back up and save one file on the write pool, then record it in the journal"""
+        try:
+            result = await self._loop.run_in_executor(self._write_executor, saver._save_file,
+                                                      self._journal, file_path)
+        except Exception as e:
+            self._journal.finish(file_path, error=str(e))
+            self._saved(file_path, None, str(e))
+        else:
+            self._journal.finish(file_path, result)
+            self._saved(file_path, result, None)
+        finally:
+            slots.release()
+    
+    def _saved(self, file_path, result, error):
+        """Report a saved file"""
+        self._on_saved(file_path, result, error)
+        self._done(file_path)
+    
+    def _done(self, file_path):
+        """Forget a file that has gone through the pipeline, if requested"""
+        if self.discard:
+            self.tag_processor.store.discard(file_path)
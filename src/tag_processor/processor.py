@@ -2,16 +2,284 @@
 MP3 Tag Processor - Handles the processing of MP3 tags
 """
 import os
-import chardet
-from mutagen.id3 import ID3, ID3NoHeaderError
-from mutagen.mp3 import MP3
-from mutagen.id3 import TIT2, TPE1, TALB, TDRC, TCON
+import io
+import sys
+import time
+import functools
+import threading
+from mutagen.id3 import ID3, ID3NoHeaderError, Frames, Frames_2_2
+from mutagen.id3 import TIT2, TPE1, TALB, TDRC, TCON, TRCK, TPOS, TPE2, TCOM, TBPM, COMM, USLT, TXXX, APIC
+from tag_processor.artwork import (ARTWORK_FIELD, FRONT_COVER, ArtworkChange, read_artwork, front_cover,
+                                   scale_image, image_mime)
+from tag_processor.tag_writer import TagWriter
+from tag_processor.id3v1 import TAIL_SIZE, read_tail, find_id3v1, id3v1_version, parse_id3v1
+from tag_processor.tag_store import TagStore
+from utils.instrumentation import get_metrics
+
+# ID3v2 text frames read and written for each tag field
+TAG_FRAMES = {
+    "title": TIT2,
+    "artist": TPE1,
+    "album": TALB,
+    "year": TDRC,
+    "genre": TCON,
+    "track": TRCK,
+    "disc": TPOS,
+    "album_artist": TPE2,
+    "composer": TCOM,
+    "bpm": TBPM
+}
+
+# Frames with a language and a description; the field is the frame without a description
+DESCRIBED_FRAMES = {
+    "comment": COMM,
+    "lyrics": USLT
+}
+
+# Fields of user-defined text frames (TXXX) are this prefix followed by the frame's description
+TXXX_PREFIX = "txxx:"
+
+# Fields read by default; "txxx" stands for all user-defined text frames
+ALL_FIELDS = tuple(TAG_FRAMES) + tuple(DESCRIBED_FRAMES) + ("txxx",)
+
+# Frames of older ID3v2 versions that are converted to a frame above
+LEGACY_FRAMES = {"TDRC": ("TYER", "TDAT", "TIME")}
+
+# Field of each frame ID
+FRAME_FIELDS = {frame_class.__name__: key for frames in (TAG_FRAMES, DESCRIBED_FRAMES)
+                for key, frame_class in frames.items()}
+
+# Upper bound for the number of files sent to a worker process in one task
+MAX_CHUNK_SIZE = 64
+
+# Seconds between cancellation checks while waiting for worker processes
+CANCEL_POLL_INTERVAL = 0.05
+
+# Size of the ID3v2 header and footer
+ID3V2_HEADER_SIZE = 10
+
+# Pseudo field marking a file whose ID3v1 tag is removed when it is saved
+ID3V1_FIELD = "id3v1"
+
+# Number of distinct byte strings whose detected encoding is remembered
+ENCODING_MEMO_SIZE = 65536
+
+# Tag processor used inside each worker process of process_files
+_worker_processor = None
+
+def is_tag_field(key):
+    """
+    Check whether a field is stored in a frame of the ID3v2 tag
+    
+    Args:
+        key: Field name, e.g. "title" or "txxx:MusicBrainz Album Id"
+        
+    Returns:
+        bool: True for fields that save_changes writes
+    """
+    return key in TAG_FRAMES or key in DESCRIBED_FRAMES or (key.startswith(TXXX_PREFIX) and key != TXXX_PREFIX)
+
+@functools.lru_cache(maxsize=None)
+def _known_frames(fields):
+    """
+    Get the frame classes mutagen decodes for a projection
+    
+    Frames that are not in the result are kept as raw bytes, so their
+    text (e.g. lyrics) or data is never decoded.
+    
+    Args:
+        fields: Tuple of fields, see ALL_FIELDS
+        
+    Returns:
+        dict: Frame ID -> frame class, for ID3v2.2 and later frame IDs
+    """
+    frame_ids = set()
+    for field in fields:
+        if field == "txxx":
+            frame_ids.add("TXXX")
+        else:
+            frame_id = (TAG_FRAMES.get(field) or DESCRIBED_FRAMES[field]).__name__
+            frame_ids.add(frame_id)
+            frame_ids.update(LEGACY_FRAMES.get(frame_id, ()))
+    
+    known_frames = {frame_id: Frames[frame_id] for frame_id in frame_ids}
+    # ID3v2.2 frames have three letter IDs and subclass the frames they were renamed to
+    for frame_id, frame_class in Frames_2_2.items():
+        if frame_class.__base__.__name__ in frame_ids:
+            known_frames[frame_id] = frame_class
+    return known_frames
+
+def _init_worker(options, metrics_enabled=True):
+    """Set up the tag processor of a worker process"""
+    global _worker_processor
+    _worker_processor = TagProcessor(**options)
+    _worker_processor.metrics.enabled = metrics_enabled
+    
+    # Send worker diagnostics to stderr so they never mix with the caller's output
+    sys.stdout = sys.stderr
+
+def _process_chunk(file_paths):
+    """
+    Process a chunk of files inside a worker process
+    
+    Args:
+        file_paths: List of MP3 file paths
+        
+    Returns:
+        tuple: (list of (file_path, tag_info, dirty_fields, bytes_read) tuples,
+                encoding detection counters of the chunk,
+                instrumentation snapshot of the chunk)
+    """
+    results = [(file_path,) + _worker_processor._read_file(file_path) for file_path in file_paths]
+    return (results,) + _take_worker_stats()
+
+def _decode_chunk(items):
+    """
+    Decode raw tags that were read by the calling process, inside a worker process
+    
+    Args:
+        items: List of (file_path, tag_data, v1_data) tuples
+        
+    Returns:
+        tuple: (list of (file_path, tag_info, dirty_fields) tuples,
+                encoding detection counters of the chunk,
+                instrumentation snapshot of the chunk)
+    """
+    results = [(file_path,) + _worker_processor._process_id3_tags(file_path, tag_data, v1_data)
+               for file_path, tag_data, v1_data in items]
+    return (results,) + _take_worker_stats()
+
+def _take_worker_stats():
+    """Get and reset the encoding counters and timings of a worker process"""
+    encoding_stats = _worker_processor.encoding_stats
+    _worker_processor.encoding_stats = dict.fromkeys(encoding_stats, 0)
+    
+    metrics = _worker_processor.metrics.snapshot()
+    _worker_processor.metrics.reset()
+    
+    return encoding_stats, metrics
+
+@functools.lru_cache(maxsize=ENCODING_MEMO_SIZE)
+def _detect_encoding(value_bytes):
+    """
+    Detect the encoding of a byte string
+    
+    Results are memoized, as artist and album names repeat across a library.
+    chardet is only imported once a field actually needs detection, since
+    loading its models takes longer than starting the rest of the program.
+    
+    Args:
+        value_bytes: Byte string to examine
+        
+    Returns:
+        str: Name of the detected encoding, or None
+    """
+    import chardet
+    return chardet.detect(value_bytes)['encoding']
+
+def _syncsafe_to_int(data):
+    """
+    Decode a 4-byte ID3v2 synchsafe integer
+    
+    Args:
+        data: 4 bytes, each carrying 7 bits of the value
+        
+    Returns:
+        int: Decoded value
+    """
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+class CountingFile(io.RawIOBase):
+    """Read-only file wrapper that counts the bytes read through it"""
+    
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.name = getattr(fileobj, "name", "<unknown>")
+        self.bytes_read = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.bytes_read += len(data)
+        return data
+    
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.fileobj.seek(offset, whence)
+    
+    def tell(self):
+        return self.fileobj.tell()
+    
+    def fileno(self):
+        return self.fileobj.fileno()
 
 class TagProcessor:
     """Class for processing MP3 tags"""
     
-    def __init__(self):
-        self.processed_files = {}  # Store processed file data for later saving
+    def __init__(self, read_stream_info=False, cache=None, detect_per_file=False, tag_writer=None,
+                 tag_store=None, metrics=None, fields=None):
+        """
+        Args:
+            read_stream_info: Also read the audio stream information (length
+                and bitrate), which needs to scan the audio frames
+            cache: Optional TagCache used to skip files that haven't changed
+            detect_per_file: Detect the encoding once per file on all of its
+                fields together instead of once per field
+            tag_writer: TagWriter used by save_changes (defaults to one with
+                the default padding policy)
+            tag_store: TagStore holding the processed tags (defaults to an
+                in-memory store)
+            metrics: Instrumentation receiving per-stage timings (defaults to
+                the process-wide instance)
+            fields: Fields to read (defaults to ALL_FIELDS); the frames of
+                other fields are not decoded. Projected results are not
+                added to the cache.
+        
+        Raises:
+            ValueError: If a field is unknown
+        """
+        if fields is not None:
+            fields = tuple(fields)
+            unknown = [field for field in fields if field not in ALL_FIELDS]
+            if unknown:
+                raise ValueError(f"Unknown field: {unknown[0]} (known fields: {', '.join(ALL_FIELDS)})")
+        self.fields = fields
+        self._fields = fields if fields is not None else ALL_FIELDS
+        self._known_frames = _known_frames(self._fields)
+        # Frames of the fields that aren't read keep their ID3v1 values when a file is saved
+        self._v1_kept = tuple(frame_id for frame_id, key in FRAME_FIELDS.items() if key not in self._fields)
+        self.read_stream_info = read_stream_info
+        self.cache = cache
+        self.detect_per_file = detect_per_file
+        self.tag_writer = tag_writer or TagWriter()
+        
+        # How often encoding detection was skipped, served from the memo or run
+        self.encoding_stats = {"skipped": 0, "memoized": 0, "detected": 0}
+        
+        # How many saves were skipped, written in place or rewrote the file
+        self.write_stats = {"skipped": 0, "in_place": 0, "rewritten": 0, "bytes_written": 0}
+        self._write_lock = threading.Lock()  # save_changes may run on several threads
+        
+        # Processed tags, dirty fields and bytes read of every file, for later saving
+        self.store = tag_store if tag_store is not None else TagStore()
+        self.metrics = metrics if metrics is not None else get_metrics()
+        
+        # Artwork changes written by the next save; pictures are too large for the store
+        self._artwork_changes = {}  # file path -> ArtworkChange
+    
+    @property
+    def processed_files(self):
+        """Read-only mapping of file path to processed tag information"""
+        return self.store
     
     def process_file(self, file_path):
         """
@@ -23,27 +291,508 @@ class TagProcessor:
         Returns:
             dict: Dictionary containing the tag information
         """
+        key = None
+        if self.cache is not None:
+            key = self.cache.file_key(file_path)
+            cached = self._get_cached_tags(file_path, key)
+            if cached is not None:
+                tag_info, dirty_fields = cached
+                self._store_result(file_path, tag_info, dirty_fields, 0)
+                return tag_info
+        
+        return self._process_uncached(file_path, key)
+    
+    def process_files(self, file_paths, workers=None, chunk_size=None, is_cancelled=None, executor=None):
+        """
+        Process the tags of many MP3 files using a pool of worker processes
+        
+        Results are yielded as soon as they are available, so they do not
+        necessarily come in the order of file_paths. Closing the generator
+        cancels the files that have not been started yet.
+        
+        Args:
+            file_paths: List of MP3 file paths
+            workers: Number of worker processes (defaults to the CPU count);
+                1 processes the files in the calling process
+            chunk_size: Number of files sent to a worker per task (defaults
+                to a size that keeps every worker busy with low IPC overhead)
+            is_cancelled: Optional callable; processing stops as soon as it
+                returns True
+            executor: Optional pool from create_worker_pool to use instead
+                of starting one for this call; it is left running
+            
+        Yields:
+            tuple: (file_path, tag_info), where tag_info is None on error
+        """
+        file_paths = list(file_paths)
+        
+        if not workers or workers < 1:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(file_paths))
+        
+        if is_cancelled is None:
+            is_cancelled = lambda: False
+        
+        if workers <= 1:
+            for file_path in file_paths:
+                if is_cancelled():
+                    return
+                yield file_path, self.process_file(file_path)
+            return
+        
+        # Serve unchanged files from the cache; only the rest goes to the workers
+        keys = {}
+        if self.cache is not None:
+            uncached_paths = []
+            for file_path in file_paths:
+                if is_cancelled():
+                    return
+                
+                key = self.cache.file_key(file_path)
+                cached = self._get_cached_tags(file_path, key)
+                if cached is None:
+                    keys[file_path] = key
+                    uncached_paths.append(file_path)
+                else:
+                    tag_info, dirty_fields = cached
+                    self._store_result(file_path, tag_info, dirty_fields, 0)
+                    yield file_path, tag_info
+            
+            file_paths = uncached_paths
+            workers = min(workers, len(file_paths))
+            
+            if workers <= 1:
+                for file_path in file_paths:
+                    if is_cancelled():
+                        return
+                    yield file_path, self._process_uncached(file_path, keys[file_path])
+                self.cache.flush()
+                return
+        
+        if not chunk_size:
+            # Aim for several chunks per worker so slow files don't leave workers idle
+            chunk_size = max(1, min(MAX_CHUNK_SIZE, len(file_paths) // (workers * 4)))
+        
+        chunks = (file_paths[i:i + chunk_size] for i in range(0, len(file_paths), chunk_size))
+        
+        from concurrent.futures import FIRST_COMPLETED, wait
+        
+        own_executor = executor is None
+        if own_executor:
+            executor = self.create_worker_pool(workers)
+        pending = set()
         try:
-            # Check if file exists
-            if not os.path.isfile(file_path):
-                raise FileNotFoundError(f"File not found: {file_path}")
+            # Keep a bounded number of chunks in flight to limit memory use
+            for chunk in chunks:
+                pending.add(executor.submit(_process_chunk, chunk))
+                while len(pending) >= workers * 2:
+                    if is_cancelled():
+                        return
+                    done, pending = wait(pending, timeout=CANCEL_POLL_INTERVAL,
+                                         return_when=FIRST_COMPLETED)
+                    for result in self._collect_chunks(done, keys):
+                        yield result
             
-            # Load the MP3 file
-            audio = MP3(file_path)
+            while pending:
+                if is_cancelled():
+                    return
+                done, pending = wait(pending, timeout=CANCEL_POLL_INTERVAL,
+                                     return_when=FIRST_COMPLETED)
+                for result in self._collect_chunks(done, keys):
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+            if own_executor:
+                executor.shutdown(wait=False)
             
-            # Process ID3 tags
-            tag_info = self._process_id3_tags(file_path, audio)
+            if self.cache is not None:
+                self.cache.flush()
+    
+    def create_worker_pool(self, workers):
+        """
+        Start a pool of worker processes that read files like this processor
+        
+        Starting the processes takes a large part of a second, so callers
+        that process files in several calls can share one pool between them.
+        
+        Args:
+            workers: Number of worker processes
+            
+        Returns:
+            ProcessPoolExecutor: The pool; the caller shuts it down
+        """
+        # Imported here, as most sessions never start worker processes
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        
+        # Spawn instead of fork: forking a process that runs Qt threads is unsafe
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=self._worker_options())
+    
+    def _collect_chunks(self, futures, keys):
+        """
+        Store the results of finished worker tasks
+        
+        Args:
+            futures: Finished futures of _process_chunk calls
+            keys: Cache validation keys of the files, taken before they were read
             
-            # Store processed data for later saving
-            self.processed_files[file_path] = tag_info
+        Yields:
+            tuple: (file_path, tag_info), where tag_info is None on error
+        """
+        for future in futures:
+            results, encoding_stats, metrics = future.result()
+            self._merge_worker_stats(encoding_stats, metrics)
             
-            return tag_info
+            for file_path, tag_info, dirty_fields, bytes_read in results:
+                self._store_result(file_path, tag_info, dirty_fields, bytes_read, keys.get(file_path))
+                yield file_path, tag_info
+    
+    def _merge_worker_stats(self, encoding_stats, metrics):
+        """
+        Add the counters and timings of a worker task to those of this processor
+        
+        Args:
+            encoding_stats: Encoding detection counters of the task
+            metrics: Instrumentation snapshot of the task
+        """
+        for key, count in encoding_stats.items():
+            self.encoding_stats[key] += count
+        self.metrics.merge(metrics)
+    
+    def _worker_options(self):
+        """Get the arguments that set up the tag processor of a worker process"""
+        return ({"read_stream_info": self.read_stream_info, "detect_per_file": self.detect_per_file,
+                 "fields": self.fields},
+                self.metrics.enabled)
+    
+    def _get_cached_tags(self, file_path, key):
+        """
+        Look up the tags of an unchanged file in the cache
+        
+        Args:
+            file_path: Path to the MP3 file
+            key: Cache validation key of the file
+            
+        Returns:
+            tuple: (tag_info, dirty_fields), or None if the file must be read
+        """
+        # Entries cached without stream info can't serve a request for it
+        required_fields = ("length", "bitrate") if self.read_stream_info else ()
+        cached = self.cache.get(file_path, key, required_fields, self._cache_options())
+        if cached is None or self.fields is None:
+            return cached
+        return self._project(*cached)
+    
+    def _cache_options(self):
+        """Get the options that change the processed tags, which cache entries must match"""
+        # Detecting the encoding per file can decode the same bytes differently
+        return {"detect_per_file": self.detect_per_file}
+    
+    def _project(self, tag_info, dirty_fields):
+        """
+        Reduce the cached result of a full read to the fields being read
+        
+        Args:
+            tag_info: Dictionary containing the tag information of all fields
+            dirty_fields: Fields changed by processing
+            
+        Returns:
+            tuple: (tag_info, dirty_fields) of the projected fields
+        """
+        def projected(key):
+            if key.startswith(TXXX_PREFIX):
+                return "txxx" in self._fields
+            return key in self._fields or not is_tag_field(key)
+        
+        projected_dirty = [key for key in dirty_fields if key == ID3V1_FIELD or projected(key)]
+        if len(projected_dirty) < len(dirty_fields):
+            # Removing the ID3v1 tag would lose the values of fields that aren't written
+            projected_dirty = [key for key in projected_dirty if key != ID3V1_FIELD]
+        
+        return {key: value for key, value in tag_info.items() if projected(key)}, projected_dirty
+    
+    def _process_uncached(self, file_path, key):
+        """
+        Read the tags of an MP3 file and store the result
+        
+        Args:
+            file_path: Path to the MP3 file
+            key: Cache validation key taken before reading, or None
+            
+        Returns:
+            dict: Dictionary containing the tag information, or None on error
+        """
+        tag_info, dirty_fields, bytes_read = self._read_file(file_path)
+        self._store_result(file_path, tag_info, dirty_fields, bytes_read, key)
+        return tag_info
+    
+    def _store_result(self, file_path, tag_info, dirty_fields, bytes_read, key=None):
+        """
+        Store processed data for later saving
+        
+        Args:
+            file_path: Path to the MP3 file
+            tag_info: Dictionary containing the tag information, or None on error
+            dirty_fields: Fields changed by processing, which need to be saved
+            bytes_read: Number of bytes read from the file
+            key: Cache validation key; the result is cached if given
+        """
+        self.store.put(file_path, tag_info, dirty_fields, bytes_read)
+        self._artwork_changes.pop(file_path, None)  # Dropped like edits of the earlier tags
+        
+        # Only full reads are cached, so every entry can serve any projection
+        if tag_info is not None and key is not None and self.cache is not None and self.fields is None:
+            self.cache.put(file_path, key, tag_info, dirty_fields, self._cache_options())
+    
+    def set_tag(self, file_path, key, value):
+        """
+        Change a tag of a processed file and mark it for saving
+        
+        Args:
+            file_path: Path to the MP3 file
+            key: Tag field, e.g. "title"
+            value: New value of the field
+        """
+        if file_path not in self.store:
+            raise ValueError(f"File {file_path} has not been processed yet")
+        
+        self.store.set_value(file_path, key, value)
+    
+    def set_tags(self, changes):
+        """
+        Change many tags at once and mark them for saving, e.g. the changes
+        computed by a RuleSet
+        
+        Args:
+            changes: Iterable of (file_path, key, value) tuples
+            
+        Returns:
+            int: Number of values that changed
+        """
+        try:
+            return self.store.set_values(changes)
+        except KeyError as e:
+            raise ValueError(f"File {e.args[0]} has not been processed yet")
+    
+    def read_artwork(self, file_path):
+        """
+        Read the picture shown for a file, as it is in the file
+        
+        Only the picture frames are read, see artwork.read_pictures; the
+        file doesn't need to be processed first.
+        
+        Args:
+            file_path: Path to the MP3 file
+            
+        Returns:
+            dict: "mime", "type", "desc" and "data" of the front cover (or
+                of the first picture), or None if the file has no artwork
+            
+        Raises:
+            OSError: If the file can't be read
+        """
+        with self.metrics.stage("artwork.read", file_path):
+            return read_artwork(file_path)
+    
+    def set_artwork(self, file_paths, data, mime=None, max_size=None):
+        """
+        Replace the front cover of processed files when they are saved
+        
+        Other pictures, e.g. a back cover, are kept. The image is kept once
+        in memory, however many files it is set for.
+        
+        Args:
+            file_paths: Paths of the MP3 files
+            data: Image bytes
+            mime: MIME type of the image (detected from the data by default)
+            max_size: Shrink the image to fit into a square of this many
+                pixels first
+            
+        Raises:
+            ValueError: If a file hasn't been processed or the data isn't a
+                JPEG, PNG or GIF image
+        """
+        mime = mime or image_mime(data)
+        if mime is None:
+            raise ValueError("The artwork must be a JPEG, PNG or GIF image")
+        if max_size:
+            scaled = scale_image(data, max_size)
+            if scaled is not None:
+                data, mime = scaled
+        self._change_artwork(file_paths, ArtworkChange("replace", data, mime, None))
+    
+    def strip_artwork(self, file_paths):
+        """
+        Remove all pictures of processed files when they are saved
+        
+        Args:
+            file_paths: Paths of the MP3 files
+            
+        Raises:
+            ValueError: If a file hasn't been processed
+        """
+        self._change_artwork(file_paths, ArtworkChange("strip", None, None, None))
+    
+    def resize_artwork(self, file_paths, max_size):
+        """
+        Shrink the pictures of processed files when they are saved
+        
+        Pictures that already fit are left as they are.
+        
+        Args:
+            file_paths: Paths of the MP3 files
+            max_size: Maximum width and height in pixels
+            
+        Raises:
+            ValueError: If a file hasn't been processed
+        """
+        self._change_artwork(file_paths, ArtworkChange("resize", None, None, max_size))
+    
+    def _change_artwork(self, file_paths, change):
+        """Remember an artwork change for files and mark them for saving"""
+        file_paths = list(file_paths)
+        for file_path in file_paths:
+            if file_path not in self.store:
+                raise ValueError(f"File {file_path} has not been processed yet")
+        
+        for file_path in file_paths:
+            self.store.mark_dirty(file_path, ARTWORK_FIELD)
+            self._artwork_changes[file_path] = change
+    
+    def is_dirty(self, file_path):
+        """
+        Check whether a file has changes that need to be saved
+        
+        Args:
+            file_path: Path to the MP3 file
+            
+        Returns:
+            bool: True if the file has unsaved changes
+        """
+        return self.store.is_dirty(file_path)
+    
+    def clear(self):
+        """Forget all processed files, e.g. before a new set of files is loaded"""
+        self.store.clear()
+        self._artwork_changes.clear()
+    
+    def close(self):
+        """Write pending cache entries to disk and close the cache and the store"""
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        self.store.close()
+    
+    def _read_file(self, file_path):
+        """
+        Read and process the tags of an MP3 file without storing them
+        
+        The file is opened once and only the ID3v2 tag at its start and the
+        ID3v1 tag at its end are read, unless read_stream_info is set.
+        
+        Args:
+            file_path: Path to the MP3 file
+            
+        Returns:
+            tuple: (tag_info, dirty_fields, bytes_read), where tag_info is
+                None on error and dirty_fields lists the fields changed by
+                processing
+        """
+        bytes_read = 0
+        metrics = self.metrics
+        start = time.perf_counter()
+        
+        try:
+            tag_data, v1_data, stream_info, bytes_read = self._read_raw(file_path)
+            
+            # Process ID3 tags
+            tag_info, dirty_fields = self._process_id3_tags(file_path, tag_data, v1_data)
+            if stream_info is not None:
+                tag_info.update(stream_info)
+            
+            return tag_info, dirty_fields, bytes_read
             
         except Exception as e:
             print(f"Error processing {file_path}: {e}")
-            return None
+            metrics.count("process.errors")
+            return None, [], bytes_read
+        finally:
+            metrics.record("process", time.perf_counter() - start, file_path)
+            metrics.count("process.bytes_read", bytes_read)
+    
+    def _read_raw(self, file_path):
+        """
+        Read the raw tags of an MP3 file, and its stream info if requested
+        
+        This is the I/O part of _read_file; the tags are decoded by
+        _process_id3_tags, which may run in another process.
+        
+        Args:
+            file_path: Path to the MP3 file
+            
+        Returns:
+            tuple: (ID3v2 tag bytes, ID3v1 tag bytes, dictionary with length
+                and bitrate or None, bytes_read)
+            
+        Raises:
+            Exception: If the file can't be read
+        """
+        # Check if file exists
+        if not os.path.isfile(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        
+        stream_info = None
+        with open(file_path, 'rb', buffering=0) as f:
+            f = CountingFile(f)
+            with self.metrics.stage("read", file_path):
+                tag_data, v1_data = self._read_tag_data(f)
+            
+            # Scanning the audio frames is expensive, so only do it on request
+            if self.read_stream_info:
+                from mutagen.mp3 import MP3
+                
+                with self.metrics.stage("stream_info", file_path):
+                    f.seek(0)
+                    info = MP3(f).info
+                stream_info = {"length": round(info.length, 3), "bitrate": info.bitrate}
+        
+        return tag_data, v1_data, stream_info, f.bytes_read
     
-    def _process_id3_tags(self, file_path, audio):
+    def _read_tag_data(self, f):
+        """
+        Read the raw ID3v2 and ID3v1 tags of an open MP3 file
+        
+        Only the bytes declared by the ID3v2 header and, with one positioned
+        read, the last bytes of the file that can hold an ID3v1 tag and an
+        Enhanced tag are read.
+        
+        Args:
+            f: MP3 file opened in binary mode
+            
+        Returns:
+            tuple: (ID3v2 tag bytes, ID3v1 tag bytes including any Enhanced
+                tag); either may be empty
+        """
+        tag_data = f.read(ID3V2_HEADER_SIZE)
+        
+        if len(tag_data) == ID3V2_HEADER_SIZE and tag_data[:3] == b"ID3":
+            tag_size = _syncsafe_to_int(tag_data[6:10])
+            if tag_data[5] & 0x10:
+                tag_size += ID3V2_HEADER_SIZE  # Footer present
+            tag_data += f.read(tag_size)
+        else:
+            tag_data = b""
+        
+        # The ID3v1 tag can only be present after the ID3v2 tag
+        file_size = f.seek(0, io.SEEK_END)
+        tail = read_tail(f.fileno(), file_size, min(TAIL_SIZE, file_size - len(tag_data)))
+        f.bytes_read += len(tail)
+        
+        return tag_data, find_id3v1(tail)
+    
+    def _process_id3_tags(self, file_path, tag_data, v1_data):
         """
         Process ID3 tags according to requirements:
         1. If only ID3v1 exists, copy it to ID3v2
@@ -51,50 +800,79 @@ class TagProcessor:
         3. If both exist, discard ID3v1
         4. Identify encoding and convert to UTF-8
         
+        ID3v1 values only fill in fields that the ID3v2 tag lacks, and are
+        marked for saving. A file with an ID3v1 tag gets the ID3V1_FIELD
+        pseudo field marked, so saving removes the ID3v1 tag once its values
+        are in the ID3v2 tag.
+        
         Args:
             file_path: Path to the MP3 file
-            audio: Mutagen MP3 object
+            tag_data: Raw ID3v2 tag bytes, including the header
+            v1_data: Raw ID3v1 tag bytes, including any Enhanced tag
             
         Returns:
-            dict: Dictionary containing the processed tag information
+            tuple: (dictionary containing the processed tag information,
+                    list of fields whose value was changed by processing)
         """
-        tag_info = {
-            "title": "",
-            "artist": "",
-            "album": "",
-            "year": "",
-            "genre": ""
-        }
+        tag_info = self._empty_tags()
         
         try:
-            # Try to load ID3 tags
-            id3 = ID3(file_path)
+            parse_start = time.perf_counter()
             
-            # Check if we have ID3v2 tags
-            has_id3v2 = len(id3) > 0
+            # Parse the ID3v2 tag from the bytes that were read; frames of other fields stay undecoded
+            id3 = ID3()
+            if tag_data:
+                id3.load(io.BytesIO(tag_data), known_frames=self._known_frames, translate=False, load_v1=False)
+            
+            # Fill in frames that are only present in the ID3v1 tag
+            v1_frame_ids = set()
+            if v1_data:
+                v2_version = 4 if id3.version[1] == 4 else 3
+                for frame in parse_id3v1(v1_data, v2_version).values():
+                    if frame.FrameID == "COMM":
+                        # The ID3v1 comment is the file's comment
+                        frame.desc = ""
+                        present = any(not comment.desc for comment in id3.getall("COMM"))
+                    else:
+                        present = bool(id3.getall(frame.HashKey))
+                    if not present:
+                        id3.add(frame)
+                        v1_frame_ids.add(frame.FrameID)
+                self.metrics.count("id3v1." + id3v1_version(v1_data))
             
-            # Check if we have ID3v1 tags (this is a simplification, as mutagen doesn't directly expose ID3v1)
-            # In a real implementation, we would need to use a different approach to check for ID3v1
-            # For now, we'll assume ID3v1 exists if certain basic tags are present in a specific format
+            # Normalize to ID3v2.4 like a regular load would
+            id3.update_to_v24()
             
-            # Extract tag information from ID3v2
-            if has_id3v2:
+            # Extract tag information
+            if len(id3) > 0:
                 tag_info = self._extract_id3v2_tags(id3)
+            self.metrics.record("parse", time.perf_counter() - parse_start, file_path)
             
             # Convert encodings to UTF-8 if needed
-            tag_info = self._convert_encodings(tag_info)
+            original = dict(tag_info)
+            with self.metrics.stage("detect", file_path):
+                tag_info = self._convert_encodings(tag_info)
+            dirty_fields = [key for key, value in tag_info.items() if original.get(key) != value]
             
-            return tag_info
+            # Fields only found in the ID3v1 tag need to be copied to ID3v2
+            v1_fields = [FRAME_FIELDS[frame_id] for frame_id in v1_frame_ids]
+            for key in v1_fields:
+                if tag_info.get(key) and key not in dirty_fields:
+                    dirty_fields.append(key)
             
-        except ID3NoHeaderError:
-            # No ID3 header found, create a new one
-            id3 = ID3()
-            id3.save(file_path)
-            return tag_info
+            # The ID3v1 tag is redundant once its values are in the ID3v2 tag, unless some aren't read
+            if v1_data and all(key in tag_info for key in v1_fields):
+                dirty_fields.append(ID3V1_FIELD)
+            
+            return tag_info, dirty_fields
         
         except Exception as e:
             print(f"Error processing ID3 tags for {file_path}: {e}")
-            return tag_info
+            return tag_info, []
+    
+    def _empty_tags(self):
+        """Get the tag information of a file without tags"""
+        return {key: "" for key in self._fields if key != "txxx"}
     
     def _extract_id3v2_tags(self, id3):
         """
@@ -104,35 +882,26 @@ class TagProcessor:
             id3: Mutagen ID3 object
             
         Returns:
-            dict: Dictionary containing the tag information
+            dict: Dictionary containing the tag information of the fields
+                being read
         """
-        tag_info = {
-            "title": "",
-            "artist": "",
-            "album": "",
-            "year": "",
-            "genre": ""
-        }
+        tag_info = self._empty_tags()
         
-        # Extract title
-        if 'TIT2' in id3:
-            tag_info["title"] = str(id3['TIT2'])
+        for key in tag_info:
+            if key in TAG_FRAMES:
+                frame_id = TAG_FRAMES[key].__name__
+                if frame_id in id3:
+                    tag_info[key] = str(id3[frame_id])
+            else:
+                # Frames with a description are application data, e.g. iTunes' normalization
+                frames = [frame for frame in id3.getall(DESCRIBED_FRAMES[key].__name__) if not frame.desc]
+                if frames:
+                    tag_info[key] = str(frames[0])
         
-        # Extract artist
-        if 'TPE1' in id3:
-            tag_info["artist"] = str(id3['TPE1'])
-        
-        # Extract album
-        if 'TALB' in id3:
-            tag_info["album"] = str(id3['TALB'])
-        
-        # Extract year
-        if 'TDRC' in id3:
-            tag_info["year"] = str(id3['TDRC'])
-        
-        # Extract genre
-        if 'TCON' in id3:
-            tag_info["genre"] = str(id3['TCON'])
+        # User-defined text frames
+        if "txxx" in self._fields:
+            for frame in id3.getall("TXXX"):
+                tag_info[TXXX_PREFIX + frame.desc] = str(frame)
         
         return tag_info
     
@@ -140,72 +909,244 @@ class TagProcessor:
         """
         Convert tag encodings to UTF-8
         
+        Text frames declared as Latin-1 often hold bytes in another encoding.
+        ASCII values and values that can't be Latin-1 bytes are left alone,
+        and values that are valid UTF-8 are decoded as such; detection only
+        runs for the remaining values.
+        
         Args:
             tag_info: Dictionary containing the tag information
             
         Returns:
             dict: Dictionary containing the tag information with UTF-8 encoding
         """
+        undetected = {}
+        
         for key, value in tag_info.items():
-            if value and isinstance(value, str):
-                # Try to detect encoding
+            if not value or not isinstance(value, str):
+                continue
+            
+            if value.isascii():
+                self.encoding_stats["skipped"] += 1
+                continue
+            
+            try:
+                # Convert to bytes if it's a string
+                value_bytes = value.encode('latin-1')
+            except UnicodeEncodeError:
+                # Not Latin-1 text, so it was already decoded from a Unicode frame
+                self.encoding_stats["skipped"] += 1
+                continue
+            
+            try:
+                tag_info[key] = value_bytes.decode('utf-8')
+                self.encoding_stats["skipped"] += 1
+                continue
+            except UnicodeDecodeError:
+                undetected[key] = value_bytes
+        
+        if not undetected:
+            return tag_info
+        
+        if self.detect_per_file:
+            # Detect once on all fields, which also gives chardet more text to work with
+            encoding = self._detect_encoding(b"\n".join(undetected.values()))
+            encodings = dict.fromkeys(undetected, encoding)
+        else:
+            encodings = {key: self._detect_encoding(value_bytes) for key, value_bytes in undetected.items()}
+        
+        for key, value_bytes in undetected.items():
+            encoding = encodings[key]
+            if encoding and encoding.lower() != 'utf-8':
                 try:
-                    # Convert to bytes if it's a string
-                    value_bytes = value.encode('latin-1')
-                    
-                    # Detect encoding
-                    detected = chardet.detect(value_bytes)
-                    
-                    if detected['encoding'] and detected['encoding'].lower() != 'utf-8':
-                        # Decode using detected encoding and encode as UTF-8
-                        decoded = value_bytes.decode(detected['encoding'], errors='replace')
-                        tag_info[key] = decoded
-                except Exception as e:
+                    # Decode using detected encoding
+                    tag_info[key] = value_bytes.decode(encoding, errors='replace')
+                except LookupError as e:
                     print(f"Error converting encoding for {key}: {e}")
         
         return tag_info
     
-    def save_changes(self, file_path):
+    def _detect_encoding(self, value_bytes):
+        """
+        Detect the encoding of a byte string, counting memo hits and misses
+        
+        Args:
+            value_bytes: Byte string to examine
+            
+        Returns:
+            str: Name of the detected encoding, or None
+        """
+        misses = _detect_encoding.cache_info().misses
+        encoding = _detect_encoding(value_bytes)
+        
+        if _detect_encoding.cache_info().misses == misses:
+            self.encoding_stats["memoized"] += 1
+        else:
+            self.encoding_stats["detected"] += 1
+        
+        return encoding
+    
+    def save_changes(self, file_path, atomic=False):
         """
         Save the changes to the MP3 file
         
+        Only fields marked as dirty are written, and only if they differ from
+        the frames in the file. Files without changes are not written at all.
+        Different files may be saved concurrently from several threads.
+        
         Args:
             file_path: Path to the MP3 file
+            atomic: Always write through a temporary file and rename, so the
+                file is never left half-written
+            
+        Returns:
+            dict: "status" ("skipped", "in_place" or "rewritten") and
+                "bytes_written"
         """
-        if file_path not in self.processed_files:
+        if file_path not in self.store:
             raise ValueError(f"File {file_path} has not been processed yet")
         
+        result = {"status": "skipped", "bytes_written": 0}
+        
+        dirty_fields = self.store.dirty_fields(file_path)
+        if not dirty_fields:
+            self._count_write(result)
+            return result
+        
+        start = time.perf_counter()
         try:
             # Get the processed tag information
-            tag_info = self.processed_files[file_path]
-            
-            # Load or create ID3 tags
-            try:
-                id3 = ID3(file_path)
-            except ID3NoHeaderError:
-                id3 = ID3()
+            tag_info = self.store[file_path]
             
-            # Update tags
-            if tag_info["title"]:
-                id3["TIT2"] = TIT2(encoding=3, text=tag_info["title"])
+            # Load or create ID3 tags; ID3v1 fields are compared as missing so they get copied
+            with self.metrics.stage("save.load", file_path):
+                try:
+                    id3 = ID3(file_path, load_v1=False)
+                except ID3NoHeaderError:
+                    id3 = ID3()
             
-            if tag_info["artist"]:
-                id3["TPE1"] = TPE1(encoding=3, text=tag_info["artist"])
+            # Replace only the frames that differ
+            changed = False
+            for key in dirty_fields:
+                if is_tag_field(key):
+                    changed |= self._write_field(id3, key, str(tag_info.get(key, "")))
             
-            if tag_info["album"]:
-                id3["TALB"] = TALB(encoding=3, text=tag_info["album"])
+            artwork_change = self._artwork_changes.get(file_path) if ARTWORK_FIELD in dirty_fields else None
+            if artwork_change is not None:
+                with self.metrics.stage("save.artwork", file_path):
+                    changed |= self._write_artwork(id3, artwork_change)
             
-            if tag_info["year"]:
-                id3["TDRC"] = TDRC(encoding=3, text=tag_info["year"])
+            strip_v1 = ID3V1_FIELD in dirty_fields
+            if changed:
+                # Save the changes, in place when the tag fits into its old space
+                with self.metrics.stage("save.write", file_path):
+                    status, bytes_written = self.tag_writer.write(file_path, id3, atomic=atomic,
+                                                                  strip_v1=strip_v1, keep_v1=self._v1_kept)
+                result = {"status": status, "bytes_written": bytes_written}
+            elif strip_v1:
+                # Only the ID3v1 tag has to go, which just shortens the file
+                with self.metrics.stage("save.write", file_path):
+                    self.tag_writer.strip_id3v1(file_path)
+                result = {"status": "in_place", "bytes_written": 0}
             
-            if tag_info["genre"]:
-                id3["TCON"] = TCON(encoding=3, text=tag_info["genre"])
+            if changed or strip_v1:
+                # The cached tags no longer match the file
+                if self.cache is not None:
+                    self.cache.invalidate(file_path)
             
-            # Save the changes
-            id3.save(file_path)
+            self.store.clear_dirty(file_path)
+            self._artwork_changes.pop(file_path, None)
+            self._count_write(result)
+            self.metrics.record("save", time.perf_counter() - start, file_path)
             
-            return True
+            return result
             
         except Exception as e:
             print(f"Error saving changes to {file_path}: {e}")
-            raise
\ No newline at end of file
+            self.metrics.count("save.errors")
+            raise
+    
+    def _write_field(self, id3, key, value):
+        """
+        Set the frame of a field, or remove it if the value is empty
+        
+        Args:
+            id3: Mutagen ID3 object loaded from the file
+            key: Field, see is_tag_field
+            value: New value
+            
+        Returns:
+            bool: True if the frames changed
+        """
+        if key in TAG_FRAMES:
+            frame_class = TAG_FRAMES[key]
+            frames = id3.getall(frame_class.__name__)
+            make_frame = lambda: frame_class(encoding=3, text=value)
+        elif key in DESCRIBED_FRAMES:
+            frame_class = DESCRIBED_FRAMES[key]
+            frames = [frame for frame in id3.getall(frame_class.__name__) if not frame.desc]
+            lang = frames[0].lang if frames else "eng"
+            make_frame = lambda: frame_class(encoding=3, lang=lang, desc="", text=value)
+        else:
+            desc = key[len(TXXX_PREFIX):]
+            frames = id3.getall("TXXX:" + desc)
+            make_frame = lambda: TXXX(encoding=3, desc=desc, text=value)
+        
+        if [str(frame) for frame in frames] == ([value] if value else []):
+            return False
+        
+        for frame in frames:
+            id3.delall(frame.HashKey)
+        if value:
+            id3.add(make_frame())
+        return True
+    
+    def _write_artwork(self, id3, change):
+        """
+        Apply an artwork change to the picture frames
+        
+        Args:
+            id3: Mutagen ID3 object loaded from the file
+            change: ArtworkChange, see set_artwork
+            
+        Returns:
+            bool: True if the frames changed
+        """
+        pictures = id3.getall("APIC")
+        if change.action == "strip":
+            id3.delall("APIC")
+            return bool(pictures)
+        
+        if change.action == "resize":
+            changed = False
+            for picture in pictures:
+                scaled = scale_image(picture.data, change.max_size)
+                if scaled is not None and scaled[0] is not picture.data:
+                    picture.data, picture.mime = scaled
+                    changed = True
+            return changed
+        
+        # The picture that is shown is replaced; its description keeps the frame's key unique
+        cover = front_cover(pictures)
+        if (cover is not None and cover.type == FRONT_COVER and cover.mime == change.mime
+                and cover.data == change.data):
+            return False
+        desc = ""
+        if cover is not None:
+            desc = cover.desc
+            id3.delall(cover.HashKey)
+        id3.add(APIC(encoding=3, mime=change.mime, type=FRONT_COVER, desc=desc, data=change.data))
+        return True
+    
+    def _count_write(self, result):
+        """
+        Add the result of a save to the write counters
+        
+        Args:
+            result: Dictionary returned by save_changes
+        """
+        with self._write_lock:
+            self.write_stats[result["status"]] += 1
+            self.write_stats["bytes_written"] += result["bytes_written"]
+            self.metrics.count("save." + result["status"])
+            self.metrics.count("save.bytes_written", result["bytes_written"])
@@ -0,0 +1,495 @@
+"""
+Rules - Bulk editing of tags with find/replace, case, trim, filename and conditional rules
+"""
+import os
+import re
+import json
+import bisect
+from collections import namedtuple
+
+# A value changed by a rule set
+Change = namedtuple("Change", ["path", "field", "old", "new"])
+
+# Modes of CaseRule
+CASE_MODES = ("upper", "lower", "title", "sentence")
+
+# Placeholder of a field in filename patterns, e.g. %artist%
+_PLACEHOLDER = re.compile(r"%(\w+)%")
+
+# A word for title case; apostrophes don't start a new word ("Don't", not "Don'T")
+_WORD = re.compile(r"[^\W_]+(?:['’][^\W_]+)*")
+
+# First letter of a value, upper-cased by sentence case
+_FIRST_LETTER = re.compile(r"[^\W\d_]")
+
+class Condition:
+    """Restricts a rule to the files whose value of a field matches a regular expression"""
+    
+    def __init__(self, field, pattern, negate=False, ignore_case=True):
+        """
+        Args:
+            field: Field to test, e.g. "artist"
+            pattern: Regular expression searched in the value
+            negate: Select the files that don't match instead
+            ignore_case: Match regardless of case
+        """
+        self.field = field
+        self.regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        self.negate = negate
+    
+    def evaluate(self, values):
+        """
+        Test a column
+        
+        Args:
+            values: Values of the field, one per file
+        
+        Returns:
+            list: True for the files the rule applies to
+        """
+        # Each distinct value is matched once
+        matches = {value: (self.regex.search(value) is not None) != self.negate for value in set(values)}
+        return [matches[value] for value in values]
+
+class Rule:
+    """
+    Base class of rules that rewrite the values of one field
+    
+    A rule works on a whole column at once: its transform() runs once per
+    distinct value, and the column is rebuilt from the results. Artists,
+    albums, years and genres repeat across thousands of files, so most
+    columns cost a few hundred transformations however many files are
+    loaded.
+    """
+    
+    def __init__(self, field, condition=None):
+        """
+        Args:
+            field: Field the rule changes, e.g. "title"
+            condition: Condition selecting the files the rule applies to
+        """
+        self.field = field
+        self.condition = condition
+    
+    def transform(self, value):
+        """
+        Transform a single value
+        
+        Args:
+            value (str): Current value; "" if the file has none
+        
+        Returns:
+            str: New value
+        """
+        raise NotImplementedError
+    
+    def apply(self, table, mask):
+        """
+        Apply the rule to a table of columns
+        
+        Args:
+            table: _Table with the columns being edited
+            mask: List of booleans selecting the files, or None for all
+        """
+        values = table.column(self.field)
+        targets = set(values) if mask is None else {value for value, selected in zip(values, mask) if selected}
+        mapping = {value: self.transform(value) for value in targets}
+        if all(old == new for old, new in mapping.items()):
+            return
+        
+        if mask is None:
+            table.set_column(self.field, [mapping[value] for value in values])
+        else:
+            table.set_column(self.field, [mapping[value] if selected else value
+                                          for value, selected in zip(values, mask)])
+
+class ReplaceRule(Rule):
+    """Find and replace text, optionally with a regular expression"""
+    
+    def __init__(self, field, find, replace="", regex=False, ignore_case=False, condition=None):
+        """
+        Args:
+            field: Field the rule changes
+            find: Text or regular expression to find
+            replace: Replacement; may refer to groups (\\1) with regex
+            regex: Treat find as a regular expression
+            ignore_case: Find regardless of case
+            condition: Condition selecting the files the rule applies to
+        """
+        if not find:
+            raise ValueError("Nothing to find")
+        super().__init__(field, condition)
+        self.regex = re.compile(find if regex else re.escape(find), re.IGNORECASE if ignore_case else 0)
+        # Without regex, backslashes in the replacement are literal
+        self.replace = replace if regex else replace.replace("\\", "\\\\")
+    
+    def transform(self, value):
+        return self.regex.sub(self.replace, value)
+
+class CaseRule(Rule):
+    """Normalize letter case: upper, lower, title or sentence case"""
+    
+    def __init__(self, field, mode="title", condition=None):
+        """
+        Args:
+            field: Field the rule changes
+            mode: One of CASE_MODES
+            condition: Condition selecting the files the rule applies to
+        """
+        if mode not in CASE_MODES:
+            raise ValueError(f"Unknown case mode: {mode}")
+        super().__init__(field, condition)
+        self.mode = mode
+    
+    def transform(self, value):
+        if self.mode == "upper":
+            return value.upper()
+        if self.mode == "lower":
+            return value.lower()
+        if self.mode == "title":
+            return _WORD.sub(lambda match: match.group(0).capitalize(), value)
+        
+        # Sentence case: only the first letter is upper case
+        value = value.lower()
+        match = _FIRST_LETTER.search(value)
+        if match is None:
+            return value
+        index = match.start()
+        return value[:index] + value[index].upper() + value[index + 1:]
+
+class TrimRule(Rule):
+    """Remove leading and trailing whitespace and collapse runs of whitespace"""
+    
+    def transform(self, value):
+        return " ".join(value.split())
+
+class SetRule(Rule):
+    """Set a field to a fixed value, usually together with a condition"""
+    
+    def __init__(self, field, value, condition=None):
+        """
+        Args:
+            field: Field the rule changes
+            value: New value
+            condition: Condition selecting the files the rule applies to
+        """
+        super().__init__(field, condition)
+        self.value = value
+    
+    def transform(self, value):
+        return self.value
+
+class _ChainedRule(Rule):
+    """Consecutive unconditional rules of the same field, applied in a single pass over the column"""
+    
+    def __init__(self, rules):
+        super().__init__(rules[0].field)
+        self.transforms = [rule.transform for rule in rules]
+    
+    def transform(self, value):
+        for transform in self.transforms:
+            value = transform(value)
+        return value
+
+class FilenameRule(Rule):
+    """
+    Fill fields from the file name, e.g. with the pattern "%artist% - %title%"
+    
+    The pattern is matched against the file name without its extension.
+    Files whose name doesn't match are left unchanged.
+    """
+    
+    def __init__(self, pattern, condition=None):
+        """
+        Args:
+            pattern: File name pattern with %field% placeholders
+            condition: Condition selecting the files the rule applies to
+        """
+        self.fields = _PLACEHOLDER.findall(pattern)
+        if not self.fields:
+            raise ValueError(f"Pattern has no %field% placeholders: {pattern}")
+        if len(set(self.fields)) != len(self.fields):
+            raise ValueError(f"Pattern uses a field more than once: {pattern}")
+        super().__init__(self.fields[0], condition)
+        
+        parts = _PLACEHOLDER.split(pattern)
+        # split() alternates literal text and field names
+        regex = "".join(re.escape(part) if index % 2 == 0 else f"(?P<{part}>.+?)"
+                        for index, part in enumerate(parts))
+        self.regex = re.compile(regex + "$")
+    
+    def apply(self, table, mask):
+        names = [os.path.splitext(os.path.basename(path))[0] for path in table.paths]
+        matches = [self.regex.match(name) if mask is None or mask[index] else None
+                   for index, name in enumerate(names)]
+        
+        for field in self.fields:
+            values = table.column(field)
+            table.set_column(field, [match.group(field).strip() if match else value
+                                     for value, match in zip(values, matches)])
+
+class _Table:
+    """Columns of the files being edited, loaded from the tag store on first use"""
+    
+    def __init__(self, store, paths):
+        self.store = store
+        self.paths = paths
+        self.original = {}  # field -> values in the store
+        self.columns = {}  # field -> values after the rules applied so far
+    
+    def column(self, field):
+        """Get the current values of a field; "" where a file has none"""
+        values = self.columns.get(field)
+        if values is None:
+            values = ["" if value is None else str(value) for value in self.store.column(field, self.paths)]
+            self.original[field] = values
+            self.columns[field] = values
+        return values
+    
+    def set_column(self, field, values):
+        """Replace the values of a field"""
+        self.column(field)
+        self.columns[field] = values
+    
+    def preview(self):
+        """
+        Get the values that differ from the store
+        
+        Returns:
+            Preview: The changes
+        """
+        diffs = []
+        for field, values in self.columns.items():
+            original = self.original[field]
+            if values is original:
+                continue
+            
+            indices = [index for index, (old, new) in enumerate(zip(original, values)) if old != new]
+            if indices:
+                diffs.append((field, indices, original, values))
+        
+        return Preview(self.paths, diffs)
+
+class Preview:
+    """
+    Changes computed by a rule set, kept by column
+    
+    Changes are listed field by field, and in the order of the files within
+    a field. Change tuples are only created when the changes are read, so a
+    preview of hundreds of thousands of values is cheap to compute.
+    """
+    
+    def __init__(self, paths, diffs):
+        """
+        Args:
+            paths: File paths the columns are indexed by
+            diffs: List of (field, indices of the changed files, old column,
+                new column) tuples
+        """
+        self._paths = paths
+        self._diffs = diffs
+        self._offsets = []  # Index of the first change of each field
+        total = 0
+        for _, indices, _, _ in diffs:
+            self._offsets.append(total)
+            total += len(indices)
+        self._total = total
+    
+    def __len__(self):
+        return self._total
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._total))]
+        if index < 0:
+            index += self._total
+        if not 0 <= index < self._total:
+            raise IndexError(index)
+        
+        diff = bisect.bisect_right(self._offsets, index) - 1
+        field, indices, original, values = self._diffs[diff]
+        row = indices[index - self._offsets[diff]]
+        return Change(self._paths[row], field, original[row], values[row])
+    
+    def __iter__(self):
+        paths = self._paths
+        for field, indices, original, values in self._diffs:
+            for row in indices:
+                yield Change(paths[row], field, original[row], values[row])
+    
+    def counts(self):
+        """
+        Get the number of changes per field
+        
+        Returns:
+            dict: Field -> number of files whose value changes
+        """
+        return {field: len(indices) for field, indices, _, _ in self._diffs}
+    
+    def file_count(self):
+        """Get the number of files that change"""
+        rows = set()
+        for _, indices, _, _ in self._diffs:
+            rows.update(indices)
+        return len(rows)
+
+class RuleSet:
+    """
+    Rules applied one after another to many files
+    
+    preview() computes the resulting changes without touching the files;
+    apply() stores them in the tag processor, which marks them dirty so
+    they are written by the next save.
+    """
+    
+    def __init__(self, rules):
+        """
+        Args:
+            rules: List of Rule objects, applied in order
+        """
+        self.rules = list(rules)
+        
+        # Fields the rules read or change
+        self.fields = set()
+        for rule in self.rules:
+            self.fields.update(getattr(rule, "fields", [rule.field]))
+            if rule.condition is not None:
+                self.fields.add(rule.condition.field)
+        
+        # Rules without a condition that follow each other on one field share a pass
+        self._passes = []
+        for rule in self.rules:
+            previous = self._passes[-1] if self._passes else None
+            if isinstance(previous, list) and self._chainable(rule) and previous[0].field == rule.field:
+                previous.append(rule)
+            elif self._chainable(rule):
+                self._passes.append([rule])
+            else:
+                self._passes.append(rule)
+        self._passes = [_ChainedRule(step) if isinstance(step, list) and len(step) > 1 else
+                        step[0] if isinstance(step, list) else step for step in self._passes]
+    
+    @staticmethod
+    def _chainable(rule):
+        """Check whether a rule can share a pass over its column with others"""
+        return rule.condition is None and type(rule).apply is Rule.apply
+    
+    @classmethod
+    def from_dicts(cls, specs, fields=None):
+        """
+        Build a rule set from plain dictionaries, e.g. loaded from JSON
+        
+        Each dictionary has an "op" ("replace", "case", "trim", "set" or
+        "from_filename"), the arguments of the rule's constructor and an
+        optional "if": {"field": ..., "matches": ..., "negate": false}.
+        
+        Args:
+            specs: List of rule dictionaries
+            fields: Field names rules may change (defaults to the fields
+                the tag processor can save, see is_tag_field)
+        
+        Returns:
+            RuleSet: The rule set
+        
+        Raises:
+            ValueError: If a rule is invalid
+        """
+        if fields is None:
+            from tag_processor.processor import is_tag_field
+        else:
+            is_tag_field = set(fields).__contains__
+        
+        rules = []
+        for number, spec in enumerate(specs, 1):
+            try:
+                spec = dict(spec)
+                op = spec.pop("op")
+                condition = spec.pop("if", None)
+                if condition is not None:
+                    condition = Condition(condition["field"], condition["matches"],
+                                          condition.get("negate", False), condition.get("ignore_case", True))
+                
+                if op == "replace":
+                    rule = ReplaceRule(condition=condition, **spec)
+                elif op == "case":
+                    rule = CaseRule(condition=condition, **spec)
+                elif op == "trim":
+                    rule = TrimRule(condition=condition, **spec)
+                elif op == "set":
+                    rule = SetRule(condition=condition, **spec)
+                elif op == "from_filename":
+                    rule = FilenameRule(condition=condition, **spec)
+                else:
+                    raise ValueError(f"unknown op {op!r}")
+                
+                unknown = [field for field in getattr(rule, "fields", [rule.field]) if not is_tag_field(field)]
+                if unknown:
+                    raise ValueError(f"unknown field {unknown[0]!r}")
+            except (KeyError, TypeError, ValueError, re.error) as e:
+                raise ValueError(f"Invalid rule {number}: {e}") from e
+            rules.append(rule)
+        
+        return cls(rules)
+    
+    @classmethod
+    def load(cls, rules_file):
+        """
+        Load a rule set from a JSON file holding a list of rule dictionaries
+        
+        Args:
+            rules_file: Path to the JSON file
+        
+        Returns:
+            RuleSet: The rule set
+        
+        Raises:
+            ValueError: If the file can't be read or a rule is invalid
+        """
+        try:
+            with open(rules_file, 'r', encoding='utf-8') as f:
+                specs = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Could not read rules from {rules_file}: {e}") from e
+        if not isinstance(specs, list):
+            raise ValueError(f"{rules_file} must contain a list of rules")
+        return cls.from_dicts(specs)
+    
+    def preview(self, store, file_paths):
+        """
+        Compute the changes the rules make
+        
+        Args:
+            store: TagStore with the processed tags
+            file_paths: Files to edit; files that weren't processed are skipped
+        
+        Returns:
+            Preview: The Change tuples (path, field, old, new)
+        """
+        table = _Table(store, [file_path for file_path in file_paths if file_path in store])
+        if not table.paths:
+            return Preview([], [])
+        
+        for rule in self._passes:
+            mask = None
+            if rule.condition is not None:
+                mask = rule.condition.evaluate(table.column(rule.condition.field))
+                if not any(mask):
+                    continue
+            rule.apply(table, mask)
+        
+        return table.preview()
+    
+    def apply(self, tag_processor, file_paths):
+        """
+        Store the changes the rules make, marking them for saving
+        
+        Args:
+            tag_processor: TagProcessor holding the processed tags
+            file_paths: Files to edit
+        
+        Returns:
+            Preview: The changes that were applied
+        """
+        changes = self.preview(tag_processor.store, file_paths)
+        tag_processor.set_tags((change.path, change.field, change.new) for change in changes)
+        return changes
@@ -0,0 +1,423 @@
+"""
+Search index - Instant search over the tags of the loaded files
+"""
+import os
+import re
+import bisect
+from array import array
+from collections import deque
+from itertools import compress, repeat
+
+# Fields searched by terms without a field, e.g. "beatles"
+TEXT_FIELDS = ("title", "artist", "album", "genre", "year", "filename")
+
+# Fields that can also be compared as numbers, e.g. "year:<1990"
+NUMERIC_FIELDS = ("year",)
+
+# A word; underscores separate words, as in file names like "01_yesterday"
+_TOKEN = re.compile(r"[^\W_]+")
+
+# A query term: an optional field, then a quoted or unquoted value
+_TERM = re.compile(r'(?:(\w+):)?("[^"]*"?|\S+)')
+
+# A numeric condition: comparison or range, e.g. "<1990", ">=2000", "1980..1989"
+_COMPARISON = re.compile(r"^(<=|>=|<|>|=)?(\d+)(?:\.\.(\d+))?$")
+
+# Leading number of a value, e.g. the year of "1999-05-01"
+_NUMBER = re.compile(r"\s*(\d+)")
+
+# Distinct numbers of a field that get a one-byte code; a field with more is compared number by number
+MAX_CODES = 255
+
+# A query whose most selective term matches at least 1/DENSE_FRACTION of the rows is answered with bitmaps
+DENSE_FRACTION = 4
+
+def tokenize(value):
+    """
+    Split a value into lower-case words
+    
+    Args:
+        value: Tag value or query text
+    
+    Returns:
+        list: Words, in order
+    """
+    return _TOKEN.findall(str(value).casefold())
+
+# Largest number kept for numeric comparisons; the rows' numbers are stored as 32-bit integers
+MAX_NUMBER = 2 ** 31 - 1
+
+def _number(value):
+    """Get the leading number of a value, or None"""
+    match = _NUMBER.match(str(value))
+    if match is None:
+        return None
+    number = int(match.group(1))
+    return number if number <= MAX_NUMBER else None
+
+def _predicate(operator, low, high):
+    """Get a function testing a number against a comparison or range parsed by _COMPARISON"""
+    low = int(low)
+    if high is not None:
+        high = int(high)
+        return lambda number: low <= number <= high
+    if operator == "<":
+        return lambda number: number < low
+    if operator == "<=":
+        return lambda number: number <= low
+    if operator == ">":
+        return lambda number: number > low
+    if operator == ">=":
+        return lambda number: number >= low
+    return lambda number: number == low
+
+class SearchIndex:
+    """
+    Inverted index from words to table rows, kept up to date as tags change
+    
+    Every word of every searched field maps to the rows whose value
+    contains it, and the words of a field are kept sorted, so a word typed
+    so far is found with a binary search instead of scanning the table. A
+    query like "artist:beat year:<1970 help" intersects the rows of its
+    terms, starting with the most selective one.
+    
+    Rows are kept in arrays of machine integers, which take a fraction of
+    the memory of sets. A query that narrows the table down builds a set
+    from its most selective term and looks the rows up in the other terms.
+    A broad query instead builds a bitmap per term, with one byte per row,
+    so the terms are intersected with a single AND of integers and the
+    rows come out in order without sorting them; numeric conditions get
+    their bitmap from a column of one-byte codes with bytes.translate. The
+    sets and bitmaps of a query are kept for the next one, which usually
+    only differs in the word being typed. The index doesn't keep the values
+    of the rows: the caller passes the old value when a value changes, and
+    the tag store stays the only copy.
+    """
+    
+    def __init__(self):
+        self._count = 0
+        self._postings = {field: {} for field in TEXT_FIELDS}  # field -> word -> array of rows
+        # Words are sorted in buckets by their first character, so a prefix only needs its bucket sorted
+        self._sorted = {field: {} for field in TEXT_FIELDS}  # field -> first character -> sorted words
+        self._pending = {field: {} for field in TEXT_FIELDS}  # field -> character -> words missing from _sorted
+        self._numbers = {field: {} for field in NUMERIC_FIELDS}  # field -> number -> array of rows
+        self._row_numbers = {field: array('i') for field in NUMERIC_FIELDS}  # field -> number by row, -1 for none
+        self._codes = {field: {} for field in NUMERIC_FIELDS}  # field -> number -> code, from 1
+        self._row_codes = {field: bytearray() for field in NUMERIC_FIELDS}  # field -> code by row, or None
+        self._term_cache = {}  # Sets or bitmaps of the rows of the terms of the last query
+    
+    def __len__(self):
+        return self._count
+    
+    def reset(self, file_paths):
+        """
+        Forget all rows and index the file names of a new table
+        
+        Args:
+            file_paths: Paths of the files, in row order
+        """
+        self.__init__()
+        self._count = len(file_paths)
+        for field in NUMERIC_FIELDS:
+            self._row_numbers[field] = array('i', [-1]) * self._count
+            self._row_codes[field] = bytearray(self._count)
+        self._add("filename", ((row, os.path.splitext(os.path.basename(file_path))[0])
+                               for row, file_path in enumerate(file_paths)))
+    
+    def add(self, tags):
+        """
+        Index the tags of rows that have no tags in the index yet
+        
+        Args:
+            tags: Iterable of (row, tag dictionary) pairs, e.g. a batch of
+                processed files
+        """
+        tags = list(tags)
+        for field in TEXT_FIELDS:
+            if field != "filename":
+                self._add(field, ((row, tag_info[field]) for row, tag_info in tags if tag_info.get(field)))
+    
+    def update(self, changes):
+        """
+        Change values of rows
+        
+        Args:
+            changes: Iterable of (row, field, old value, new value) tuples;
+                the old value is the one the index holds for the row
+        """
+        removed = {}
+        added = {}
+        for row, field, old, new in changes:
+            if field not in self._postings or old == new:
+                continue
+            if old:
+                removed.setdefault(field, []).append((row, old))
+            if new:
+                added.setdefault(field, []).append((row, new))
+        
+        for field, items in removed.items():
+            self._remove(field, items)
+        for field, items in added.items():
+            self._add(field, items)
+    
+    def _add(self, field, items):
+        """Add (row, value) pairs to the postings of a field"""
+        # Artists, albums, years and genres repeat, so each distinct value is split once
+        by_value = {}
+        for row, value in items:
+            rows = by_value.get(value)
+            if rows is None:
+                by_value[value] = [row]
+            else:
+                rows.append(row)
+        
+        postings = self._postings[field]
+        pending = self._pending[field]
+        numbers = self._numbers.get(field)
+        for value, rows in by_value.items():
+            for word in set(tokenize(value)):
+                word_rows = postings.get(word)
+                if word_rows is None:
+                    word_rows = postings[word] = array('I')
+                    bucket = pending.get(word[0])
+                    if bucket is None:
+                        bucket = pending[word[0]] = set()
+                    bucket.add(word)
+                word_rows.extend(rows)
+            
+            if numbers is not None:
+                number = _number(value)
+                if number is not None:
+                    number_rows = numbers.get(number)
+                    if number_rows is None:
+                        number_rows = numbers[number] = array('I')
+                    number_rows.extend(rows)
+                    row_numbers = self._row_numbers[field]
+                    for row in rows:
+                        row_numbers[row] = number
+                    
+                    row_codes = self._row_codes[field]
+                    if row_codes is not None:
+                        code = self._code(field, number)
+                        if code is None:
+                            self._row_codes[field] = None
+                        else:
+                            for row in rows:
+                                row_codes[row] = code
+        
+        self._term_cache.clear()
+    
+    def _remove(self, field, items):
+        """Remove (row, value) pairs from the postings of a field"""
+        by_word = {}
+        by_number = {}
+        for row, value in items:
+            for word in set(tokenize(value)):
+                by_word.setdefault(word, set()).add(row)
+            number = _number(value) if field in self._numbers else None
+            if number is not None:
+                by_number.setdefault(number, set()).add(row)
+                self._row_numbers[field][row] = -1
+                if self._row_codes[field] is not None:
+                    self._row_codes[field][row] = 0
+        
+        # Each array is rewritten once, however many of its rows are removed
+        for postings, removed in ((self._postings[field], by_word), (self._numbers.get(field), by_number)):
+            for key, rows in removed.items():
+                kept = array('I', [row for row in postings.get(key, ()) if row not in rows])
+                if kept:
+                    postings[key] = kept
+                elif key in postings:
+                    # A removed word stays in the sorted list until it is rebuilt; lookups skip it
+                    del postings[key]
+                    if postings is self._postings[field]:
+                        self._pending[field].get(key[0], set()).discard(key)
+        
+        self._term_cache.clear()
+    
+    def _code(self, field, number):
+        """Get the one-byte code of a number, or None if the field has run out of codes"""
+        codes = self._codes[field]
+        code = codes.get(number)
+        if code is None and len(codes) < MAX_CODES:
+            code = codes[number] = len(codes) + 1
+        return code
+    
+    def _words(self, field, character):
+        """Get the sorted words of a field starting with a character, adding those indexed since the last search"""
+        words = self._sorted[field].get(character, [])
+        pending = self._pending[field].pop(character, None)
+        if pending:
+            if len(pending) > len(words) // 8:
+                # Sorting the two sorted runs merges them, which is much cheaper than sorting all words
+                postings = self._postings[field]
+                words = [word for word in words if word in postings and word not in pending]
+                words.extend(sorted(pending))
+                words.sort()
+            else:
+                for word in pending:
+                    bisect.insort(words, word)
+            self._sorted[field][character] = words
+        return words
+    
+    def _prefix(self, field, prefix):
+        """Get the row arrays of the words of a field starting with prefix"""
+        postings = self._postings[field]
+        words = self._words(field, prefix[0])
+        start = bisect.bisect_left(words, prefix)
+        # "\U0010ffff" sorts after every character a word can continue with
+        end = bisect.bisect_left(words, prefix + "\U0010ffff", start)
+        return [postings[word] for word in words[start:end] if word in postings]
+    
+    def _terms(self, query):
+        """
+        Split a query into terms
+        
+        Returns:
+            list: (field or None, kind, value) tuples, where kind is
+                "prefix" for the start of a word, "word" for a whole word and
+                "compare" for a numeric condition
+        """
+        terms = []
+        for field, value in _TERM.findall(query):
+            field = field.casefold()
+            value = value.strip('"')
+            if field and field not in self._postings:
+                value = f"{field} {value}"
+                field = ""
+            
+            if field in self._numbers:
+                match = _COMPARISON.match(value)
+                # A bare number is matched as a prefix ("year:199" finds the 1990s)
+                if match and (match.group(1) or match.group(3)):
+                    terms.append((field, "compare", match.groups()))
+                    continue
+            
+            for word in tokenize(value):
+                # A single letter would match most of the table; it only matches whole words
+                terms.append((field or None, "prefix" if len(word) > 1 else "word", word))
+        return terms
+    
+    def _arrays(self, term):
+        """Get the row arrays of a term; a row matches if it is in any of them"""
+        field, kind, value = term
+        if kind == "compare":
+            # There are few distinct numbers (years), so they are tested one by one
+            test = _predicate(*value)
+            return [rows for number, rows in self._numbers[field].items() if test(number)]
+        fields = TEXT_FIELDS if field is None else (field,)
+        if kind == "word":
+            return [self._postings[field][value] for field in fields if value in self._postings[field]]
+        return [rows for field in fields for rows in self._prefix(field, value)]
+    
+    def search(self, query):
+        """
+        Find the rows matching a query
+        
+        A query is a list of terms that must all match. A term is a word,
+        a quoted phrase or a field-scoped term like artist:beatles,
+        album:"abbey road", year:<1990, year:>=2000 or year:1980..1989.
+        Words match the start of words in the values, so results can be
+        shown while the query is being typed. Unknown fields are searched
+        as ordinary words.
+        
+        Args:
+            query: Query text
+        
+        Returns:
+            list: Matching rows in ascending order, or None if the query
+                has no terms (everything matches)
+        """
+        terms = self._terms(query)
+        if not terms:
+            return None
+        
+        # Intersecting costs the size of the smaller set, so start with the most selective term
+        arrays = {term: self._arrays(term) for term in set(terms)}
+        sizes = {term: sum(map(len, term_arrays)) for term, term_arrays in arrays.items()}
+        order = sorted(arrays, key=sizes.get)
+        
+        # Typing usually changes only the last term, so the others are reused
+        cache = {}
+        if sizes[order[0]] * DENSE_FRACTION >= self._count:
+            rows = self._search_bitmaps(order, arrays, cache)
+        else:
+            rows = sorted(self._search_sets(order, arrays, sizes, cache))
+        self._term_cache = cache
+        return rows
+    
+    def _search_sets(self, order, arrays, sizes, cache):
+        """Intersect the terms of a query that narrows the table down, see search"""
+        rows = None
+        for term in order:
+            field, kind, value = term
+            term_rows = self._term_cache.get(term)
+            if rows is None:
+                if not isinstance(term_rows, set):
+                    term_rows = set().union(*arrays[term])
+                # The sets are never modified, so the result can start out as the cached set
+                rows = cache[term] = term_rows
+            elif term_rows is not None:
+                cache[term] = term_rows
+                if isinstance(term_rows, set):
+                    rows = rows & term_rows
+                else:
+                    rows = {row for row in rows if term_rows[row]}
+            elif kind == "compare" and self._row_codes[field] is not None:
+                # Looking up the few rows left in the term's table of codes is cheaper than its rows
+                table = self._code_table(term)
+                row_codes = self._row_codes[field]
+                rows = {row for row in rows if table[row_codes[row]]}
+            elif kind == "compare" and len(rows) * 8 < sizes[term]:
+                # Few rows left: testing their numbers is cheaper than going through the term's rows
+                test = _predicate(*value)
+                row_numbers = self._row_numbers[field]
+                rows = {row for row in rows if row_numbers[row] >= 0 and test(row_numbers[row])}
+            else:
+                # Looking up the term's rows in the result is cheaper than building the term's set
+                rows = set().union(*(rows.intersection(term_arrays) for term_arrays in arrays[term]))
+            if not rows:
+                break
+        return rows
+    
+    def _search_bitmaps(self, order, arrays, cache):
+        """Intersect the terms of a broad query, see search"""
+        bits = None
+        for term in order:
+            bitmap = self._term_cache.get(term)
+            if not isinstance(bitmap, bytes):
+                bitmap = self._bitmap(term, arrays[term])
+            cache[term] = bitmap
+            
+            term_bits = int.from_bytes(bitmap, "little")
+            bits = term_bits if bits is None else bits & term_bits
+            if not bits:
+                return []
+        
+        if len(order) > 1:
+            bitmap = bits.to_bytes(self._count, "little")
+        # The bitmap is in row order, so the rows need no sorting
+        return list(compress(range(self._count), bitmap))
+    
+    def _bitmap(self, term, term_arrays):
+        """Get the bitmap of a term: one byte per row, 1 where the row matches"""
+        field, kind, value = term
+        if kind == "compare" and self._row_codes[field] is not None:
+            return bytes(self._row_codes[field].translate(self._code_table(term)))
+        
+        bitmap = bytearray(self._count)
+        set_row = bitmap.__setitem__
+        for rows in term_arrays:
+            # Runs the loop in C; the deque keeps nothing
+            deque(map(set_row, rows, repeat(1)), maxlen=0)
+        return bytes(bitmap)
+    
+    def _code_table(self, term):
+        """Get a translation table mapping the codes of the numbers matching a compare term to 1"""
+        field, kind, value = term
+        test = _predicate(*value)
+        table = bytearray(256)
+        for number, code in self._codes[field].items():
+            if test(number):
+                table[code] = 1
+        return bytes(table)
@@ -0,0 +1,232 @@
+"""
+Persistent tag cache - Stores processed tags between sessions
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from utils.config import TAG_CACHE_FILE
+
+# Number of buffered writes after which they are committed to disk
+FLUSH_INTERVAL = 500
+
+# Fraction of max_entries kept after an eviction, so evictions happen in bulk
+EVICTION_TARGET = 0.9
+
+# Version of the stored data; caches written by other versions are discarded
+SCHEMA_VERSION = 4
+
+class TagCache:
+    """
+    On-disk cache of processed tags
+    
+    Entries are keyed by the file path and validated against the file's
+    size, modification time and inode, so a changed file is never served
+    from the cache. They also record the processing options they were made
+    with, e.g. how encodings are detected, and only serve a reader using
+    the same options. The least recently used entries are evicted when the
+    cache grows beyond max_entries.
+    """
+    
+    def __init__(self, cache_file, max_entries=1000000):
+        """
+        Args:
+            cache_file: Path to the SQLite database file
+            max_entries: Maximum number of cached files
+        """
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        self._lock = threading.Lock()
+        self._pending = {}  # Buffered writes: path -> row
+        self._touched = {}  # Buffered last-used updates: path -> timestamp
+        
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        
+        # Connections are shared between the GUI's worker threads; access is serialized by _lock
+        self._connection = sqlite3.connect(cache_file, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        if self._connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._connection.execute("DROP TABLE IF EXISTS tags")
+            self._connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS tags ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+            "tags TEXT, last_used INTEGER)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS tags_last_used ON tags (last_used)")
+        self._connection.commit()
+        
+        # Upper bound of the number of entries, so the table isn't counted on every flush
+        self._max_count = self._connection.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+    
+    @staticmethod
+    def file_key(file_path):
+        """
+        Get the validation key of a file
+        
+        Args:
+            file_path: Path to the file
+        
+        Returns:
+            tuple: (size, mtime_ns, inode), or None if the file can't be accessed
+        """
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns, st.st_ino)
+    
+    def get(self, file_path, key, required_fields=(), options=None):
+        """
+        Get the cached tags of a file
+        
+        Args:
+            file_path: Path to the file
+            key: Validation key from file_key
+            required_fields: Fields the cached tags must contain to be used
+            options: Processing options the cached tags must have been made
+                with, see put
+        
+        Returns:
+            tuple: (tag_info, dirty_fields), or None if missing or stale
+        """
+        if key is None:
+            self.misses += 1
+            return None
+        
+        with self._lock:
+            row = self._pending.get(file_path)
+            if row is None:
+                row = self._connection.execute(
+                    "SELECT size, mtime_ns, inode, tags FROM tags WHERE path = ?", (file_path,)
+                ).fetchone()
+            
+            if row is None or tuple(row[:3]) != key:
+                self.misses += 1
+                return None
+            
+            entry = json.loads(row[3])
+            tag_info = entry["tags"]
+            if entry.get("options") != options or any(field not in tag_info for field in required_fields):
+                self.misses += 1
+                return None
+            
+            self.hits += 1
+            self._touched[file_path] = time.time_ns()
+            if len(self._touched) >= FLUSH_INTERVAL:
+                self._flush()
+        
+        return tag_info, entry["dirty"]
+    
+    def put(self, file_path, key, tag_info, dirty_fields=(), options=None):
+        """
+        Store the tags of a file
+        
+        Args:
+            file_path: Path to the file
+            key: Validation key from file_key, taken before the file was read
+            tag_info: Processed tag information
+            dirty_fields: Fields whose processed value differs from the file
+            options: JSON-serializable dictionary of the options that change
+                the processed tags
+        """
+        if key is None:
+            return
+        
+        entry = {"tags": tag_info, "dirty": list(dirty_fields), "options": options}
+        with self._lock:
+            self._pending[file_path] = key + (json.dumps(entry, ensure_ascii=False),)
+            if len(self._pending) >= FLUSH_INTERVAL:
+                self._flush()
+    
+    def invalidate(self, file_path):
+        """
+        Remove a file from the cache, e.g. after its tags were written
+        
+        Args:
+            file_path: Path to the file
+        """
+        with self._lock:
+            self._pending.pop(file_path, None)
+            self._touched.pop(file_path, None)
+            self._connection.execute("DELETE FROM tags WHERE path = ?", (file_path,))
+            self._connection.commit()
+    
+    def flush(self):
+        """Commit buffered writes to disk"""
+        with self._lock:
+            self._flush()
+    
+    def close(self):
+        """Commit buffered writes and close the database"""
+        with self._lock:
+            self._flush()
+            self._connection.close()
+    
+    def stats(self):
+        """
+        Get the cache counters
+        
+        Returns:
+            dict: Hits, misses and evictions since the cache was opened
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+    
+    def _flush(self):
+        """Commit buffered writes and evict old entries (caller holds _lock)"""
+        if not self._pending and not self._touched:
+            return
+        
+        now = time.time_ns()
+        self._max_count += len(self._pending)
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO tags (path, size, mtime_ns, inode, tags, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            ((path,) + row + (now,) for path, row in self._pending.items())
+        )
+        self._connection.executemany(
+            "UPDATE tags SET last_used = ? WHERE path = ?",
+            ((last_used, path) for path, last_used in self._touched.items())
+        )
+        self._pending.clear()
+        self._touched.clear()
+        
+        if self._max_count > self.max_entries:
+            count = self._connection.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - int(self.max_entries * EVICTION_TARGET)
+                self._connection.execute(
+                    "DELETE FROM tags WHERE path IN "
+                    "(SELECT path FROM tags ORDER BY last_used LIMIT ?)", (excess,)
+                )
+                self.evictions += excess
+                count -= excess
+            self._max_count = count
+        
+        self._connection.commit()
+
+
+def open_tag_cache(max_entries=1000000, cache_file=TAG_CACHE_FILE):
+    """
+    Open the tag cache, or return None if it can't be opened
+    
+    Args:
+        max_entries: Maximum number of cached files
+        cache_file: Path to the SQLite database file
+    
+    Returns:
+        TagCache: The opened cache, or None
+    """
+    try:
+        return TagCache(cache_file, max_entries)
+    except Exception as e:
+        print(f"Error opening tag cache: {e}")
+        return None
@@ -0,0 +1,274 @@
+"""
+Tag I/O - Streams tags to JSON lines or CSV files and imports edited files back
+"""
+import os
+import csv
+import json
+from collections import namedtuple
+from tag_processor.processor import TAG_FRAMES, DESCRIBED_FRAMES, is_tag_field
+from tag_processor.bulk_save import BulkSaver
+from tag_processor.rules import Change
+
+# File formats of exports and imports
+FORMATS = ("jsonl", "csv")
+
+# Column holding the path of each file
+PATH_COLUMN = "path"
+
+# Columns of the stream information, which is exported but not imported
+STREAM_INFO_COLUMNS = ("length", "bitrate")
+
+# Number of files read, compared and saved together by an import
+CHUNK_SIZE = 1000
+
+# Largest value read from a CSV file, in characters
+MAX_FIELD_SIZE = 16 * 1024 * 1024
+
+# A row of an import file; error is set instead of path and values if the row can't be used
+TagRow = namedtuple("TagRow", ["line", "path", "values", "error"])
+
+def guess_format(file_name):
+    """
+    Get the format of an export or import file from its extension
+    
+    Args:
+        file_name: Name of the file
+    
+    Returns:
+        str: "csv" for .csv files, otherwise "jsonl"
+    """
+    return "csv" if file_name.lower().endswith(".csv") else "jsonl"
+
+def csv_columns(fields=None, stream_info=False):
+    """
+    Get the columns of a CSV export after the path
+    
+    A CSV file has the same columns on every row, so they have to be known
+    before the first file is read. User-defined TXXX frames differ from
+    file to file, so they are only exported to JSON lines.
+    
+    Args:
+        fields: Fields that are read, see processor.ALL_FIELDS (default: all)
+        stream_info: Whether the length and bitrate are read
+    
+    Returns:
+        list: Column names
+    """
+    columns = [field for field in tuple(TAG_FRAMES) + tuple(DESCRIBED_FRAMES)
+               if fields is None or field in fields]
+    if stream_info:
+        columns.extend(STREAM_INFO_COLUMNS)
+    return columns
+
+class TagExporter:
+    """
+    Writes the tags of files to a stream, one line or row per file
+    
+    Nothing is kept once a file is written, so exports of any size take
+    constant memory when the tags come from a TagPipeline that discards
+    the files it has reported.
+    """
+    
+    def __init__(self, stream, file_format="jsonl", columns=None):
+        """
+        Args:
+            stream: Text stream to write to; CSV streams should be opened
+                with newline=""
+            file_format: "jsonl" or "csv"
+            columns: Columns of a CSV export after the path (defaults to
+                csv_columns()); JSON lines hold every field of a file
+        """
+        self.stream = stream
+        self.file_format = file_format
+        self.count = 0  # Number of files written
+        
+        if file_format == "csv":
+            self.columns = list(columns) if columns is not None else csv_columns()
+            self._csv = csv.writer(stream)
+            self._csv.writerow([PATH_COLUMN] + self.columns)
+    
+    def write(self, file_path, tag_info):
+        """
+        Write the tags of a file
+        
+        Args:
+            file_path: Path to the MP3 file
+            tag_info: Dictionary containing the tag information
+        """
+        if self.file_format == "csv":
+            self._csv.writerow([file_path] + [tag_info.get(column, "") for column in self.columns])
+        else:
+            record = {PATH_COLUMN: file_path}
+            record.update(tag_info)
+            self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+def _tag_values(record):
+    """Get the tag fields of a row as strings; other columns, such as the length, are ignored"""
+    return {key: "" if value is None else str(value) for key, value in record.items()
+            if key != PATH_COLUMN and is_tag_field(key)}
+
+def read_rows(stream, file_format="jsonl"):
+    """
+    Read the rows of an export that may have been edited
+    
+    Rows are read one at a time. JSON lines may also be the "result"
+    events of batch process, whose fields are under "tags". A field that
+    is missing from a row is left as it is; an empty value clears it.
+    
+    Args:
+        stream: Text stream to read from; CSV streams should be opened with
+            newline=""
+        file_format: "jsonl" or "csv"
+    
+    Yields:
+        TagRow: Rows in file order, numbered from 1 (the CSV header is line 1)
+    
+    Raises:
+        ValueError: If a CSV file has no path column or can't be parsed
+    """
+    if file_format == "csv":
+        # Lyrics can be longer than the csv module allows by default
+        csv.field_size_limit(max(csv.field_size_limit(), MAX_FIELD_SIZE))
+        reader = csv.DictReader(stream)
+        if reader.fieldnames is None:
+            return
+        if PATH_COLUMN not in reader.fieldnames:
+            raise ValueError(f"The CSV file has no {PATH_COLUMN} column")
+        
+        try:
+            for record in reader:
+                line = reader.line_num
+                if not record[PATH_COLUMN]:
+                    yield TagRow(line, None, None, "No path")
+                    continue
+                # Cells missing from a short row are None, and leave their fields alone
+                yield TagRow(line, record[PATH_COLUMN],
+                             _tag_values({key: value for key, value in record.items() if value is not None}), None)
+        except csv.Error as e:
+            raise ValueError(f"line {reader.line_num}: {e}")
+        return
+    
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+        except ValueError as e:
+            yield TagRow(line, None, None, f"Invalid JSON: {e}")
+            continue
+        
+        if not isinstance(record, dict) or not isinstance(record.get(PATH_COLUMN), str):
+            yield TagRow(line, None, None, "No path")
+            continue
+        tags = record.get("tags")
+        yield TagRow(line, record[PATH_COLUMN], _tag_values(tags if isinstance(tags, dict) else record), None)
+
+class TagImporter:
+    """
+    Applies the values of an edited export to the files
+    
+    Rows are handled in chunks: the files of a chunk are processed, every
+    value that differs from the file's tag is set like an edit made in the
+    table, the files are saved with a BulkSaver, and the chunk is dropped
+    from the tag store before the next one is read. Memory use depends on
+    the chunk size, not on the size of the import.
+    
+    Only files with values that differ from their tags are written, so
+    files whose rows weren't edited are not touched, even if processing
+    alone would change them (e.g. re-encoded text). A file that is written
+    is saved like one edited in the table, including the changes of
+    processing, such as the values moved out of an ID3v1 tag.
+    """
+    
+    def __init__(self, tag_processor, workers=None, concurrency=4, chunk_size=CHUNK_SIZE):
+        """
+        Args:
+            tag_processor: TagProcessor that reads and saves the files
+            workers: Number of worker processes reading the files that
+                aren't cached, shared by all chunks (defaults to the CPU count)
+            concurrency: Maximum number of files written at the same time
+            chunk_size: Number of files handled together
+        """
+        self.tag_processor = tag_processor
+        self.workers = workers
+        self.chunk_size = max(1, chunk_size)
+        self.saver = BulkSaver(tag_processor, concurrency)
+    
+    def run(self, rows, on_edit=None, on_saved=None, on_error=None):
+        """
+        Import rows
+        
+        Rows for the same file are merged if they fall into the same chunk,
+        the later values winning.
+        
+        Args:
+            rows: Iterable of TagRow, e.g. from read_rows; it is consumed
+                one chunk at a time
+            on_edit: Called with a rules.Change for every value that is set
+            on_saved: Called with (file_path, result, error) once a file has
+                been saved, like the results of BulkSaver.save
+            on_error: Called with (file_path, stage, error) for a row that
+                can't be used (stage "import", file_path is "line N") or a
+                file that can't be read (stage "process")
+        """
+        on_edit = on_edit or (lambda change: None)
+        on_saved = on_saved or (lambda file_path, result, error: None)
+        on_error = on_error or (lambda file_path, stage, error: None)
+        
+        # One pool reads the files of every chunk; its processes are only started once files aren't cached
+        workers = self.workers if self.workers and self.workers > 0 else os.cpu_count() or 1
+        executor = self.tag_processor.create_worker_pool(workers) if workers > 1 else None
+        try:
+            chunk = {}  # file path -> values
+            for row in rows:
+                if row.error is not None:
+                    on_error(f"line {row.line}", "import", row.error)
+                    continue
+                
+                values = chunk.get(row.path)
+                if values is None:
+                    chunk[row.path] = row.values
+                else:
+                    values.update(row.values)
+                
+                if len(chunk) >= self.chunk_size:
+                    self._import_chunk(chunk, workers, executor, on_edit, on_saved, on_error)
+                    chunk = {}
+            
+            if chunk:
+                self._import_chunk(chunk, workers, executor, on_edit, on_saved, on_error)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+    
+    def _import_chunk(self, chunk, workers, executor, on_edit, on_saved, on_error):
+        """Process, change and save the files of a chunk, then forget them"""
+        tag_processor = self.tag_processor
+        store = tag_processor.store
+        processed_paths = []
+        
+        try:
+            for file_path, tag_info in tag_processor.process_files(list(chunk), workers=workers,
+                                                                        executor=executor):
+                if tag_info is None:
+                    on_error(file_path, "process", "Could not read tags")
+                    continue
+                
+                changes = [Change(file_path, key, tag_info.get(key) or "", value)
+                           for key, value in chunk[file_path].items() if (tag_info.get(key) or "") != value]
+                if changes:
+                    tag_processor.set_tags((change.path, change.field, change.new) for change in changes)
+                    for change in changes:
+                        on_edit(change)
+                else:
+                    # Nothing was edited, so what processing would change on its own isn't written either
+                    store.clear_dirty(file_path)
+                processed_paths.append(file_path)
+            
+            # Files without changes are reported as skipped without being touched
+            for file_path, result, error in self.saver.save(processed_paths):
+                on_saved(file_path, result, error)
+        finally:
+            for file_path in chunk:
+                store.discard(file_path)
@@ -0,0 +1,663 @@
+"""
+Tag store - Compact in-memory (or on-disk) storage of processed tags
+"""
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+from array import array
+from collections.abc import Mapping
+
+# Fields whose values repeat across many files and are stored only once
+SHARED_FIELDS = frozenset(["artist", "album", "year", "genre", "track", "disc", "album_artist", "composer"])
+
+# Fields every processed file has, stored as columns with a bit in the dirty masks
+COLUMN_FIELDS = ("title", "artist", "album", "year", "genre", "track", "disc", "album_artist", "composer", "bpm",
+                 "comment", "lyrics", "length", "bitrate")
+
+# Number of shared values kept before discard() drops those no row uses any more
+SHARED_PRUNE_SIZE = 4096
+
+class TagStore(Mapping):
+    """
+    Processed tags of all files of a session, stored by column
+    
+    Every field of COLUMN_FIELDS is a list of values indexed by row, so a
+    file costs one list slot per field instead of a dictionary of its own.
+    Fields only some files have, such as TXXX frames, are kept in a small
+    dictionary per row that has them. Repeating values (artist, album,
+    year, genre) are shared between rows, the dirty column fields of a row
+    are a bitmask and the bytes read per file live in an array of machine
+    integers.
+    
+    The store is a read-only mapping of file path to tag dictionary; the
+    dictionaries are built on access. Failed files have a row for their
+    statistics but are not part of the mapping.
+    
+    Files are stored by worker threads while the table reads them, so every
+    access holds a lock, and a row only becomes visible once it is complete.
+    """
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+    
+    def _reset(self):
+        """Forget all files"""
+        self._rows = {}  # file path -> row number
+        self._paths = []  # row number -> file path
+        self._fields = {field: bit for bit, field in enumerate(COLUMN_FIELDS)}  # field -> bit in the dirty masks
+        self._columns = {}  # field -> list of values by row, None if the file has no value
+        self._other = {}  # row -> {field: value} of the fields that aren't columns
+        self._dirty = []  # Bitmask of dirty column fields by row
+        self._other_dirty = {}  # row -> set of the dirty fields that aren't columns
+        self._bytes_read = array('Q')
+        self._processed = bytearray()  # 1 if the row holds tags, 0 if processing failed
+        self._shared = {}  # Single copy of each value of the SHARED_FIELDS
+        self._count = 0  # Number of processed rows
+        self._free = []  # Rows of discarded files, reused by put()
+        self._discarded_bytes_read = 0  # Bytes read from discarded files
+    
+    def __getitem__(self, file_path):
+        with self._lock:
+            row = self._processed_row(file_path)
+            tag_info = {}
+            for field, column in self._columns.items():
+                value = column[row]
+                if value is not None:
+                    tag_info[field] = value
+            tag_info.update(self._other.get(row, ()))
+            return tag_info
+    
+    def __contains__(self, file_path):
+        with self._lock:
+            row = self._rows.get(file_path)
+            return row is not None and self._processed[row] == 1
+    
+    def __iter__(self):
+        with self._lock:
+            processed = self._processed
+            return iter([path for row, path in enumerate(self._paths) if processed[row]])
+    
+    def __len__(self):
+        return self._count
+    
+    def put(self, file_path, tag_info, dirty_fields=(), bytes_read=0):
+        """
+        Store the processed tags of a file, replacing earlier ones
+        
+        Args:
+            file_path: Path to the MP3 file
+            tag_info: Dictionary of tag values, or None if processing failed
+            dirty_fields: Fields that differ from the tags in the file
+            bytes_read: Number of bytes read from the file
+        """
+        with self._lock:
+            row = self._rows.get(file_path)
+            if row is None and self._free:
+                row = self._free.pop()
+                self._paths[row] = file_path
+            elif row is None:
+                row = len(self._paths)
+                self._paths.append(file_path)
+                for column in self._columns.values():
+                    column.append(None)
+                self._dirty.append(0)
+                self._bytes_read.append(0)
+                self._processed.append(0)
+            else:
+                for column in self._columns.values():
+                    column[row] = None
+                self._other.pop(row, None)
+            
+            self._count += (tag_info is not None) - self._processed[row]
+            self._processed[row] = tag_info is not None
+            self._bytes_read[row] = bytes_read
+            self._dirty[row] = 0
+            self._other_dirty.pop(row, None)
+            
+            if tag_info is not None:
+                for field, value in tag_info.items():
+                    self._set(row, field, value)
+                self._mark_dirty(row, dirty_fields)
+            
+            # Published last, so the row is never seen half-written
+            self._rows[file_path] = row
+    
+    def _get(self, row, field):
+        """Get a single value, None if the file has none"""
+        column = self._columns.get(field)
+        if column is not None:
+            return column[row]
+        return self._other.get(row, {}).get(field)
+    
+    def _set(self, row, field, value):
+        """Store a single value"""
+        if field not in self._fields:
+            other = self._other.get(row)
+            if value is None:
+                if other:
+                    other.pop(field, None)
+            elif other is None:
+                self._other[row] = {field: value}
+            else:
+                other[field] = value
+            return
+        
+        column = self._columns.get(field)
+        if column is None:
+            column = self._columns[field] = [None] * len(self._paths)
+        
+        if field in SHARED_FIELDS and isinstance(value, str):
+            value = self._shared.setdefault(value, value)
+        column[row] = value
+    
+    def _mark_dirty(self, row, fields):
+        """Add fields to the dirty fields of a row"""
+        mask = 0
+        for field in fields:
+            bit = self._fields.get(field)
+            if bit is not None:
+                mask |= 1 << bit
+            else:
+                self._other_dirty.setdefault(row, set()).add(field)
+        self._dirty[row] |= mask
+    
+    def _processed_row(self, file_path):
+        """Get the row of a processed file or raise KeyError"""
+        row = self._rows.get(file_path)
+        if row is None or not self._processed[row]:
+            raise KeyError(file_path)
+        return row
+    
+    def column(self, field, file_paths):
+        """
+        Get the values of a field for many files at once
+        
+        Args:
+            field: Tag field, e.g. "artist"
+            file_paths: Paths of processed files
+        
+        Returns:
+            list: Values in the order of file_paths; None where a file has no value
+        """
+        with self._lock:
+            rows = self._rows
+            if field not in self._fields:
+                other = self._other
+                return [other.get(rows[file_path], {}).get(field) for file_path in file_paths]
+            
+            column = self._columns.get(field)
+            if column is None:
+                return [None] * len(file_paths)
+            return [column[rows[file_path]] for file_path in file_paths]
+    
+    def set_value(self, file_path, field, value):
+        """
+        Change a value of a processed file and mark the field dirty
+        
+        Args:
+            file_path: Path to the MP3 file
+            field: Tag field, e.g. "title"
+            value: New value
+        
+        Returns:
+            bool: True if the value changed
+        """
+        with self._lock:
+            row = self._processed_row(file_path)
+            if self._get(row, field) == value:
+                return False
+            
+            self._set(row, field, value)
+            self._mark_dirty(row, [field])
+            return True
+    
+    def set_values(self, changes):
+        """
+        Change many values at once, see set_value
+        
+        Args:
+            changes: Iterable of (file_path, field, value) tuples
+        
+        Returns:
+            int: Number of values that changed
+        """
+        return sum(self.set_value(file_path, field, value) for file_path, field, value in changes)
+    
+    def mark_dirty(self, file_path, field):
+        """
+        Mark a field of a processed file for saving without storing a value,
+        e.g. for data kept elsewhere, such as new artwork
+        
+        Args:
+            file_path: Path to the MP3 file
+            field: Field or pseudo field
+        
+        Raises:
+            KeyError: If the file hasn't been processed
+        """
+        with self._lock:
+            row = self._processed_row(file_path)
+            self._mark_dirty(row, [field])
+    
+    def dirty_fields(self, file_path):
+        """
+        Get the fields of a file that need to be saved
+        
+        Args:
+            file_path: Path to the MP3 file
+        
+        Returns:
+            set: Dirty fields; empty for clean or unknown files
+        """
+        with self._lock:
+            row = self._rows.get(file_path)
+            if row is None:
+                return set()
+            
+            mask = self._dirty[row]
+            fields = {field for field, bit in self._fields.items() if mask & (1 << bit)} if mask else set()
+            fields.update(self._other_dirty.get(row, ()))
+            return fields
+    
+    def is_dirty(self, file_path, field=None):
+        """
+        Check whether a file, or one of its fields, needs to be saved
+        
+        Args:
+            file_path: Path to the MP3 file
+            field: Only check this field
+        
+        Returns:
+            bool: True if there are unsaved changes
+        """
+        with self._lock:
+            row = self._rows.get(file_path)
+            if row is None:
+                return False
+            if field is None:
+                return self._dirty[row] != 0 or row in self._other_dirty
+            
+            bit = self._fields.get(field)
+            if bit is None:
+                return field in self._other_dirty.get(row, ())
+            return bool(self._dirty[row] & (1 << bit))
+    
+    def clear_dirty(self, file_path):
+        """
+        Mark a file as saved
+        
+        Args:
+            file_path: Path to the MP3 file
+        """
+        with self._lock:
+            row = self._rows.get(file_path)
+            if row is not None:
+                self._dirty[row] = 0
+                self._other_dirty.pop(row, None)
+    
+    def bytes_read(self, file_path):
+        """
+        Get the number of bytes read from a file while processing it
+        
+        Args:
+            file_path: Path to the MP3 file
+        
+        Returns:
+            int: Bytes read, 0 for unknown files
+        """
+        with self._lock:
+            row = self._rows.get(file_path)
+            return self._bytes_read[row] if row is not None else 0
+    
+    def total_bytes_read(self):
+        """Get the number of bytes read from all files, including discarded ones"""
+        with self._lock:
+            return sum(self._bytes_read) + self._discarded_bytes_read
+    
+    def discard(self, file_path):
+        """
+        Forget a file that is no longer needed, e.g. once it has been saved
+        
+        Its row is reused by the next file, so a stream of files that are
+        discarded after use keeps the store at a constant size. The bytes
+        read from the file still count towards total_bytes_read().
+        
+        Args:
+            file_path: Path to the MP3 file
+        """
+        with self._lock:
+            row = self._rows.pop(file_path, None)
+            if row is None:
+                return
+            
+            self._count -= self._processed[row]
+            self._discarded_bytes_read += self._bytes_read[row]
+            for column in self._columns.values():
+                column[row] = None
+            self._other.pop(row, None)
+            self._paths[row] = None
+            self._dirty[row] = 0
+            self._other_dirty.pop(row, None)
+            self._bytes_read[row] = 0
+            self._processed[row] = 0
+            self._free.append(row)
+            
+            if not self._rows:
+                self._shared = {}
+            elif len(self._shared) > max(SHARED_PRUNE_SIZE, 2 * len(SHARED_FIELDS) * len(self._rows)):
+                self._prune_shared()
+    
+    def _prune_shared(self):
+        """Drop the shared values that no row uses any more"""
+        shared = {}
+        for field in SHARED_FIELDS:
+            for value in self._columns.get(field, ()):
+                if isinstance(value, str):
+                    shared[value] = value
+        self._shared = shared
+    
+    def clear(self):
+        """Remove all files"""
+        with self._lock:
+            self._reset()
+    
+    def close(self):
+        """Release the storage"""
+        self.clear()
+
+class SpilledTagStore(TagStore):
+    """
+    Tag store kept in a temporary SQLite database instead of memory
+    
+    For sessions with more files than fit in memory. Lookups go through
+    SQLite's page cache, so they are slower than with TagStore; the file is
+    deleted when the store is closed.
+    """
+    
+    def __init__(self, directory=None):
+        """
+        Args:
+            directory: Directory for the database file (defaults to the
+                system's temporary directory)
+        """
+        fd, self.db_file = tempfile.mkstemp(dir=directory, prefix="mp3tagedit-store-", suffix=".sqlite3")
+        os.close(fd)
+        
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=OFF")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.execute(
+            "CREATE TABLE files (path TEXT PRIMARY KEY, tags TEXT, dirty TEXT, bytes_read INTEGER)"
+        )
+        self._count = 0
+        self._total_bytes_read = 0
+    
+    def _query(self, sql, params=()):
+        """Run a query and return the first row"""
+        with self._lock:
+            return self._connection.execute(sql, params).fetchone()
+    
+    def _execute(self, sql, params=()):
+        """Run a statement"""
+        with self._lock:
+            self._connection.execute(sql, params)
+    
+    def __getitem__(self, file_path):
+        row = self._query("SELECT tags FROM files WHERE path = ? AND tags IS NOT NULL", (file_path,))
+        if row is None:
+            raise KeyError(file_path)
+        return json.loads(row[0])
+    
+    def __contains__(self, file_path):
+        return self._query("SELECT 1 FROM files WHERE path = ? AND tags IS NOT NULL", (file_path,)) is not None
+    
+    def __iter__(self):
+        with self._lock:
+            paths = [row[0] for row in self._connection.execute(
+                "SELECT path FROM files WHERE tags IS NOT NULL ORDER BY rowid")]
+        return iter(paths)
+    
+    def put(self, file_path, tag_info, dirty_fields=(), bytes_read=0):
+        """
+        Store the processed tags of a file, replacing earlier ones
+        
+        Args:
+            file_path: Path to the MP3 file
+            tag_info: Dictionary of tag values, or None if processing failed
+            dirty_fields: Fields that differ from the tags in the file
+            bytes_read: Number of bytes read from the file
+        """
+        tags = json.dumps(tag_info, ensure_ascii=False) if tag_info is not None else None
+        dirty = json.dumps(sorted(dirty_fields)) if tag_info is not None and dirty_fields else None
+        
+        with self._lock:
+            old = self._connection.execute(
+                "SELECT tags IS NOT NULL, bytes_read FROM files WHERE path = ?", (file_path,)).fetchone()
+            if old is not None:
+                self._count -= old[0]
+                self._total_bytes_read -= old[1]
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files (path, tags, dirty, bytes_read) VALUES (?, ?, ?, ?)",
+                (file_path, tags, dirty, bytes_read))
+            self._count += tag_info is not None
+            self._total_bytes_read += bytes_read
+    
+    def column(self, field, file_paths):
+        """
+        Get the values of a field for many files at once
+        
+        Args:
+            field: Tag field, e.g. "artist"
+            file_paths: Paths of processed files
+        
+        Returns:
+            list: Values in the order of file_paths; None where a file has no value
+        """
+        # One pass over the table is much faster than a query per file
+        wanted = set(file_paths)
+        with self._lock:
+            try:
+                rows = self._connection.execute("SELECT path, json_extract(tags, ?) FROM files "
+                                                "WHERE tags IS NOT NULL", ("$." + field,)).fetchall()
+            except sqlite3.OperationalError:
+                # SQLite built without the JSON functions
+                rows = [(file_path, json.loads(tags).get(field)) for file_path, tags in self._connection.execute(
+                    "SELECT path, tags FROM files WHERE tags IS NOT NULL")]
+        
+        values = {file_path: value for file_path, value in rows if file_path in wanted}
+        return [values.get(file_path) for file_path in file_paths]
+    
+    def set_value(self, file_path, field, value):
+        """
+        Change a value of a processed file and mark the field dirty
+        
+        Args:
+            file_path: Path to the MP3 file
+            field: Tag field, e.g. "title"
+            value: New value
+        
+        Returns:
+            bool: True if the value changed
+        """
+        tag_info = self[file_path]
+        if tag_info.get(field) == value:
+            return False
+        
+        tag_info[field] = value
+        dirty = self.dirty_fields(file_path) | {field}
+        self._execute("UPDATE files SET tags = ?, dirty = ? WHERE path = ?",
+                      (json.dumps(tag_info, ensure_ascii=False), json.dumps(sorted(dirty)), file_path))
+        return True
+    
+    def set_values(self, changes):
+        """
+        Change many values at once, see set_value
+        
+        Each file is read and written once, in a single transaction.
+        
+        Args:
+            changes: Iterable of (file_path, field, value) tuples
+        
+        Returns:
+            int: Number of values that changed
+        """
+        by_file = {}
+        for file_path, field, value in changes:
+            by_file.setdefault(file_path, {})[field] = value
+        
+        changed = 0
+        updates = []
+        with self._lock:
+            for file_path, values in by_file.items():
+                row = self._connection.execute(
+                    "SELECT tags, dirty FROM files WHERE path = ? AND tags IS NOT NULL", (file_path,)).fetchone()
+                if row is None:
+                    raise KeyError(file_path)
+                
+                tag_info = json.loads(row[0])
+                dirty = set(json.loads(row[1])) if row[1] is not None else set()
+                fields = {field for field, value in values.items() if tag_info.get(field) != value}
+                if not fields:
+                    continue
+                
+                for field in fields:
+                    tag_info[field] = values[field]
+                changed += len(fields)
+                updates.append((json.dumps(tag_info, ensure_ascii=False), json.dumps(sorted(dirty | fields)),
+                                file_path))
+            
+            with self._connection:
+                self._connection.executemany("UPDATE files SET tags = ?, dirty = ? WHERE path = ?", updates)
+        return changed
+    
+    def mark_dirty(self, file_path, field):
+        """
+        Mark a field of a processed file for saving without storing a value,
+        e.g. for data kept elsewhere, such as new artwork
+        
+        Args:
+            file_path: Path to the MP3 file
+            field: Field or pseudo field
+        
+        Raises:
+            KeyError: If the file hasn't been processed
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT dirty FROM files WHERE path = ? AND tags IS NOT NULL", (file_path,)).fetchone()
+            if row is None:
+                raise KeyError(file_path)
+            dirty = set(json.loads(row[0])) if row[0] is not None else set()
+            self._connection.execute("UPDATE files SET dirty = ? WHERE path = ?",
+                                     (json.dumps(sorted(dirty | {field})), file_path))
+    
+    def dirty_fields(self, file_path):
+        """
+        Get the fields of a file that need to be saved
+        
+        Args:
+            file_path: Path to the MP3 file
+        
+        Returns:
+            set: Dirty fields; empty for clean or unknown files
+        """
+        row = self._query("SELECT dirty FROM files WHERE path = ?", (file_path,))
+        if row is None or row[0] is None:
+            return set()
+        return set(json.loads(row[0]))
+    
+    def is_dirty(self, file_path, field=None):
+        """
+        Check whether a file, or one of its fields, needs to be saved
+        
+        Args:
+            file_path: Path to the MP3 file
+            field: Only check this field
+        
+        Returns:
+            bool: True if there are unsaved changes
+        """
+        if field is None:
+            row = self._query("SELECT dirty IS NOT NULL FROM files WHERE path = ?", (file_path,))
+            return bool(row and row[0])
+        return field in self.dirty_fields(file_path)
+    
+    def clear_dirty(self, file_path):
+        """
+        Mark a file as saved
+        
+        Args:
+            file_path: Path to the MP3 file
+        """
+        self._execute("UPDATE files SET dirty = NULL WHERE path = ?", (file_path,))
+    
+    def bytes_read(self, file_path):
+        """
+        Get the number of bytes read from a file while processing it
+        
+        Args:
+            file_path: Path to the MP3 file
+        
+        Returns:
+            int: Bytes read, 0 for unknown files
+        """
+        row = self._query("SELECT bytes_read FROM files WHERE path = ?", (file_path,))
+        return row[0] if row is not None else 0
+    
+    def total_bytes_read(self):
+        """Get the number of bytes read from all files"""
+        return self._total_bytes_read
+    
+    def discard(self, file_path):
+        """
+        Forget a file that is no longer needed, e.g. once it has been saved
+        
+        The bytes read from the file still count towards total_bytes_read().
+        
+        Args:
+            file_path: Path to the MP3 file
+        """
+        with self._lock:
+            old = self._connection.execute(
+                "SELECT tags IS NOT NULL FROM files WHERE path = ?", (file_path,)).fetchone()
+            if old is not None:
+                self._count -= old[0]
+                self._connection.execute("DELETE FROM files WHERE path = ?", (file_path,))
+    
+    def clear(self):
+        """Remove all files"""
+        self._execute("DELETE FROM files")
+        self._count = 0
+        self._total_bytes_read = 0
+    
+    def close(self):
+        """Close and delete the database"""
+        with self._lock:
+            self._connection.close()
+        try:
+            os.unlink(self.db_file)
+        except OSError:
+            pass
+
+def create_tag_store(spill_to_disk=False, directory=None):
+    """
+    Create the tag store of a session
+    
+    Args:
+        spill_to_disk: Keep the tags in a temporary database instead of
+            memory, for sessions larger than the available memory
+        directory: Directory for the database file
+    
+    Returns:
+        TagStore: The new store
+    """
+    if spill_to_disk:
+        try:
+            return SpilledTagStore(directory)
+        except Exception as e:
+            print(f"Error creating on-disk tag store, keeping tags in memory: {e}")
+    return TagStore()
@@ -0,0 +1,343 @@
+"""
+Tag writer - Writes ID3v2 tags without rewriting the audio when possible
+"""
+import os
+import io
+import tempfile
+from tag_processor.id3v1 import ID3V1_SIZE, TAIL_SIZE, read_tail, find_id3v1, parse_id3v1
+
+# Size of the ID3v2 header and footer
+ID3V2_HEADER_SIZE = 10
+
+# Block size used when the audio has to be copied through Python
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# Prefix of the temporary files written next to the file being rewritten
+TEMP_PREFIX = ".mp3tagedit-"
+
+# Results of TagWriter.write
+IN_PLACE = "in_place"
+REWRITTEN = "rewritten"
+
+class TagWriter:
+    """
+    Writes ID3v2 tags to MP3 files
+    
+    A tag that fits into the space of the existing tag, including its
+    padding, is overwritten in place. Otherwise the file is rewritten: the
+    new tag and the audio are written to a temporary file that replaces the
+    original atomically. The audio is copied by the kernel where possible
+    and is never held in memory.
+    """
+    
+    def __init__(self, padding=4096, max_padding=1024 * 1024):
+        """
+        Args:
+            padding: Padding added after the frames when the file has to be
+                rewritten, so later edits fit in place
+            max_padding: Largest padding left in place; a tag that would
+                leave more padding than this is shrunk by rewriting the file
+        """
+        self.padding = padding
+        self.max_padding = max_padding
+    
+    def write(self, file_path, id3, atomic=False, strip_v1=False, keep_v1=()):
+        """
+        Write an ID3v2.4 tag to a file
+        
+        An existing ID3v1 tag is updated with the new values, or removed
+        together with any Enhanced tag if strip_v1 is set.
+        
+        Args:
+            file_path: Path to the MP3 file
+            id3: Mutagen ID3 object to write
+            atomic: Always write through a temporary file and rename, even
+                when the tag would fit in place
+            strip_v1: Remove the ID3v1 tag
+            keep_v1: Frame IDs whose values in the existing ID3v1 tag are
+                kept when id3 has no such frame, e.g. fields that were not
+                read
+        
+        Returns:
+            tuple: (IN_PLACE or REWRITTEN, number of bytes written)
+        """
+        from mutagen.id3 import MakeID3v1
+        
+        with open(file_path, 'r+b') as f:
+            old_size = self._read_tag_size(f)
+            data = self._render(id3, f, old_size)
+            
+            old_v1 = self._read_id3v1(f, old_size)
+            v1_size = len(old_v1)
+            v1_data = b""
+            if v1_size and not strip_v1:
+                frames = id3
+                if keep_v1:
+                    frames = dict(id3.items())
+                    for frame_id, frame in parse_id3v1(old_v1).items():
+                        if frame_id in keep_v1 and frame_id not in frames:
+                            frames[frame_id] = frame
+                
+                # Only the basic tag is updated; an Enhanced tag before it is kept
+                v1_size = ID3V1_SIZE
+                v1_data = MakeID3v1(frames)
+            
+            if len(data) == old_size and not atomic:
+                f.seek(0)
+                f.write(data)
+                bytes_written = len(data) + self._replace_id3v1(f, v1_size, v1_data)
+                return IN_PLACE, bytes_written
+        
+        bytes_written = self._rewrite(file_path, data, old_size, v1_size, v1_data)
+        return REWRITTEN, bytes_written
+    
+    def write_raw(self, file_path, tag_data, v1_data=b"", atomic=False):
+        """
+        Replace the ID3v2 tag of a file with raw tag bytes, e.g. a backup
+        
+        Args:
+            file_path: Path to the MP3 file
+            tag_data: Complete ID3v2 tag, or empty bytes to remove the tag
+            v1_data: ID3v1 tag, including any Enhanced tag, that replaces the
+                file's ID3v1 tag or is appended if it has none; if empty, the
+                file's ID3v1 tag is kept
+            atomic: Always write through a temporary file and rename
+        
+        Returns:
+            tuple: (IN_PLACE or REWRITTEN, number of bytes written)
+        """
+        with open(file_path, 'r+b') as f:
+            old_size = self._read_tag_size(f)
+            v1_size = len(self._read_id3v1(f, old_size)) if v1_data else 0
+            
+            if len(tag_data) == old_size and not atomic:
+                f.seek(0)
+                f.write(tag_data)
+                bytes_written = len(tag_data) + self._replace_id3v1(f, v1_size, v1_data)
+                return IN_PLACE, bytes_written
+        
+        bytes_written = self._rewrite(file_path, tag_data, old_size, v1_size, v1_data)
+        return REWRITTEN, bytes_written
+    
+    def strip_id3v1(self, file_path):
+        """
+        Remove the ID3v1 tag, and any Enhanced tag, by truncating the file
+        
+        Args:
+            file_path: Path to the MP3 file
+        
+        Returns:
+            int: Number of bytes removed
+        """
+        with open(file_path, 'r+b') as f:
+            v1_size = len(self._read_id3v1(f, self._read_tag_size(f)))
+            if v1_size:
+                f.truncate(os.fstat(f.fileno()).st_size - v1_size)
+        return v1_size
+    
+    def read_raw(self, file_path):
+        """
+        Read the raw ID3v2 and ID3v1 tags of a file, e.g. for a backup
+        
+        Args:
+            file_path: Path to the MP3 file
+        
+        Returns:
+            tuple: (ID3v2 tag bytes, ID3v1 tag bytes including any Enhanced
+                tag); either may be empty
+        """
+        with open(file_path, 'rb') as f:
+            tag_size = self._read_tag_size(f)
+            f.seek(0)
+            tag_data = f.read(tag_size)
+            v1_data = self._read_id3v1(f, tag_size)
+        
+        return tag_data, v1_data
+    
+    def _read_tag_size(self, f):
+        """
+        Get the size of the existing ID3v2 tag
+        
+        Args:
+            f: MP3 file opened in binary mode
+        
+        Returns:
+            int: Size of the tag including header, padding and footer, or 0
+        """
+        f.seek(0)
+        header = f.read(ID3V2_HEADER_SIZE)
+        if len(header) < ID3V2_HEADER_SIZE or header[:3] != b"ID3":
+            return 0
+        
+        size = ID3V2_HEADER_SIZE + ((header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9])
+        if header[5] & 0x10:
+            size += ID3V2_HEADER_SIZE  # Footer
+        return size
+    
+    def _render(self, id3, f, old_size):
+        """
+        Render the tag, padded to fill the old tag's space when it fits
+        
+        Args:
+            id3: Mutagen ID3 object
+            f: MP3 file opened in binary mode
+            old_size: Size of the existing tag
+        
+        Returns:
+            bytes: The complete tag
+        """
+        def padding_policy(info):
+            # info.padding is the space left in the old tag after the new frames
+            if 0 <= info.padding <= self.max_padding:
+                return info.padding
+            return self.padding
+        
+        return id3._prepare_data(f, 0, old_size, 4, '/', padding_policy)
+    
+    def _read_id3v1(self, f, tag_size):
+        """
+        Read the ID3v1 tag, including any Enhanced tag, of an open file
+        
+        Args:
+            f: MP3 file opened in binary mode
+            tag_size: Size of the ID3v2 tag, which the ID3v1 tag can't overlap
+        
+        Returns:
+            bytes: The tag, or empty bytes if there is none
+        """
+        file_size = os.fstat(f.fileno()).st_size
+        tail = read_tail(f.fileno(), file_size, min(TAIL_SIZE, file_size - tag_size))
+        return find_id3v1(tail)
+    
+    def _replace_id3v1(self, f, v1_size, v1_data):
+        """
+        Replace the last v1_size bytes of a file with a new ID3v1 tag
+        
+        Args:
+            f: MP3 file opened for reading and writing
+            v1_size: Size of the existing tag; 0 appends the new tag
+            v1_data: New tag; if empty, the existing tag is removed
+        
+        Returns:
+            int: Number of bytes written
+        """
+        if not v1_size and not v1_data:
+            return 0
+        
+        file_size = f.seek(0, io.SEEK_END)
+        f.seek(file_size - v1_size)
+        f.write(v1_data)
+        if len(v1_data) < v1_size:
+            f.truncate()
+        return len(v1_data)
+    
+    def _rewrite(self, file_path, data, old_size, v1_size, v1_data):
+        """
+        Write the new tag followed by the audio to a temporary file and
+        replace the original with it
+        
+        Args:
+            file_path: Path to the MP3 file
+            data: The complete new tag
+            old_size: Size of the tag being replaced
+            v1_size: Size of the ID3v1 tag at the end that isn't copied
+            v1_data: ID3v1 tag written after the audio, if any
+        
+        Returns:
+            int: Number of bytes written
+        """
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX, suffix=".tmp")
+        
+        try:
+            with open(file_path, 'rb') as src, os.fdopen(fd, 'w+b') as dst:
+                st = os.fstat(src.fileno())
+                dst.write(data)
+                dst.flush()
+                
+                audio_size = st.st_size - old_size - v1_size
+                copy_range(src.fileno(), dst.fileno(), old_size, audio_size)
+                
+                dst.seek(0, io.SEEK_END)
+                dst.write(v1_data)
+                bytes_written = len(data) + audio_size + len(v1_data)
+                
+                # Keep the original permissions and, where allowed, the owner
+                os.chmod(temp_path, st.st_mode & 0o7777)
+                try:
+                    os.fchown(dst.fileno(), st.st_uid, st.st_gid)
+                except (AttributeError, OSError):
+                    pass
+                
+                dst.flush()
+                os.fsync(dst.fileno())
+                
+                # Never replace the original with a file that lost part of the audio
+                temp_size = os.fstat(dst.fileno()).st_size
+                if temp_size != bytes_written:
+                    raise OSError(f"Temporary file has {temp_size} bytes instead of {bytes_written}")
+            
+            os.replace(temp_path, file_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        
+        return bytes_written
+
+def copy_range(src_fd, dst_fd, offset, count):
+    """
+    Copy bytes from one file to the end of another
+    
+    Uses os.copy_file_range or os.sendfile so the data stays in the kernel
+    (or on the server, for network file systems that support it), and falls
+    back to copying in fixed-size blocks.
+    
+    Args:
+        src_fd: File descriptor to copy from
+        dst_fd: File descriptor to append to, positioned at its end
+        offset: Offset in the source file to start copying at
+        count: Number of bytes to copy
+    
+    Raises:
+        OSError: If fewer than count bytes could be copied
+    """
+    remaining = count
+    
+    if hasattr(os, "copy_file_range"):
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, remaining, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+        except OSError:
+            pass  # Not supported between these file systems; try the next method
+    
+    if remaining > 0 and hasattr(os, "sendfile"):
+        try:
+            while remaining > 0:
+                copied = os.sendfile(dst_fd, src_fd, offset, remaining)
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+        except OSError:
+            pass
+    
+    if remaining > 0:
+        with open(src_fd, 'rb', closefd=False) as src, open(dst_fd, 'ab', closefd=False) as dst:
+            src.seek(offset)
+            while remaining > 0:
+                block = src.read(min(COPY_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                dst.write(block)
+                remaining -= len(block)
+    
+    if remaining > 0:
+        # The source is shorter than expected, e.g. it was truncated while being copied
+        raise OSError(f"Copied {count - remaining} of {count} bytes; the file ended early")
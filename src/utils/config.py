@@ -3,10 +3,26 @@ Configuration module for the MP3 Tag Editor application
 """
 import os
 import json
+import time
+import atexit
+import tempfile
+import threading
 from pathlib import Path
+from collections.abc import MutableMapping
 
 CONFIG_DIR = os.path.join(str(Path.home()), ".mp3tagedit")
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
+TAG_CACHE_FILE = os.path.join(CONFIG_DIR, "tag_cache.sqlite3")
+JOURNAL_DIR = os.path.join(CONFIG_DIR, "journal")
+AUDIO_HASH_FILE = os.path.join(CONFIG_DIR, "audio_hashes.sqlite3")
+THUMBNAIL_DIR = os.path.join(CONFIG_DIR, "thumbnails")
+CHECKPOINT_DIR = os.path.join(CONFIG_DIR, "checkpoints")
+
+# Seconds changes are collected before the config file is written
+WRITE_DELAY = 1.0
+
+# Minimum seconds between two checks of the config file for external edits
+CHECK_INTERVAL = 2.0
 
 # Default configuration
 DEFAULT_CONFIG = {
@@ -15,7 +31,21 @@ DEFAULT_CONFIG = {
     "recursive_search": True,
     "window_width": 800,
     "window_height": 600,
-    "auto_process": False
+    "auto_process": False,
+    "worker_processes": 0,  # 0 uses one worker process per CPU core
+    "read_stream_info": False,  # Scan audio frames for length and bitrate
+    "detect_encoding_per_file": False,
+    "tag_padding": 4096,  # Padding added when a file has to be rewritten
+    "tag_max_padding": 1048576,  # Larger leftover padding is reclaimed by rewriting
+    "tag_cache_enabled": True,
+    "tag_cache_max_entries": 1000000,
+    "tag_store_spill_to_disk": False,  # Keep processed tags on disk for very large sessions
+    "save_threads": 4,  # Files written concurrently when saving
+    "show_artwork": True,  # Show artwork thumbnails next to the file names
+    "thumbnail_cache_max_mb": 64,  # Size limit of the thumbnails kept on disk
+    "artwork_max_size": 1000,  # New artwork is shrunk to fit into this many pixels; 0 keeps it as is
+    "profile_cpu": False,  # Save a cProfile profile of every background task
+    "profile_memory": False  # Save the largest memory allocations of every background task
 }
 
 def ensure_config_dir():
@@ -23,47 +53,207 @@ def ensure_config_dir():
     if not os.path.exists(CONFIG_DIR):
         os.makedirs(CONFIG_DIR)
 
-def load_config():
+class Config(MutableMapping):
     """
-    Load the configuration from the config file
+    Configuration kept in memory and written back in the background
     
-    Returns:
-        dict: Configuration dictionary
+    The config file is read once. Reads are served from memory; the file is
+    only checked for external edits (by modification time and size) every
+    CHECK_INTERVAL seconds. Changes are collected for WRITE_DELAY seconds
+    and then written at once through a temporary file that replaces the
+    config file, so it is never left half-written. Pending changes are
+    written when the process exits.
     """
-    ensure_config_dir()
     
-    if not os.path.exists(CONFIG_FILE):
-        save_config(DEFAULT_CONFIG)
-        return DEFAULT_CONFIG.copy()
+    def __init__(self, config_file=CONFIG_FILE, write_delay=WRITE_DELAY, check_interval=CHECK_INTERVAL):
+        """
+        Args:
+            config_file: Path to the JSON config file
+            write_delay: Seconds changes are collected before writing
+            check_interval: Minimum seconds between checks for external edits
+        """
+        self.config_file = config_file
+        self.write_delay = write_delay
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._values = dict(DEFAULT_CONFIG)
+        self._changed = set()  # Keys changed since the file was last read or written
+        self._file_stamp = None  # (mtime_ns, size) of the file as last read or written
+        self._next_check = 0.0
+        self._timer = None
+        
+        self._load()
+        if self._file_stamp is None:
+            # Create the file with the defaults, as earlier versions did
+            self._changed.update(DEFAULT_CONFIG)
+            self._schedule_write()
+    
+    def _stat(self):
+        """Get the (mtime_ns, size) of the config file, or None if it doesn't exist"""
+        try:
+            stat = os.stat(self.config_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
     
-    try:
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
+    def _load(self):
+        """Read the config file, keeping the changes that weren't written yet"""
+        stamp = self._stat()
+        if stamp is None:
+            return
+        
+        try:
+            with open(self.config_file, 'r') as f:
+                config = json.load(f)
+        except Exception as e:
+            print(f"Error loading configuration: {e}")
+            return
+        
+        values = dict(DEFAULT_CONFIG)
+        values.update(config)
+        for key in self._changed:
+            if key in self._values:
+                values[key] = self._values[key]
+            else:
+                values.pop(key, None)
         
-        # Ensure all default keys are present
-        for key, value in DEFAULT_CONFIG.items():
-            if key not in config:
-                config[key] = value
+        self._values = values
+        self._file_stamp = stamp
+    
+    def _check_file(self):
+        """Reload the config file if it was changed by another program"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        
+        stamp = self._stat()
+        if stamp is not None and stamp != self._file_stamp:
+            self._load()
+    
+    def __getitem__(self, key):
+        with self._lock:
+            self._check_file()
+            return self._values[key]
+    
+    def __setitem__(self, key, value):
+        with self._lock:
+            if key in self._values and self._values[key] == value:
+                return
+            self._values[key] = value
+            self._changed.add(key)
+            self._schedule_write()
+    
+    def __delitem__(self, key):
+        with self._lock:
+            del self._values[key]
+            self._changed.add(key)
+            self._schedule_write()
+    
+    def __iter__(self):
+        with self._lock:
+            self._check_file()
+            return iter(list(self._values))
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._values)
+    
+    def as_dict(self):
+        """
+        Get a copy of all values
         
-        return config
-    except Exception as e:
-        print(f"Error loading configuration: {e}")
-        return DEFAULT_CONFIG.copy()
+        Returns:
+            dict: Configuration dictionary
+        """
+        with self._lock:
+            self._check_file()
+            return dict(self._values)
+    
+    def reload(self):
+        """Read the config file again, keeping the changes that weren't written yet"""
+        with self._lock:
+            self._load()
+    
+    def _schedule_write(self):
+        """Write the changes after the write delay, unless a write is already scheduled"""
+        if self._timer is None:
+            self._timer = threading.Timer(self.write_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def flush(self):
+        """Write pending changes to the config file now"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._changed:
+                return
+            
+            # Keep keys another program changed since the file was read
+            stamp = self._stat()
+            if stamp is not None and stamp != self._file_stamp:
+                self._load()
+            
+            directory = os.path.dirname(self.config_file)
+            temp_path = None
+            try:
+                os.makedirs(directory, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".config-", suffix=".tmp")
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self._values, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.config_file)
+                temp_path = None
+                
+                self._changed.clear()
+                self._file_stamp = self._stat()
+            except Exception as e:
+                print(f"Error saving configuration: {e}")
+            finally:
+                if temp_path is not None:
+                    try:
+                        os.unlink(temp_path)
+                    except OSError:
+                        pass
+
+_config = None
+_config_lock = threading.Lock()
+
+def get_config():
+    """
+    Get the process-wide configuration, loading it on first use
+    
+    Returns:
+        Config: The shared configuration
+    """
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = Config()
+                atexit.register(_config.flush)
+    return _config
+
+def load_config():
+    """
+    Get a copy of the configuration
+    
+    Returns:
+        dict: Configuration dictionary
+    """
+    return get_config().as_dict()
 
 def save_config(config):
     """
-    Save the configuration to the config file
+    Save configuration values; the file is written shortly after
     
     Args:
         config (dict): Configuration dictionary
     """
-    ensure_config_dir()
-    
-    try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=4)
-    except Exception as e:
-        print(f"Error saving configuration: {e}")
+    get_config().update(config)
 
 def get_config_value(key, default=None):
     """
@@ -76,8 +266,7 @@ def get_config_value(key, default=None):
     Returns:
         Configuration value
     """
-    config = load_config()
-    return config.get(key, default)
+    return get_config().get(key, default)
 
 def set_config_value(key, value):
     """
@@ -87,6 +276,4 @@ def set_config_value(key, value):
         key (str): Configuration key
         value: Configuration value
     """
-    config = load_config()
-    config[key] = value
-    save_config(config)
\ No newline at end of file
+    get_config()[key] = value
\ No newline at end of file
@@ -2,7 +2,13 @@
 File utility functions for the MP3 Tag Editor
 """
 import os
+import time
+import random
 from pathlib import Path
+from utils.instrumentation import get_metrics
+
+# Number of directories kept for each requested sample file when sampling
+STRATA_PER_SAMPLE = 8
 
 def get_music_folder():
     """
@@ -30,6 +36,63 @@ def get_music_folder():
     # If no music folder is found, return the home directory
     return home
 
+def iter_mp3_files(directory, recursive=True):
+    """
+    Iterate over the MP3 files in a directory
+    
+    Files are yielded while the directory tree is being walked. The file
+    type information returned by the directory listing is reused, so no
+    extra stat calls are made on most file systems. The time spent listing
+    each directory is recorded as the "scan.directory" stage, without the
+    time the caller spends between files.
+    
+    Args:
+        directory (str): Directory to search for MP3 files
+        recursive (bool): Whether to search recursively
+        
+    Yields:
+        str: Path to an MP3 file
+    """
+    metrics = get_metrics()
+    directories = [directory]
+    
+    while directories:
+        current = directories.pop()
+        subdirectories = []
+        files = 0
+        elapsed = 0.0
+        start = time.perf_counter()
+        
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            if entry.name.lower().endswith('.mp3'):
+                                files += 1
+                                elapsed += time.perf_counter() - start
+                                start = None  # Paused while the caller has the file
+                                yield entry.path
+                                start = time.perf_counter()
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Error reading directory {current}: {e}")
+            metrics.count("scan.errors")
+            continue
+        finally:
+            if start is not None:
+                elapsed += time.perf_counter() - start
+            metrics.record("scan.directory", elapsed, current)
+            metrics.count("scan.files", files)
+        
+        metrics.count("scan.directories")
+        
+        # Visit subdirectories in listing order
+        directories.extend(reversed(subdirectories))
+
 def get_mp3_files(directory, recursive=True):
     """
     Get all MP3 files in a directory
@@ -41,38 +104,112 @@ def get_mp3_files(directory, recursive=True):
     Returns:
         list: List of MP3 file paths
     """
-    mp3_files = []
-    
-    if recursive:
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.lower().endswith('.mp3'):
-                    mp3_files.append(os.path.join(root, file))
-    else:
-        for file in os.listdir(directory):
-            if file.lower().endswith('.mp3'):
-                mp3_files.append(os.path.join(directory, file))
-    
-    return mp3_files
+    return list(iter_mp3_files(directory, recursive))
 
-def get_sample_mp3_files(directory, max_files=10, recursive=True):
+def get_sample_mp3_files(directory, max_files=10, recursive=True, max_seconds=2.0,
+                         max_entries=200000, seed=None):
     """
     Get a sample of MP3 files from a directory
     
+    The tree is explored from randomly chosen directories instead of being
+    walked completely, and exploration stops when the time or entry budget
+    is used up or enough directories with MP3 files were found, so sampling
+    takes bounded time regardless of library size. The sample is spread
+    across folders by taking files from as many different directories as
+    possible.
+    
     Args:
         directory (str): Directory to search for MP3 files
         max_files (int): Maximum number of files to return
         recursive (bool): Whether to search recursively
+        max_seconds (float): Time budget for exploring the tree
+        max_entries (int): Maximum number of directory entries to read
+        seed: Optional random seed for reproducible samples
         
     Returns:
         list: List of MP3 file paths
     """
-    mp3_files = get_mp3_files(directory, recursive)
+    rng = random.Random(seed)
+    metrics = get_metrics()
+    start = time.perf_counter()
+    deadline = time.monotonic() + max_seconds
+    entries_read = 0
+    
+    # Directories still to explore; a random one is picked each time
+    frontier = [directory]
     
-    # Return a sample of files
-    if len(mp3_files) > max_files:
-        # Take a distributed sample
-        step = len(mp3_files) // max_files
-        return mp3_files[::step][:max_files]
+    # Per-directory samples; exploration stops early once there are enough
+    max_strata = max_files * STRATA_PER_SAMPLE
+    strata = []
+    
+    while (frontier and len(strata) < max_strata and entries_read < max_entries
+           and time.monotonic() < deadline):
+        index = rng.randrange(len(frontier))
+        frontier[index], frontier[-1] = frontier[-1], frontier[index]
+        current = frontier.pop()
+        
+        # Reservoir sample of the files in this directory
+        files = []
+        files_seen = 0
+        
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    entries_read += 1
+                    try:
+                        if entry.is_file():
+                            if entry.name.lower().endswith('.mp3'):
+                                files_seen += 1
+                                if len(files) < max_files:
+                                    files.append(entry.path)
+                                else:
+                                    slot = rng.randrange(files_seen)
+                                    if slot < max_files:
+                                        files[slot] = entry.path
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            frontier.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Error reading directory {current}: {e}")
+            continue
+        
+        if not files:
+            continue
+        
+        rng.shuffle(files)
+        strata.append(files)
+    
+    metrics.record("sample", time.perf_counter() - start)
+    metrics.count("sample.entries", entries_read)
+    
+    # Take files round-robin across directories for a representative spread
+    rng.shuffle(strata)
+    sample = []
+    for position in range(max_files):
+        for files in strata:
+            if position < len(files):
+                sample.append(files[position])
+                if len(sample) == max_files:
+                    return sample
+    
+    return sample
+
+def format_size(size):
+    """
+    Format a number of bytes for display
+    
+    Args:
+        size (int): Number of bytes
+        
+    Returns:
+        str: Human readable size, e.g. "1.5 MB"
+    """
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
     
-    return mp3_files
\ No newline at end of file
+    if unit == "bytes":
+        return f"{size} bytes"
+    return f"{size:.1f} {unit}"
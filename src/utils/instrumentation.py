@@ -0,0 +1,349 @@
+"""
+Instrumentation - Per-stage timings, counters and optional profiling
+"""
+import os
+import io
+import math
+import time
+import heapq
+import threading
+from contextlib import contextmanager
+from utils.config import CONFIG_DIR
+
+# Directory for profiler output
+PROFILE_DIR = os.path.join(CONFIG_DIR, "profiles")
+
+# Histogram buckets per doubling of the duration; 4 gives percentiles within ~19%
+BUCKETS_PER_OCTAVE = 4
+
+# Number of slowest files kept per stage
+SLOWEST_FILES = 10
+
+# Number of allocation sites written by the memory profiler
+TRACEMALLOC_TOP = 50
+
+class StageStats:
+    """Timings of one stage: totals, a log-scale histogram and the slowest files"""
+    
+    __slots__ = ("count", "total", "min", "max", "buckets", "slowest")
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = {}  # Bucket index -> number of durations
+        self.slowest = []  # Min-heap of (seconds, file_path)
+    
+    def add(self, seconds, file_path=None):
+        """Record one duration"""
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        
+        index = _bucket_index(seconds)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        
+        if file_path is not None:
+            if len(self.slowest) < SLOWEST_FILES:
+                heapq.heappush(self.slowest, (seconds, file_path))
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (seconds, file_path))
+    
+    def percentile(self, fraction):
+        """
+        Estimate a percentile from the histogram
+        
+        Args:
+            fraction: Percentile as a fraction, e.g. 0.95
+        
+        Returns:
+            float: Duration in seconds
+        """
+        if not self.count:
+            return 0.0
+        
+        target = fraction * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return min(max(_bucket_upper_bound(index), self.min), self.max)
+        return self.max
+    
+    def to_dict(self):
+        """Get the raw data, so it can be sent between processes and merged"""
+        return {"count": self.count, "total": self.total,
+                "min": self.min if self.count else 0.0, "max": self.max,
+                "buckets": self.buckets, "slowest": self.slowest}
+    
+    def merge(self, data):
+        """Add the raw data of another StageStats"""
+        if not data["count"]:
+            return
+        
+        self.count += data["count"]
+        self.total += data["total"]
+        self.min = min(self.min, data["min"])
+        self.max = max(self.max, data["max"])
+        for index, count in data["buckets"].items():
+            index = int(index)  # Keys become strings in JSON
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        
+        self.slowest = heapq.nlargest(SLOWEST_FILES, self.slowest + [tuple(item) for item in data["slowest"]])
+        heapq.heapify(self.slowest)
+
+def _bucket_index(seconds):
+    """Get the histogram bucket of a duration; bucket 0 holds everything up to 1 µs"""
+    microseconds = seconds * 1e6
+    if microseconds <= 1:
+        return 0
+    return int(math.log2(microseconds) * BUCKETS_PER_OCTAVE)
+
+def _bucket_upper_bound(index):
+    """Get the largest duration in seconds of a histogram bucket"""
+    return 2 ** ((index + 1) / BUCKETS_PER_OCTAVE) / 1e6
+
+class _StageTimer:
+    """Context manager that records the time spent in a stage"""
+    
+    __slots__ = ("instrumentation", "name", "file_path", "start")
+    
+    def __init__(self, instrumentation, name, file_path):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.file_path = file_path
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.record(self.name, time.perf_counter() - self.start, self.file_path)
+        return False
+
+class _NullTimer:
+    """Context manager used while instrumentation is disabled"""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class Instrumentation:
+    """
+    Collects per-stage timings and counters
+    
+    Stages are timed with the stage() context manager or record(). Each
+    stage keeps a log-scale histogram, so percentiles cost constant memory
+    however many files are processed, and the raw data of several processes
+    can be merged. Recording is thread-safe, as files are saved from several
+    threads.
+    """
+    
+    def __init__(self, enabled=True):
+        """
+        Args:
+            enabled: Whether timings and counters are recorded
+        """
+        self.enabled = enabled
+        self.stages = {}  # Stage name -> StageStats
+        self.counters = {}
+        self._lock = threading.Lock()
+    
+    def stage(self, name, file_path=None):
+        """
+        Time a stage
+        
+        Args:
+            name: Stage name, e.g. "parse"
+            file_path: File being handled, tracked among the slowest files
+        
+        Returns:
+            A context manager that records the time spent inside it
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, name, file_path)
+    
+    def record(self, name, seconds, file_path=None):
+        """
+        Record the duration of a stage
+        
+        Args:
+            name: Stage name
+            seconds: Duration in seconds
+            file_path: File being handled, tracked among the slowest files
+        """
+        if not self.enabled:
+            return
+        
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.add(seconds, file_path)
+    
+    def count(self, name, amount=1):
+        """
+        Increase a counter
+        
+        Args:
+            name: Counter name, e.g. "scan.files"
+            amount: Amount to add
+        """
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def reset(self):
+        """Forget all timings and counters"""
+        self.stages = {}
+        self.counters = {}
+    
+    def snapshot(self):
+        """
+        Get the raw data, e.g. to send it from a worker process
+        
+        Returns:
+            dict: Data that can be passed to merge()
+        """
+        return {"stages": {name: stats.to_dict() for name, stats in self.stages.items()},
+                "counters": dict(self.counters)}
+    
+    def merge(self, snapshot):
+        """
+        Add the data of another Instrumentation
+        
+        Args:
+            snapshot: Result of snapshot()
+        """
+        with self._lock:
+            for name, data in snapshot["stages"].items():
+                stats = self.stages.get(name)
+                if stats is None:
+                    stats = self.stages[name] = StageStats()
+                stats.merge(data)
+            
+            for name, amount in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def report(self):
+        """
+        Summarize the timings
+        
+        Returns:
+            dict: Per stage the count, total seconds, mean, p50, p95, p99 and
+                maximum in milliseconds and the slowest files, plus the
+                counters
+        """
+        stages = {}
+        for name, stats in sorted(self.stages.items()):
+            stages[name] = {
+                "count": stats.count,
+                "total_s": round(stats.total, 6),
+                "mean_ms": round(stats.total / stats.count * 1000, 3) if stats.count else 0.0,
+                "p50_ms": round(stats.percentile(0.50) * 1000, 3),
+                "p95_ms": round(stats.percentile(0.95) * 1000, 3),
+                "p99_ms": round(stats.percentile(0.99) * 1000, 3),
+                "max_ms": round(stats.max * 1000, 3),
+                "slowest": [{"path": file_path, "ms": round(seconds * 1000, 3)}
+                            for seconds, file_path in sorted(stats.slowest, reverse=True)],
+            }
+        return {"stages": stages, "counters": dict(sorted(self.counters.items()))}
+    
+    def summary(self, limit=4):
+        """
+        Get a one-line summary of the stages that took the most time
+        
+        Args:
+            limit: Maximum number of stages listed
+        
+        Returns:
+            str: Summary, e.g. "parse 1.2s (p95 3.1 ms), read 0.8s (p95 1.0 ms)"
+        """
+        stages = sorted(self.stages.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+        return ", ".join(f"{name} {stats.total:.2f}s (p95 {stats.percentile(0.95) * 1000:.1f} ms)"
+                         for name, stats in stages)
+
+# Instrumentation shared by the tag processor and the file utilities of this process
+_metrics = Instrumentation()
+
+def get_metrics():
+    """
+    Get the process-wide instrumentation
+    
+    Returns:
+        Instrumentation: The shared instance
+    """
+    return _metrics
+
+@contextmanager
+def profiling(cpu=False, memory=False, label="run", output_dir=PROFILE_DIR):
+    """
+    Profile the code run inside the block
+    
+    The cProfile data is saved as <label>-<time>.prof (readable with pstats
+    or snakeviz) and the largest allocation sites as <label>-<time>.memory.txt.
+    cProfile only sees the calling thread; worker processes aren't profiled.
+    
+    Args:
+        cpu: Profile function calls with cProfile
+        memory: Trace memory allocations with tracemalloc
+        label: Prefix of the output files
+        output_dir: Directory for the output files
+    
+    Yields:
+        list: Paths of the written files, filled in when the block exits
+    """
+    written = []
+    if not cpu and not memory:
+        yield written
+        return
+    
+    profiler = None
+    if cpu:
+        import cProfile
+        profiler = cProfile.Profile()
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+    
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield written
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        
+        snapshot = None
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            base = os.path.join(output_dir, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}")
+            
+            if profiler is not None:
+                profiler.dump_stats(base + ".prof")
+                written.append(base + ".prof")
+            
+            if snapshot is not None:
+                lines = io.StringIO()
+                lines.write(f"Current: {current / 1e6:.1f} MB, peak: {peak / 1e6:.1f} MB\n\n")
+                for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+                    lines.write(f"{stat}\n")
+                with open(base + ".memory.txt", 'w', encoding='utf-8') as f:
+                    f.write(lines.getvalue())
+                written.append(base + ".memory.txt")
+        except Exception as e:
+            print(f"Error saving profile: {e}")
@@ -0,0 +1,130 @@
+"""
+Startup profile - Measures how long each module takes to import
+"""
+import sys
+import time
+import threading
+from importlib.abc import MetaPathFinder
+
+# Number of modules listed in the report
+REPORT_LIMIT = 25
+
+class _TimedLoader:
+    """Loader wrapper that times creating and executing a module"""
+    
+    def __init__(self, loader, timer, name):
+        self._loader = loader
+        self._timer = timer
+        self._name = name
+    
+    def create_module(self, spec):
+        # Extension modules do their work, including their own imports, here
+        self._timer.enter(self._name)
+        try:
+            return self._loader.create_module(spec)
+        finally:
+            self._timer.leave(self._name)
+    
+    def exec_module(self, module):
+        # Keep the real loader visible to code that inspects __loader__
+        module.__loader__ = self._loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self._loader
+        
+        self._timer.enter(self._name)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer.leave(self._name)
+    
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+class ImportTimer(MetaPathFinder):
+    """
+    Import hook recording the time spent importing each module
+    
+    The first entry of sys.meta_path finds modules through the other
+    finders and wraps their loaders. Times are inclusive (cumulative) and
+    exclusive (self) of the modules imported while a module runs, like
+    python -X importtime, and only modules imported after install() count.
+    """
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.cumulative = {}  # Module name -> seconds including nested imports
+        self.self_time = {}  # Module name -> seconds excluding nested imports
+        self._stack = []  # [name, start, nested seconds] of the modules being executed
+        self._local = threading.local()
+    
+    @classmethod
+    def install(cls):
+        """
+        Start timing imports
+        
+        Returns:
+            ImportTimer: The installed timer
+        """
+        timer = cls()
+        sys.meta_path.insert(0, timer)
+        return timer
+    
+    def uninstall(self):
+        """Stop timing imports"""
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+    
+    def find_spec(self, fullname, path=None, target=None):
+        # Only time imports of the main thread; other threads see the plain loaders
+        if threading.current_thread() is not threading.main_thread() or getattr(self._local, "busy", False):
+            return None
+        
+        self._local.busy = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.busy = False
+        
+        if spec.loader is None or not hasattr(spec.loader, "exec_module"):
+            return spec
+        spec.loader = _TimedLoader(spec.loader, self, fullname)
+        return spec
+    
+    def enter(self, name):
+        """Note that a module starts being created or executed"""
+        self._stack.append([name, time.perf_counter(), 0.0])
+    
+    def leave(self, name):
+        """Note that a module was created or executed"""
+        name, start, nested = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.cumulative[name] = self.cumulative.get(name, 0.0) + elapsed
+        self.self_time[name] = self.self_time.get(name, 0.0) + elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+    
+    def report(self, label="startup", limit=REPORT_LIMIT, stream=None):
+        """
+        Print the import times, slowest modules first
+        
+        Args:
+            label: What the elapsed time measures, e.g. "window shown"
+            limit: Maximum number of modules listed
+            stream: Stream to print to (defaults to stderr)
+        """
+        stream = stream or sys.stderr
+        elapsed = time.perf_counter() - self.start
+        imports = sum(self.self_time.values())
+        
+        print(f"{label}: {elapsed * 1000:.1f} ms, of which {imports * 1000:.1f} ms importing "
+              f"{len(self.cumulative)} modules", file=stream)
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module", file=stream)
+        for name in sorted(self.cumulative, key=self.cumulative.get, reverse=True)[:limit]:
+            print(f"{self.cumulative[name] * 1000:14.1f} {self.self_time[name] * 1000:9.1f}  {name}", file=stream)